@@ -0,0 +1,231 @@
+"""
+asyncio-Laufzeit für das Frostwarnsystem
+
+Der Knoten läuft in einem asyncio-Eventloop im Hauptthread statt in einem
+Thread je Aufgabe (paho loop_start, Sensor-Thread, Link-Monitor, lokale API,
+30-s-Hauptschleife). Threads bleiben nur, wo wirklich blockiert wird:
+Sensor-I/O und Reconnects im Executor, Uplink-Worker und RPC-Executor.
+
+MQTTDriver treibt paho über dessen Socket-Callbacks:
+
+- on_socket_open/close: Socket beim Loop an- bzw. abmelden (loop_read()
+  nur, wenn der Socket lesbar ist),
+- on_socket_register_write/unregister_write: loop_write() nur, solange paho
+  etwas zu senden hat,
+- loop_misc() (Keepalive/PINGREQ) alle keepalive/4 Sekunden statt paho's
+  Sekundentakt,
+- Reconnect mit Backoff (wie paho: reconnect_min bis reconnect_max) im
+  Executor, da connect() blockiert (DNS, TCP, TLS); reconnect_now()
+  verkürzt die Wartezeit, z.B. wenn ppp0 wieder oben ist.
+- reconnect(configure): DISCONNECT, neue Verbindungsparameter setzen und
+  sofort neu verbinden (geänderter Broker nach einem Konfigurations-Reload).
+
+Die Callbacks kommen auch aus anderen Threads (publish() im Uplink-Worker,
+reconnect() im Executor); sie werden per call_soon_threadsafe in den Loop
+übergeben.
+"""
+
+import asyncio
+import logging
+import threading
+
+
+class MQTTDriver:
+    """Betreibt einen paho-Client im asyncio-Loop (siehe Moduldokumentation)"""
+
+    def __init__(self, client, loop, keepalive=60, reconnect_min=1.0, reconnect_max=120.0):
+        self.client = client
+        self.loop = loop
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.set_keepalive(keepalive)
+        self._loop_thread = threading.get_ident()
+        self._fd = None  # Registered socket (file descriptor), None while disconnected
+        self._sock = None
+        self._writing = False
+        self._misc_handle = None
+        self._delay = reconnect_min
+        self._stopping = False
+        self._closed = asyncio.Event()
+        self._reconnect_now = asyncio.Event()
+        self.counts = {"reads": 0, "writes": 0, "misc": 0, "connects": 0, "connect_failures": 0}
+
+    def set_keepalive(self, keepalive):
+        # PINGREQ goes out at most a quarter keepalive late, well within the broker's 1.5x grace
+        self.misc_interval = max(1.0, keepalive / 4)
+
+    def attach(self):
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    # --- paho socket callbacks (any thread) ---
+
+    def _call(self, func, *args):
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self._opened, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self._socket_closed, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self._sync_writer)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self._sync_writer)
+
+    def wake_writer(self):
+        """Nach publish() aus einem anderen Thread: Schreibbereitschaft neu prüfen (threadsicher)"""
+        self._call(self._sync_writer)
+
+    def reconnect_now(self):
+        """Wartenden Reconnect sofort ausführen (threadsicher)"""
+        self._call(self._reconnect_now.set)
+
+    # --- loop side ---
+
+    def _opened(self, sock):
+        if self._fd is not None:
+            self._unregister()
+        self._sock = sock
+        self._fd = sock.fileno()
+        self._closed.clear()
+        self.loop.add_reader(self._fd, self._on_readable)
+        self._schedule_misc()
+        self._sync_writer()
+
+    def _socket_closed(self, sock):
+        if self._sock is not sock:
+            return
+        self._unregister()
+        self._closed.set()
+
+    def _unregister(self):
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+            self.loop.remove_writer(self._fd)
+        if self._misc_handle is not None:
+            self._misc_handle.cancel()
+            self._misc_handle = None
+        self._fd = None
+        self._sock = None
+        self._writing = False
+
+    def _sync_writer(self):
+        if self._fd is None:
+            return
+        want = self.client.want_write()
+        if want and not self._writing:
+            self.loop.add_writer(self._fd, self._on_writable)
+            self._writing = True
+        elif not want and self._writing:
+            self.loop.remove_writer(self._fd)
+            self._writing = False
+
+    def _on_readable(self):
+        self.counts["reads"] += 1
+        self.client.loop_read()
+        sock = self._sock
+        # TLS: records already decrypted by ssl are not visible to select()
+        while sock is not None and sock is self._sock and getattr(sock, "pending", None) and sock.pending():
+            self.client.loop_read()
+        if self._delay != self.reconnect_min and self.client.is_connected():
+            self._delay = self.reconnect_min  # CONNACK received, backoff starts over
+        self._sync_writer()
+
+    def _on_writable(self):
+        self.counts["writes"] += 1
+        self.client.loop_write()
+        self._sync_writer()
+
+    def _schedule_misc(self):
+        self._misc_handle = self.loop.call_later(self.misc_interval, self._misc)
+
+    def _misc(self):
+        self._misc_handle = None
+        if self._fd is None:
+            return
+        self.counts["misc"] += 1
+        self.client.loop_misc()
+        if self._fd is not None:
+            self._schedule_misc()
+            self._sync_writer()
+
+    # --- connection task ---
+
+    async def run(self):
+        """Verbindung herstellen und halten, bis stop() aufgerufen wird"""
+        while not self._stopping:
+            if self._fd is None:
+                if not await self._connect():
+                    await self._backoff()
+                    continue
+            await self._closed.wait()
+            if not self._stopping:
+                await self._backoff()
+
+    async def _connect(self):
+        self._closed.clear()
+        try:
+            rc = await self.loop.run_in_executor(None, self.client.reconnect)
+        except Exception as e:
+            self.counts["connect_failures"] += 1
+            logging.warning(f"MQTT Verbindungsaufbau fehlgeschlagen: {e} (nächster Versuch in {self._delay:.0f}s)")
+            return False
+        if rc != 0:
+            self.counts["connect_failures"] += 1
+            logging.warning(f"MQTT Verbindungsaufbau fehlgeschlagen (rc={rc}), nächster Versuch in {self._delay:.0f}s")
+            return False
+        self.counts["connects"] += 1
+        return True
+
+    async def _backoff(self):
+        """Bis zum nächsten Verbindungsversuch warten (abbrechbar durch reconnect_now() und stop())"""
+        delay = self._delay
+        self._delay = min(self._delay * 2, self.reconnect_max)
+        if self._reconnect_now.is_set():
+            self._reconnect_now.clear()
+            return
+        try:
+            await asyncio.wait_for(self._reconnect_now.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        self._reconnect_now.clear()
+
+    async def reconnect(self, configure=None, timeout=5.0):
+        """Sauber trennen, configure() aufrufen (z.B. connect_async mit neuem Broker), sofort neu verbinden"""
+        if self._fd is not None:
+            self.client.disconnect()
+            self._sync_writer()
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning("MQTT DISCONNECT nicht rechtzeitig gesendet, verbinde trotzdem neu.")
+        # run() now waits in _backoff(); the new parameters are in place before it connects
+        if configure is not None:
+            configure()
+        self._delay = self.reconnect_min
+        self._reconnect_now.set()
+
+    async def stop(self, timeout=5.0):
+        """DISCONNECT nach allen bereits übergebenen Paketen senden und auf das Schließen warten"""
+        self._stopping = True
+        self._reconnect_now.set()
+        if self._fd is not None:
+            self.client.disconnect()
+            self._sync_writer()
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning("MQTT DISCONNECT nicht rechtzeitig gesendet, schließe Socket.")
+        self._unregister()
+
+    def stats(self):
+        return {**self.counts, "connected": self._fd is not None, "misc_interval_s": self.misc_interval,
+                "reconnect_delay_s": self._delay}
@@ -0,0 +1,271 @@
+"""
+GPRS-Datenbudget für das Frostwarnsystem
+
+DataBudget zählt den Verbrauch im laufenden Abrechnungsmonat:
+
+- je Verkehrsklasse auf MQTT-Ebene (record() aus mqtt_publish, inkl.
+  PUBACK und geschätzter TCP/IP-Header),
+- geschätzte Grundlast, die nicht über das Skript läuft (MQTT-Keepalive,
+  Ping des SIM800L-Watchdogs, ServerAlive des autossh-Tunnels),
+- den tatsächlichen Verbrauch aus /proc/net/dev für ppp0. Die Differenz zu
+  den gezählten Klassen erscheint als "unattributed" (TLS, TCP-ACKs, DNS,
+  SSH-Sitzungen, ...).
+
+Für den Monatsverbrauch zählt ppp0, sofern vorhanden, sonst die Summe der
+Klassen. level() leitet daraus eine Sparstufe ab (0 = normal bis 3 =
+kritisch), die das Hauptskript in Verhalten übersetzt (Heartbeat, Batches,
+Kompression, Messintervall außerhalb des Frostbereichs). projection()
+liefert Restbudget und Hochrechnung auf das Monatsende.
+"""
+
+import calendar
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+TCP_IP_HEADER_BYTES = 40  # IPv4 + TCP without options, per packet
+
+# Estimated background traffic per event (bytes on ppp0 incl. IP headers)
+MQTT_PINGREQ_BYTES = 2 * (2 + TCP_IP_HEADER_BYTES) + TCP_IP_HEADER_BYTES  # PINGREQ, PINGRESP, ACK
+WATCHDOG_PING_BYTES = 2 * 84  # ICMP echo request + reply, 56 byte payload (sim800l_watchdog.py)
+SSH_KEEPALIVE_BYTES = 2 * (100 + TCP_IP_HEADER_BYTES) + TCP_IP_HEADER_BYTES  # ServerAlive request/reply + ACK
+
+TRAFFIC_CLASSES = ("sensor", "backlog", "status", "metrics", "alert", "other_mqtt")
+ESTIMATED_CLASSES = ("mqtt_keepalive", "watchdog_ping", "ssh_keepalive")
+
+# Budget levels: (name, projected/budget above, remaining share below)
+LEVELS = (
+    ("normal", None, None),
+    ("sparen", 1.0, 0.25),
+    ("knapp", 1.25, 0.10),
+    ("kritisch", None, 0.03),
+)
+
+
+def read_interface_bytes(interface, path="/proc/net/dev"):
+    """(rx_bytes, tx_bytes) eines Interfaces aus /proc/net/dev, None wenn es fehlt"""
+    try:
+        with open(path) as f:
+            for line in f:
+                name, sep, rest = line.partition(":")
+                if sep and name.strip() == interface:
+                    fields = rest.split()
+                    return int(fields[0]), int(fields[8])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def read_ifindex(interface, sysfs_root="/sys/class/net"):
+    try:
+        with open(os.path.join(sysfs_root, interface, "ifindex")) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def period_bounds(now, reset_day):
+    """Beginn und Ende des Abrechnungszeitraums (lokale Zeit), der now enthält"""
+    def start_of(year, month):
+        day = min(reset_day, calendar.monthrange(year, month)[1])
+        return datetime(year, month, day)
+
+    start = start_of(now.year, now.month)
+    if now < start:
+        year, month = (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+        start = start_of(year, month)
+    year, month = (start.year, start.month + 1) if start.month < 12 else (start.year + 1, 1)
+    return start, start_of(year, month)
+
+
+class DataBudget:
+    """
+    Verbrauchszähler und Sparstufe (siehe Moduldokumentation). record() ist
+    threadsicher; sample() und save() laufen periodisch aus der Hauptschleife.
+    """
+
+    def __init__(self, monthly_bytes=0, reset_day=1, interface="ppp0", state_file=None,
+                 watchdog_interval=120, ssh_keepalive_interval=60):
+        self.monthly_bytes = monthly_bytes
+        self.reset_day = reset_day
+        self.interface = interface
+        self.state_file = state_file
+        self.watchdog_interval = watchdog_interval
+        self.ssh_keepalive_interval = ssh_keepalive_interval
+        self.keepalive = 60
+        self._lock = threading.Lock()
+        self._reset_period(period_bounds(datetime.now(), reset_day)[0])
+        self._last_counters = None  # (ifindex, rx, tx) at the last sample
+        self._last_sample = None  # monotonic
+        self._mqtt_connected = False
+
+    def _reset_period(self, start):
+        self.period_start = start
+        self.classes = {name: 0 for name in TRAFFIC_CLASSES + ESTIMATED_CLASSES}
+        self.interface_rx = 0
+        self.interface_tx = 0
+
+    def _check_period_locked(self, now=None):
+        start, _ = period_bounds(now or datetime.now(), self.reset_day)
+        if start != self.period_start:
+            logging.info(f"Neuer Abrechnungszeitraum ab {start:%Y-%m-%d}, Datenbudget zurückgesetzt.")
+            self._reset_period(start)
+
+    # --- counting ---
+
+    def record(self, traffic_class, nbytes, packets=1):
+        """Gesendete/bestätigte MQTT-Nachricht: Nutzbytes plus TCP/IP-Header je Paket"""
+        if traffic_class not in self.classes:
+            traffic_class = "other_mqtt"
+        with self._lock:
+            self.classes[traffic_class] += nbytes + packets * TCP_IP_HEADER_BYTES
+
+    def set_connected(self, connected):
+        """MQTT verbunden/getrennt - Keepalives fallen nur bei bestehender Verbindung an"""
+        self._mqtt_connected = connected
+
+    def sample(self):
+        """Periodisch aufrufen: ppp0-Zähler übernehmen und Grundlast schätzen"""
+        now = time.monotonic()
+        counters = read_interface_bytes(self.interface) if self.interface else None
+        ifindex = read_ifindex(self.interface) if counters is not None else None
+        with self._lock:
+            self._check_period_locked()
+            if self._last_sample is not None:
+                elapsed = now - self._last_sample
+                if self._mqtt_connected and self.keepalive:
+                    self.classes["mqtt_keepalive"] += int(elapsed / self.keepalive * MQTT_PINGREQ_BYTES)
+                if counters is not None:
+                    # Background traffic of other services only exists while the link is up
+                    if self.watchdog_interval:
+                        self.classes["watchdog_ping"] += int(elapsed / self.watchdog_interval * WATCHDOG_PING_BYTES)
+                    if self.ssh_keepalive_interval:
+                        self.classes["ssh_keepalive"] += int(elapsed / self.ssh_keepalive_interval * SSH_KEEPALIVE_BYTES)
+            self._last_sample = now
+            if counters is None:
+                self._last_counters = None  # ppp0 gone: the next one starts counting at zero
+                return
+            rx, tx = counters
+            last = self._last_counters
+            if last is not None and last[0] == ifindex and rx >= last[1] and tx >= last[2]:
+                self.interface_rx += rx - last[1]
+                self.interface_tx += tx - last[2]
+            else:
+                # New ppp0 (after a redial) or first sample after start of a fresh state
+                self.interface_rx += rx
+                self.interface_tx += tx
+            self._last_counters = (ifindex, rx, tx)
+
+    # --- evaluation ---
+
+    def used(self):
+        with self._lock:
+            interface_total = self.interface_rx + self.interface_tx
+            return interface_total if interface_total else sum(self.classes.values())
+
+    def projection(self, now=None):
+        now = now or datetime.now()
+        with self._lock:
+            self._check_period_locked(now)
+            start = self.period_start
+        _, end = period_bounds(now, self.reset_day)
+        used = self.used()
+        period_s = (end - start).total_seconds()
+        # At least one day, otherwise the first hours of a month extrapolate wildly
+        elapsed_s = max(86400.0, (now - start).total_seconds())
+        projected = int(used * period_s / min(period_s, elapsed_s))
+        remaining = self.monthly_bytes - used if self.monthly_bytes else None
+        days_left = max(0.0, (end - now).total_seconds() / 86400)
+        return {
+            "period_start": start.isoformat(),
+            "period_end": end.isoformat(),
+            "budget_bytes": self.monthly_bytes,
+            "used_bytes": used,
+            "remaining_bytes": remaining,
+            "projected_bytes": projected,
+            "daily_allowance_bytes": int(remaining / days_left) if remaining is not None and days_left > 0 else None,
+            "days_left": round(days_left, 1),
+        }
+
+    def level(self, projection=None):
+        """Sparstufe 0-3 aus Hochrechnung und Restbudget (0 ohne Budget)"""
+        if not self.monthly_bytes:
+            return 0
+        p = projection or self.projection()
+        ratio = p["projected_bytes"] / self.monthly_bytes
+        remaining_share = max(0.0, p["remaining_bytes"] / self.monthly_bytes)
+        level = 0
+        for index, (_, ratio_above, remaining_below) in enumerate(LEVELS):
+            if index == 0:
+                continue
+            if (ratio_above is not None and ratio > ratio_above) or \
+                    (remaining_below is not None and remaining_share < remaining_below):
+                level = index
+        return level
+
+    def stats(self):
+        p = self.projection()
+        level = self.level(p)
+        with self._lock:
+            classes = dict(self.classes)
+            interface = {"rx": self.interface_rx, "tx": self.interface_tx}
+        counted = sum(classes.values())
+        interface_total = interface["rx"] + interface["tx"]
+        return {
+            **p,
+            "level": level,
+            "level_name": LEVELS[level][0],
+            "classes": classes,
+            "interface": interface,
+            "unattributed_bytes": max(0, interface_total - counted) if interface_total else None,
+        }
+
+    # --- persistence ---
+
+    def load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return False
+        try:
+            with open(self.state_file) as f:
+                data = json.load(f)
+            start = datetime.fromisoformat(data["period_start"])
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Datenbudget {self.state_file} nicht lesbar: {e}")
+            return False
+        with self._lock:
+            if start != self.period_start:
+                return False  # state from an earlier period
+            for name, value in data.get("classes", {}).items():
+                if name in self.classes:
+                    self.classes[name] = int(value)
+            self.interface_rx = int(data.get("interface_rx", 0))
+            self.interface_tx = int(data.get("interface_tx", 0))
+            last = data.get("last_counters")
+            # Same ppp0 as before the restart: continue from its counters instead of counting them twice
+            if last and read_ifindex(self.interface) == last[0]:
+                self._last_counters = tuple(last)
+        logging.info(f"Datenbudget geladen: {self.used() / 1e6:.2f} MB seit {self.period_start:%Y-%m-%d}.")
+        return True
+
+    def save(self):
+        if not self.state_file:
+            return
+        with self._lock:
+            data = {
+                "period_start": self.period_start.isoformat(),
+                "classes": self.classes,
+                "interface_rx": self.interface_rx,
+                "interface_tx": self.interface_tx,
+                "last_counters": self._last_counters,
+                "saved": time.time(),
+            }
+            tmp = self.state_file + ".tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.state_file)
+            except OSError as e:
+                logging.warning(f"Datenbudget {self.state_file} konnte nicht gespeichert werden: {e}")
@@ -0,0 +1,169 @@
+"""
+Nutzlast-Formate für das Frostwarnsystem
+
+Batch-Envelope (Pufferabbau nach Verbindungsausfall):
+    Viele Messwerte in einer komprimierten MQTT-Nachricht.
+
+    Byte 0-2  Magic b"FWE"
+    Byte 3    Schema-Version (1)
+    Rest      zlib( JSON {"keys": [...], "rows": [[...], ...]} )
+
+    Die Schlüssel stehen nur einmal im Kopf, jede Zeile enthält die Werte in
+    derselben Reihenfolge (fehlende Werte = null). Der passende Decoder für
+    den Server steckt im Node-RED-Flow ("Decode Batch Envelope") und in
+    decode_envelope() unten.
+
+Binärformat für Live-Messwerte (mqtt_payload_format = "binary"):
+    Ein Messwert in ca. 40 statt ~500 Bytes.
+
+    Byte 0    Marker 0xF7
+    Byte 1    Schema-Version (1)
+    Byte 2-5  Zeitstempel, Epoch-Sekunden (uint32, big endian)
+    Byte 6-7  Bitmap der vorhandenen Felder (Bit i = BINARY_FIELDS[i])
+    Rest      Vorhandene Felder in Schema-Reihenfolge als Festkomma-Ganzzahlen
+
+    device_id steht im Topic, uptime_str wird aus uptime_seconds abgeleitet.
+    Werte außerhalb des Wertebereichs eines Feldes gelten als nicht vorhanden.
+"""
+
+import json
+import socket
+import struct
+import zlib
+from datetime import datetime, timezone
+
+ENVELOPE_MAGIC = b"FWE"
+ENVELOPE_VERSION = 1
+
+
+BINARY_MARKER = 0xF7
+BINARY_VERSION = 1
+
+# (Feldname, struct-Format, Skalierungsfaktor) - Reihenfolge = Bit-Position, nur anhängen!
+BINARY_FIELDS = (
+    ("dry_temp", "h", 100),
+    ("wet_temp", "h", 100),
+    ("humidity", "H", 10),
+    ("calc_wet_temp", "h", 100),
+    ("effective_wet_temp", "h", 100),
+    ("battery_percent", "B", 1),
+    ("battery_voltage", "H", 1000),
+    ("dcdc_voltage", "H", 1000),
+    ("cpu_percent", "H", 10),
+    ("memory_percent", "H", 10),
+    ("disk_percent", "H", 10),
+    ("uptime_seconds", "I", 1),
+    ("ip_address", "4s", None),
+    ("seq", "I", 1),
+    ("boot", "H", 1),
+)
+_BINARY_HEADER = struct.Struct(">BBIH")
+_INT_RANGES = {"h": (-32768, 32767), "H": (0, 65535), "B": (0, 255), "I": (0, 2**32 - 1)}
+
+
+class PayloadFormatError(ValueError):
+    """Nutzlast hat ein unbekanntes oder beschädigtes Format"""
+
+
+def encode_envelope(readings, level=6):
+    """Packt eine Liste von Messwert-Dicts in ein komprimiertes Envelope (bytes)"""
+    keys = []
+    seen = set()
+    for reading in readings:
+        for key in reading:
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+    rows = [[reading.get(key) for key in keys] for reading in readings]
+    body = json.dumps({"keys": keys, "rows": rows}, separators=(",", ":")).encode("utf-8")
+    return ENVELOPE_MAGIC + bytes([ENVELOPE_VERSION]) + zlib.compress(body, level)
+
+
+def is_envelope(data):
+    return isinstance(data, (bytes, bytearray)) and data[:3] == ENVELOPE_MAGIC
+
+
+def decode_envelope(data):
+    """Entpackt ein Envelope wieder in eine Liste von Messwert-Dicts"""
+    if not is_envelope(data):
+        raise PayloadFormatError("Kein Batch-Envelope (Magic fehlt)")
+    version = data[3]
+    if version != ENVELOPE_VERSION:
+        raise PayloadFormatError(f"Nicht unterstützte Envelope-Version: {version}")
+    try:
+        body = json.loads(zlib.decompress(data[4:]))
+    except (zlib.error, ValueError) as e:
+        raise PayloadFormatError(f"Envelope beschädigt: {e}")
+    keys = body["keys"]
+    return [{k: v for k, v in zip(keys, row) if v is not None} for row in body["rows"]]
+
+
+def _timestamp_to_epoch(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp())
+
+
+def encode_binary_reading(reading):
+    """Kodiert einen Messwert (dict oder frost_reading.Reading) im kompakten Binärformat (bytes)"""
+    bitmap = 0
+    fmt = ">"
+    values = []
+    for bit, (name, code, scale) in enumerate(BINARY_FIELDS):
+        value = reading.get(name)
+        if value is None:
+            continue
+        if scale is None:  # IPv4-Adresse
+            try:
+                packed = socket.inet_aton(value)
+            except (OSError, TypeError):
+                continue
+            values.append(packed)
+        else:
+            try:
+                scaled = int(round(float(value) * scale))
+            except (TypeError, ValueError):
+                continue
+            low, high = _INT_RANGES[code]
+            if not low <= scaled <= high:
+                continue
+            values.append(scaled)
+        bitmap |= 1 << bit
+        fmt += code
+    epoch = getattr(reading, "epoch", None)  # frost_reading.Reading: no ISO string round trip
+    timestamp = int(epoch) if epoch is not None else _timestamp_to_epoch(reading["timestamp"])
+    return _BINARY_HEADER.pack(BINARY_MARKER, BINARY_VERSION, timestamp, bitmap) + struct.pack(fmt, *values)
+
+
+def is_binary_reading(data):
+    return isinstance(data, (bytes, bytearray)) and len(data) >= _BINARY_HEADER.size and data[0] == BINARY_MARKER
+
+
+def decode_binary_reading(data, device_id=None):
+    """Dekodiert das Binärformat wieder in einen Messwert-Dict (wie update_sensor_data())"""
+    if not is_binary_reading(data):
+        raise PayloadFormatError("Kein binärer Messwert (Marker fehlt)")
+    _, version, timestamp, bitmap = _BINARY_HEADER.unpack_from(data)
+    if version != BINARY_VERSION:
+        raise PayloadFormatError(f"Nicht unterstützte Binär-Version: {version}")
+    fields = [(name, code, scale) for bit, (name, code, scale) in enumerate(BINARY_FIELDS) if bitmap & (1 << bit)]
+    fmt = ">" + "".join(code for _, code, _ in fields)
+    try:
+        values = struct.unpack_from(fmt, data, _BINARY_HEADER.size)
+    except struct.error as e:
+        raise PayloadFormatError(f"Binärer Messwert beschädigt: {e}")
+
+    reading = {"timestamp": datetime.fromtimestamp(timestamp, timezone.utc).isoformat()}
+    if device_id:
+        reading["device_id"] = device_id
+    for (name, code, scale), value in zip(fields, values):
+        if scale is None:
+            reading[name] = socket.inet_ntoa(value)
+        elif scale == 1:
+            reading[name] = value
+        else:
+            reading[name] = value / scale
+    if "uptime_seconds" in reading:
+        up = reading["uptime_seconds"]
+        reading["uptime_str"] = f"{up // 86400}d {(up % 86400) // 3600}h {(up % 3600) // 60}m"
+    return reading
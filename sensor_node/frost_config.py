@@ -0,0 +1,287 @@
+"""
+Konfiguration des Frostwarnsystems zur Laufzeit neu laden
+
+Bisher wurde frost_config_mqtt.json nur beim Start gelesen; jede Änderung
+(Intervalle, QoS, Topics, Kalibrierung) brauchte einen Neustart des Dienstes,
+der die MQTT-Sitzung trennt, den Puffer neu lädt und die Hardware neu
+initialisiert. Jetzt:
+
+- ConfigWatcher: inotify auf das Verzeichnis der Datei (Editoren und
+  save_config() ersetzen sie oft per rename), ohne zusätzliche Pakete;
+  der Deskriptor hängt im Event-Loop (add_reader), kein Polling-Thread.
+- validate_config(): Typen wie in DEFAULT_CONFIG, Wertebereiche und
+  erlaubte Werte. Eine fehlerhafte Datei wird zur Laufzeit als Ganzes
+  abgelehnt, die laufende Konfiguration bleibt.
+- ConfigSnapshot: unveränderliche Sicht auf eine geprüfte Konfiguration.
+  Ein Austausch ist eine einzige Zuweisung; ein Leser in einem anderen
+  Thread sieht entweder die alte oder die neue, nie eine Mischung.
+- ConfigStore: tauscht den Snapshot aus und benachrichtigt nur die
+  Abnehmer, deren Schlüssel sich geändert haben (z.B. MQTT verbindet nur
+  bei geändertem Broker neu). Gemessen wird die Zeit von der
+  Dateiänderung bis zur Wirkung, je Abnehmer (auch asynchrone Wirkungen
+  wie das CONNACK nach einem Broker-Wechsel).
+"""
+
+import asyncio
+import ctypes
+import inspect
+import logging
+import math
+import os
+import struct
+import threading
+import time
+from collections.abc import Mapping
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+_EVENT = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len (name follows)
+
+
+class ConfigError(ValueError):
+    """Konfiguration ungültig; problems enthält die einzelnen Fehler"""
+
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+class ConfigSnapshot(Mapping):
+    """Unveränderliche, geprüfte Konfiguration (liest sich wie ein dict: get, [], in)"""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        object.__setattr__(self, "_data", dict(data))
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigSnapshot ist unveränderlich, replace() liefert einen neuen Snapshot")
+
+    def replace(self, **changes):
+        """Neuer Snapshot mit geänderten Werten (z.B. SET_THRESHOLD, Kalibrierung)"""
+        return ConfigSnapshot({**self._data, **changes})
+
+    def as_dict(self):
+        return dict(self._data)
+
+    def changed_keys(self, other):
+        """Schlüssel, deren Wert sich gegenüber other unterscheidet (auch neue und entfernte)"""
+        return frozenset(key for key in self._data.keys() | other.keys()
+                         if self._data.get(key, _MISSING) != other.get(key, _MISSING))
+
+    def __repr__(self):
+        return f"ConfigSnapshot({self._data!r})"
+
+
+_MISSING = object()
+
+
+def _check_type(value, default):
+    """Wert auf den Typ des Standardwerts bringen; None, wenn er nicht passt"""
+    if isinstance(default, bool):
+        return value if isinstance(value, bool) else None
+    if isinstance(default, (int, float)):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            return None
+        if isinstance(default, int) and not isinstance(value, int):
+            return int(value) if float(value).is_integer() else None
+        return value
+    if isinstance(default, str):
+        return value if isinstance(value, str) else None
+    return value
+
+
+def validate_config(raw, defaults, limits=None, choices=None):
+    """
+    Prüft eine geladene Konfiguration gegen die Standardwerte. Liefert
+    (geprüfte Werte, Probleme); ungültige Werte sind durch den Standard
+    ersetzt. Unbekannte Schlüssel bleiben erhalten (ältere Dateien).
+    """
+    if not isinstance(raw, dict):
+        return dict(defaults), [f"Konfiguration ist kein JSON-Objekt ({type(raw).__name__})"]
+    limits = limits or {}
+    choices = choices or {}
+    values = {**defaults}
+    problems = []
+    for key, value in raw.items():
+        if key not in defaults:
+            values[key] = value
+            continue
+        checked = _check_type(value, defaults[key])
+        if checked is None and value is not None:
+            problems.append(f"{key}: {value!r} hat nicht den Typ {type(defaults[key]).__name__}")
+            continue
+        if checked is None:
+            continue  # null: default
+        low, high = limits.get(key, (None, None))
+        if (low is not None and checked < low) or (high is not None and checked > high):
+            problems.append(f"{key}: {checked!r} außerhalb {low if low is not None else '-∞'}..{high if high is not None else '∞'}")
+            continue
+        if key in choices and checked not in choices[key]:
+            problems.append(f"{key}: {checked!r} nicht in {', '.join(map(str, choices[key]))}")
+            continue
+        values[key] = checked
+    return values, problems
+
+
+class ConfigStore:
+    """
+    Hält den aktuellen Snapshot und benachrichtigt Abnehmer nach Schlüsseln
+    (siehe Moduldokumentation). on_swap(snapshot) bindet ihn z.B. an eine
+    globale Variable, bevor die Abnehmer laufen.
+    """
+
+    def __init__(self, snapshot, on_swap=None):
+        self.current = snapshot
+        self.on_swap = on_swap
+        self._listeners = []  # (name, keys or None = all, callback(changed, old, new))
+        self._lock = threading.Lock()
+        self.counts = {"reloads": 0, "unchanged": 0, "rejected": 0, "updates": 0}
+        self.last_changed = []
+        self.last_latency_s = None
+        self.max_latency_s = 0.0
+        self.consumer_latency_s = {}
+        self.last_problems = []
+        if on_swap is not None:
+            on_swap(snapshot)
+
+    def subscribe(self, name, keys, callback):
+        """callback(changed, old, new) bei Änderung eines der Schlüssel (keys=None: jede Änderung);
+        eine zurückgegebene awaitable (z.B. Warten aufs CONNACK) zählt zur Wirkungszeit"""
+        self._listeners.append((name, frozenset(keys) if keys is not None else None, callback))
+
+    def swap(self, snapshot):
+        """Snapshot atomar austauschen; liefert (geänderte Schlüssel, alter Snapshot)"""
+        with self._lock:
+            old = self.current
+            changed = snapshot.changed_keys(old)
+            if changed:
+                self.current = snapshot
+                if self.on_swap is not None:
+                    self.on_swap(snapshot)
+        return changed, old
+
+    def _notify(self, changed, old, new, detected_at):
+        """Betroffene Abnehmer aufrufen; liefert [(name, awaitable)] der noch laufenden Wirkungen"""
+        pending = []
+        for name, keys, callback in self._listeners:
+            if keys is not None and not keys & changed:
+                continue
+            try:
+                result = callback(changed & keys if keys is not None else changed, old, new)
+            except Exception as e:
+                logging.error(f"Konfiguration: Abnehmer {name} fehlgeschlagen: {e}", exc_info=True)
+                continue
+            if inspect.isawaitable(result):
+                pending.append((name, result))
+            else:
+                self.consumer_latency_s[name] = round(time.monotonic() - detected_at, 3)
+        return pending
+
+    async def _settle(self, name, awaitable, detected_at, timeout):
+        try:
+            await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Konfiguration: {name} nach {timeout:.0f}s noch nicht wirksam.")
+        except Exception as e:
+            logging.error(f"Konfiguration: Abnehmer {name} fehlgeschlagen: {e}", exc_info=True)
+        self.consumer_latency_s[name] = round(time.monotonic() - detected_at, 3)
+
+    async def apply(self, changed, old, new, detected_at=None, timeout=60.0):
+        """Nach swap(): Abnehmer benachrichtigen und auf ihre Wirkung warten (im Event-Loop); misst die Zeit"""
+        detected_at = time.monotonic() if detected_at is None else detected_at
+        self.last_changed = sorted(changed)
+        pending = self._notify(changed, old, new, detected_at)
+        if pending:
+            await asyncio.gather(*(self._settle(name, awaitable, detected_at, timeout) for name, awaitable in pending))
+        self.last_latency_s = time.monotonic() - detected_at
+        self.max_latency_s = max(self.max_latency_s, self.last_latency_s)
+
+    def update(self, **changes):
+        """Werte im laufenden Betrieb ändern (beliebiger Thread); liefert (geänderte Schlüssel, alter Snapshot)"""
+        changed, old = self.swap(self.current.replace(**changes))
+        if changed:
+            self.counts["updates"] += 1
+        return changed, old
+
+    def reject(self, problems):
+        self.counts["rejected"] += 1
+        self.last_problems = list(problems)
+
+    async def reload(self, snapshot, detected_at=None, timeout=60.0):
+        """Neu geladenen Snapshot übernehmen und anwenden; liefert die geänderten Schlüssel"""
+        changed, old = self.swap(snapshot)
+        if not changed:
+            self.counts["unchanged"] += 1
+            return changed
+        self.counts["reloads"] += 1
+        self.last_problems = []
+        await self.apply(changed, old, snapshot, detected_at, timeout)
+        return changed
+
+    def stats(self):
+        return {
+            **self.counts,
+            "last_changed": self.last_changed,
+            "last_latency_s": round(self.last_latency_s, 3) if self.last_latency_s is not None else None,
+            "max_latency_s": round(self.max_latency_s, 3),
+            "consumer_latency_s": dict(self.consumer_latency_s),
+            "last_problems": self.last_problems,
+        }
+
+
+class ConfigWatcher:
+    """inotify auf das Verzeichnis der Konfigurationsdatei (Linux); OSError, wenn nicht verfügbar"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.directory, self.filename = os.path.split(self.path)
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 fehlgeschlagen")
+        # Written in place (close after write) or replaced by rename (editors, atomic saves)
+        if libc.inotify_add_watch(self.fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch {self.directory} fehlgeschlagen")
+        self.counts = {"events": 0, "matched": 0}
+
+    def fileno(self):
+        return self.fd
+
+    def changed(self):
+        """Anstehende Ereignisse lesen; True, wenn die Konfigurationsdatei dabei war (oder Ereignisse verloren gingen)"""
+        matched = False
+        name = os.fsencode(self.filename)
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except (BlockingIOError, InterruptedError):
+                break
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                event_name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+                self.counts["events"] += 1
+                if event_name == name or mask & IN_Q_OVERFLOW:
+                    matched = True
+        if matched:
+            self.counts["matched"] += 1
+        return matched
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
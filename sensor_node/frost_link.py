@@ -0,0 +1,276 @@
+"""
+Überwachung der GPRS-Verbindung (ppp0) für das Frostwarnsystem
+
+Der LinkMonitor meldet, sobald das Interface hoch- oder herunterfährt,
+statt dass das Skript es erst über fehlschlagende MQTT-Reconnects oder die
+30-s-Schleife in main() bemerkt. Quelle sind rtnetlink-Ereignisse
+(RTM_NEWLINK/RTM_DELLINK, Adressänderungen); ist kein Netlink-Socket
+verfügbar, wird /sys/class/net/<if>/flags im Abstand poll_interval gelesen.
+
+Mit start(loop=...) läuft der Monitor ohne eigenen Thread im asyncio-Loop:
+der Netlink-Socket wird beim Loop angemeldet, sysfs nur noch alle
+resync_interval Sekunden als Sicherheitsnetz gelesen (sofort nach einem
+Lesefehler, z.B. Pufferüberlauf).
+
+Das Interface gilt als "oben", wenn es existiert und IFF_UP und IFF_RUNNING
+gesetzt sind - pppd setzt beides erst nach abgeschlossener IPCP-Aushandlung.
+
+Zusätzlich misst der Monitor die Zeit von Link-Up bis zum ersten PUBACK
+(on_ack() aus on_publish aufrufen).
+"""
+
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+from frost_uplink import LatencyHistogram
+
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+IFLA_IFNAME = 3
+
+_NLMSGHDR = struct.Struct("=IHHII")   # len, type, flags, seq, pid
+_IFINFOMSG = struct.Struct("=BxHiII")  # family, type, index, flags, change
+_RTATTR = struct.Struct("=HH")        # len, type
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def parse_link_events(data):
+    """rtnetlink-Nachrichten -> [(msg_type, ifname oder None, flags oder None), ...]"""
+    events = []
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        msg_len, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+        if msg_len < _NLMSGHDR.size:
+            break
+        body = offset + _NLMSGHDR.size
+        end = offset + msg_len
+        if msg_type in (RTM_NEWLINK, RTM_DELLINK) and body + _IFINFOMSG.size <= end:
+            _, _, _, flags, _ = _IFINFOMSG.unpack_from(data, body)
+            name = None
+            attr = body + _IFINFOMSG.size
+            while attr + _RTATTR.size <= end:
+                attr_len, attr_type = _RTATTR.unpack_from(data, attr)
+                if attr_len < _RTATTR.size:
+                    break
+                if attr_type == IFLA_IFNAME:
+                    name = data[attr + _RTATTR.size:attr + attr_len].split(b"\0", 1)[0].decode("ascii", "replace")
+                    break
+                attr += _align(attr_len)
+            events.append((msg_type, name, flags))
+        elif msg_type in (RTM_NEWADDR, RTM_DELADDR):
+            events.append((msg_type, None, None))
+        offset += _align(msg_len)
+    return events
+
+
+class LinkMonitor:
+    """
+    Meldet Zustandswechsel eines Netzwerk-Interfaces an on_change(up).
+    Der Rückruf läuft im Monitor-Thread und sollte nicht lange blockieren.
+
+    state: None (vor start()), True (oben), False (unten oder nicht vorhanden).
+    """
+
+    def __init__(self, interface="ppp0", on_change=None, poll_interval=2.0, sysfs_root="/sys/class/net",
+                 resync_interval=60.0):
+        self.interface = interface
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.resync_interval = resync_interval
+        self.sysfs_root = sysfs_root
+        self.state = None
+        self.seen = False  # interface existed at least once (WLAN/LAN setups never have ppp0)
+        self.source = None  # "netlink" or "sysfs"
+        self._lock = threading.Lock()
+        self._stop = False
+        self._thread = None
+        self._sock = None
+        self._loop = None
+        self._timer = None  # asyncio TimerHandle of the next sysfs read (loop mode)
+        self._up_since = None  # monotonic time of the last link-up, until the first PUBACK
+        self._up_to_ack = LatencyHistogram(bounds=(1, 2, 5, 10, 30, 60, 120))
+        self.last_up_to_ack_s = None
+        self.last_change = None
+        self.counts = {"up_events": 0, "down_events": 0, "netlink_events": 0}
+
+    # --- state ---
+
+    def read_sysfs(self):
+        """Aktueller Zustand aus /sys/class/net: True/False, None wenn das Interface fehlt"""
+        try:
+            with open(os.path.join(self.sysfs_root, self.interface, "flags")) as f:
+                flags = int(f.read().strip(), 16)
+        except (OSError, ValueError):
+            return None
+        return bool(flags & IFF_UP and flags & IFF_RUNNING)
+
+    def is_down(self):
+        """True, wenn das (schon einmal gesehene) Interface gerade unten ist - Senden pausieren"""
+        return self.seen and self.state is not True
+
+    def _update(self, up, reason):
+        """up: True/False, None = Interface fehlt (zählt als unten)"""
+        if up is not None:
+            self.seen = True
+        up = bool(up)
+        with self._lock:
+            previous = self.state
+            if previous == up:
+                return
+            self.state = up
+            if previous is None:  # initial state at start, no transition
+                return
+            self.last_change = time.time()
+            self.counts["up_events" if up else "down_events"] += 1
+            self._up_since = time.monotonic() if up else None
+        logging.info(f"Interface {self.interface} {'oben' if up else 'unten'} ({reason}).")
+        if self.on_change:
+            try:
+                self.on_change(up)
+            except Exception as e:
+                logging.error(f"Fehler im Link-Rückruf ({self.interface}): {e}", exc_info=True)
+
+    def on_ack(self):
+        """PUBACK empfangen - beendet die Messung Link-Up bis erster PUBACK"""
+        with self._lock:
+            if self._up_since is None:
+                return
+            elapsed = time.monotonic() - self._up_since
+            self._up_since = None
+            self._up_to_ack.observe(elapsed)
+            self.last_up_to_ack_s = elapsed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "interface": self.interface,
+                "up": self.state,
+                "source": self.source,
+                **self.counts,
+                "last_change": self.last_change,
+                "up_to_first_ack_s": round(self.last_up_to_ack_s, 2) if self.last_up_to_ack_s is not None else None,
+                "up_to_first_ack": self._up_to_ack.as_dict(),
+            }
+
+    # --- thread ---
+
+    def start(self, loop=None):
+        self._stop = False
+        self._update(self.read_sysfs(), "Start")
+        try:
+            self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            self._sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+            self.source = "netlink"
+        except (AttributeError, OSError) as e:
+            # AF_NETLINK missing (not Linux) or not permitted -> poll sysfs
+            logging.warning(f"Netlink für Link-Überwachung nicht verfügbar ({e}), lese {self.sysfs_root} alle {self.poll_interval}s.")
+            self._sock = None
+            self.source = "sysfs"
+        if loop is not None:
+            self._loop = loop
+            if self._sock is not None:
+                self._sock.setblocking(False)
+                loop.add_reader(self._sock.fileno(), self._on_readable)
+            self._schedule_resync()
+        else:
+            self._thread = threading.Thread(target=self._run, name="LinkMonitor", daemon=True)
+            self._thread.start()
+        logging.info(f"Link-Überwachung für {self.interface} gestartet ({self.source}, Zustand: {self.state}).")
+
+    def stop(self):
+        self._stop = True
+        if self._thread:
+            self._thread.join(self.poll_interval + 1)
+        if self._loop is not None:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._sock:
+                self._loop.remove_reader(self._sock.fileno())
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def is_alive(self):
+        if self._loop is not None:
+            return not self._stop
+        return self._thread is not None and self._thread.is_alive()
+
+    # --- asyncio loop ---
+
+    def _schedule_resync(self):
+        # Without netlink sysfs is the only source and keeps the short poll interval
+        interval = self.resync_interval if self._sock is not None else self.poll_interval
+        self._timer = self._loop.call_later(interval, self._resync)
+
+    def _resync(self):
+        self._timer = None
+        if self._stop:
+            return
+        try:
+            self._update(self.read_sysfs(), "sysfs")
+        except Exception as e:
+            logging.error(f"Unerwarteter Fehler in der Link-Überwachung: {e}", exc_info=True)
+        self._schedule_resync()
+
+    def _on_readable(self):
+        try:
+            self._handle(self._sock.recv(65536))
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            logging.warning(f"Fehler beim Lesen der Link-Ereignisse: {e}")
+            self._update(self.read_sysfs(), "sysfs")
+        except Exception as e:
+            logging.error(f"Unerwarteter Fehler in der Link-Überwachung: {e}", exc_info=True)
+
+    def _run(self):
+        while not self._stop:
+            try:
+                if self._sock is None:
+                    time.sleep(self.poll_interval)
+                    self._update(self.read_sysfs(), "sysfs")
+                    continue
+                readable, _, _ = select.select([self._sock], [], [], self.poll_interval)
+                if not readable:
+                    # Safety net: missed events (e.g. netlink buffer overrun) are caught here
+                    self._update(self.read_sysfs(), "sysfs")
+                    continue
+                self._handle(self._sock.recv(65536))
+            except OSError as e:
+                logging.warning(f"Fehler beim Lesen der Link-Ereignisse: {e}")
+                time.sleep(self.poll_interval)
+                self._update(self.read_sysfs(), "sysfs")
+            except Exception as e:
+                logging.error(f"Unerwarteter Fehler in der Link-Überwachung: {e}", exc_info=True)
+                time.sleep(self.poll_interval)
+
+    def _handle(self, data):
+        for msg_type, name, flags in parse_link_events(data):
+            if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+                if name != self.interface:
+                    continue
+                self.counts["netlink_events"] += 1
+                if msg_type == RTM_DELLINK:
+                    self._update(None, "netlink: entfernt")
+                else:
+                    self._update(bool(flags & IFF_UP and flags & IFF_RUNNING), "netlink")
+            else:
+                # Address change on any interface: cheap to re-check our own
+                self._update(self.read_sysfs(), "netlink: Adresse")
@@ -0,0 +1,184 @@
+"""
+Lokaler Abfrage-Endpunkt für das Frostwarnsystem
+
+Stellt die letzten Messwerte, Zeitbereichsabfragen aus einem Ringpuffer im
+Speicher sowie Pufferfüllstand und Uplink-Zustand als JSON bereit - ohne
+Zugriff auf SD-Karte oder MQTT-Broker. Gedacht für die Diagnose über den
+Reverse-SSH-Tunnel, z.B.:
+
+    curl -s http://127.0.0.1:8765/last
+    curl -s "http://127.0.0.1:8765/readings?from=2024-03-01T02:00:00Z&limit=50"
+    curl -s --unix-socket /run/frostwarn/api.sock http://localhost/status
+
+Der Server läuft in eigenen Threads (mit start(loop=...) nimmt der asyncio-Loop
+die Verbindungen an, nur die Anfragen laufen in Threads); der Sensor-Thread
+hält nur für das Anhängen an den Ring kurz eine eigene Sperre.
+"""
+
+import bisect
+import collections
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class ReadingRing:
+    """Ringpuffer der letzten Messwerte (frost_reading.Reading) mit Epoch-Zeitstempel für Bereichsabfragen"""
+
+    def __init__(self, maxlen):
+        self._lock = threading.Lock()
+        self._items = collections.deque(maxlen=maxlen)
+
+    def append(self, reading, ts=None):
+        """Fügt eine Messung an (O(1)); ts in Epoch-Sekunden, Standard: jetzt"""
+        entry = (ts if ts is not None else time.time(), reading)
+        with self._lock:
+            self._items.append(entry)
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def capacity(self):
+        return self._items.maxlen
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._items)
+
+    def query(self, start_ts=None, end_ts=None, limit=None):
+        """Messungen im Bereich [start_ts, end_ts], chronologisch; limit = die neuesten N"""
+        items = self.snapshot()
+        stamps = [ts for ts, _ in items]
+        lo = bisect.bisect_left(stamps, start_ts) if start_ts is not None else 0
+        hi = bisect.bisect_right(stamps, end_ts) if end_ts is not None else len(items)
+        selected = [reading for _, reading in items[lo:hi]]
+        if limit is not None and limit >= 0:
+            selected = selected[-limit:] if limit else []
+        return selected
+
+
+def _parse_time(value):
+    """ISO-8601 (mit 'Z') oder Epoch-Sekunden -> Epoch-Sekunden"""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _json_default(value):
+    """Messwerte (frost_reading.Reading) als dict, alles andere als Text"""
+    as_dict = getattr(value, "as_dict", None)
+    return as_dict() if as_dict is not None else str(value)
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    server_version = "FrostLocalAPI/1.0"
+
+    def log_message(self, format, *args):
+        # Kein Zugriff auf client_address (bei Unix-Sockets leer), nur Debug-Log
+        logging.debug("Lokale API: " + format % args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, default=_json_default).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        api = self.server.api
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path in ("/", "/last"):
+                self._send_json(200, api.last_provider())
+            elif url.path == "/readings":
+                limit = int(params["limit"]) if "limit" in params else None
+                readings = api.ring.query(_parse_time(params.get("from")), _parse_time(params.get("to")), limit)
+                self._send_json(200, {"count": len(readings), "readings": readings})
+            elif url.path == "/status":
+                status = {"ring_size": len(api.ring), "ring_capacity": api.ring.capacity}
+                status.update(api.status_provider())
+                self._send_json(200, status)
+            else:
+                self._send_json(404, {"error": f"Unbekannter Pfad: {url.path}",
+                                      "paths": ["/last", "/readings?from=&to=&limit=", "/status"]})
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            logging.error(f"Fehler in lokaler API ({self.path}): {e}", exc_info=True)
+            self._send_json(500, {"error": str(e)})
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler erwartet ein (host, port)-Tupel
+        return request, ("unix", 0)
+
+
+class LocalQueryServer:
+    """
+    HTTP-Server auf 127.0.0.1:<port> oder einem Unix-Socket.
+    last_provider() und status_provider() liefern JSON-fähige Dicts aus dem Speicher.
+    """
+
+    def __init__(self, ring, last_provider, status_provider, port=8765, socket_path=""):
+        self.ring = ring
+        self.last_provider = last_provider
+        self.status_provider = status_provider
+        self.port = port
+        self.socket_path = socket_path
+        self._httpd = None
+        self._thread = None
+        self._loop = None
+
+    def start(self, loop=None):
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)  # Veralteter Socket vom letzten Lauf
+            self._httpd = _ThreadingUnixHTTPServer(self.socket_path, _QueryHandler)
+            os.chmod(self.socket_path, 0o660)
+            where = self.socket_path
+        else:
+            self._httpd = ThreadingHTTPServer(("127.0.0.1", self.port), _QueryHandler)
+            self._httpd.daemon_threads = True
+            where = f"127.0.0.1:{self.port}"
+        self._httpd.api = self
+        if loop is not None:
+            # No serve_forever() thread polling every 0.5 s: accept when the listening socket is readable
+            self._loop = loop
+            self._httpd.timeout = 0
+            loop.add_reader(self._httpd.fileno(), self._httpd.handle_request)
+        else:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="LocalAPI", daemon=True)
+            self._thread.start()
+        logging.info(f"Lokale Abfrage-API gestartet auf {where}")
+
+    def stop(self):
+        if self._httpd:
+            if self._loop is not None:
+                self._loop.remove_reader(self._httpd.fileno())
+                self._loop = None
+            else:
+                self._httpd.shutdown()
+            self._httpd.server_close()
+            if self.socket_path and os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._httpd = None
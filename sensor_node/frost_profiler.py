@@ -0,0 +1,407 @@
+"""
+Profiling auf Abruf für das Frostwarnsystem
+
+Verhält sich ein Node im Feld seltsam (hohe CPU-Last, wachsender Speicher,
+ein Thread hängt), gab es bisher nur das Log und den SSH-Tunnel. Über das
+Kommando-Topic (frost_rpc) lassen sich jetzt zeitlich begrenzte Messungen
+starten; das Ergebnis geht komprimiert auf das Diagnose-Topic:
+
+    PROFILE_START {"kind": "cpu", "duration": 60}
+    PROFILE_STOP  {"kind": "cpu"}          (ohne kind: alle laufenden)
+    PROFILE_STATUS
+
+- cpu: cProfile im Event-Loop-Thread (Scheduler, Jobs, MQTT-I/O, lokale
+  API); Funktionen nach kumulierter und eigener Zeit.
+- memory: tracemalloc für die Dauer der Messung; was in dieser Zeit
+  angelegt wurde und am Ende noch lebt, nach Zeile und mit Aufrufkette
+  (Lecks, wachsender Puffer), dazu aktueller und Spitzenverbrauch.
+- stacks: Stichproben der Stacks aller Threads (sys._current_frames) im
+  Abstand interval, als Collapsed Stacks für Flamegraphs - sieht auch die
+  Threads, die cProfile nicht erfasst (Sensor-Executor, Uplink-Worker,
+  paho). duration 0: einmaliger Stack-Dump aller Threads.
+
+Jede Messung endet spätestens nach duration Sekunden (höchstens
+max_duration), je Art läuft höchstens eine. Solange keine Messung läuft,
+kostet das nichts: cProfile, pstats und tracemalloc werden erst beim Start
+importiert, es gibt keinen Hook und keinen Thread.
+
+Ergebnis (Diagnose-Topic):
+
+    Byte 0-2  Magic b"FWD"
+    Byte 3    Version (1)
+    Rest      zlib( JSON {"kind", "started", "duration_s", "reason", ...} )
+
+server_setup/diagnostics/render_diagnostics.py stellt es dar.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import importlib
+import json
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+DIAG_MAGIC = b"FWD"
+DIAG_VERSION = 1
+DIAG_CONTENT_TYPE = "application/x-frost-diagnostics"
+
+PROFILE_KINDS = ("cpu", "memory", "stacks")
+DEFAULT_DURATION = 30.0
+DEFAULT_TOP = {"cpu": 40, "memory": 25, "stacks": 100}
+MAX_TOP = 500
+DEFAULT_INTERVAL = 0.02  # Stack sampling period (s)
+MIN_INTERVAL = 0.005
+DEFAULT_FRAMES = 8  # tracemalloc frames per allocation
+MAX_FRAMES = 32
+MEMORY_TRACEBACKS = 10
+
+
+class ProfilerError(ValueError):
+    """Messung nicht möglich; code wie bei frost_rpc.RPCError (invalid_value, busy, unavailable)"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def encode_report(report, level=9):
+    """Bericht (dict) -> komprimierte Nutzlast für das Diagnose-Topic"""
+    body = json.dumps(report, separators=(",", ":"), default=str).encode("utf-8")
+    return DIAG_MAGIC + bytes([DIAG_VERSION]) + zlib.compress(body, level)
+
+
+def decode_report(data):
+    """Nutzlast des Diagnose-Topics -> Bericht (dict); ValueError bei fremdem Format"""
+    if data[:3] != DIAG_MAGIC:
+        raise ValueError("Kein Diagnosebericht (Magic fehlt)")
+    if data[3] != DIAG_VERSION:
+        raise ValueError(f"Nicht unterstützte Diagnose-Version: {data[3]}")
+    return json.loads(zlib.decompress(data[4:]))
+
+
+_path_prefixes = None
+
+
+def _short_path(path):
+    """Pfade ohne Interpreter-/site-packages-Präfix (kürzere Berichte über GPRS)"""
+    global _path_prefixes
+    if _path_prefixes is None:
+        paths = sysconfig.get_paths()
+        prefixes = {paths.get(name) for name in ("purelib", "platlib", "stdlib", "platstdlib")}
+        prefixes.add(os.path.dirname(os.path.abspath(__file__)))
+        _path_prefixes = sorted((p.rstrip("/") + "/" for p in prefixes if p), key=len, reverse=True)
+    for prefix in _path_prefixes:
+        if path.startswith(prefix):
+            return path[len(prefix):]
+    return path
+
+
+def _number(params, name, default, low, high, integer=False):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value) if integer else float(value)
+    except (TypeError, ValueError):
+        raise ProfilerError("invalid_value", f"{name}: {value!r} ist keine Zahl")
+    if not low <= value <= high:
+        raise ProfilerError("invalid_value", f"{name}: {value} außerhalb {low}..{high}")
+    return value
+
+
+def _rss_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class _Session:
+    def __init__(self, kind, duration, top, params):
+        self.kind = kind
+        self.duration = duration
+        self.top = top
+        self.params = params
+        self.started = time.time()
+        self.started_mono = time.monotonic()
+        self.timer = None
+        self.profile = None      # cpu: cProfile.Profile
+        self.done = None         # stacks: threading.Event
+        self.thread = None       # stacks: sampler thread
+        self.stacks = None       # stacks: Counter of collapsed stacks
+        self.samples = 0
+
+
+class Profiler:
+    """
+    Zeitlich begrenzte Messungen (siehe Moduldokumentation).
+    publish(kind, payload) liefert den komprimierten Bericht aus; loop ist
+    der Event-Loop, in dessen Thread cProfile misst; context (dict) steht in
+    jedem Bericht (z.B. device_id, Prozessrolle).
+    """
+
+    def __init__(self, publish, loop=None, context=None, max_duration=600.0):
+        self.publish = publish
+        self.loop = loop
+        self.context = dict(context or {})
+        self.max_duration = max_duration
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.counts = {"started": 0, "published": 0, "failed": 0}
+        self.last = {}  # kind -> summary of the last report
+
+    # --- commands (any thread) ---
+
+    def start(self, kind, params=None):
+        """Messung starten; liefert eine Zusammenfassung. ProfilerError bei ungültigen Parametern oder belegt"""
+        params = params or {}
+        if kind not in PROFILE_KINDS:
+            raise ProfilerError("invalid_value", f"kind: {kind!r} nicht in {', '.join(PROFILE_KINDS)}")
+        limit = self.max_duration
+        duration = _number(params, "duration", min(DEFAULT_DURATION, limit), 0 if kind == "stacks" else 1, limit)
+        top = _number(params, "top", DEFAULT_TOP[kind], 1, MAX_TOP, integer=True)
+        if kind == "stacks" and duration == 0:
+            report = self._report(_Session(kind, 0, top, {}), "dump", threads=self._dump_stacks())
+            return {"kind": kind, "published_bytes": self._emit(report)}
+
+        session = _Session(kind, duration, top, params)
+        with self._lock:
+            if kind in self._sessions:
+                raise ProfilerError("busy", f"Messung {kind} läuft bereits")
+            self._sessions[kind] = session  # Reserved; removed again if starting fails
+        try:
+            if kind == "cpu":
+                self._start_cpu(session)
+            elif kind == "memory":
+                self._start_memory(session)
+            else:
+                self._start_stacks(session)
+        except Exception:
+            with self._lock:
+                self._sessions.pop(kind, None)
+            raise
+        session.timer = threading.Timer(duration, self.stop, (kind, "timeout"))
+        session.timer.daemon = True
+        session.timer.name = f"Profiler_{kind}"
+        session.timer.start()
+        self.counts["started"] += 1
+        logging.info(f"Profiling {kind} gestartet für {duration:.0f}s.")
+        return {"kind": kind, "duration_s": duration, "top": top}
+
+    def stop(self, kind, reason="stop", publish=True):
+        """Messung beenden und den Bericht ausliefern; None, wenn keine lief"""
+        with self._lock:
+            session = self._sessions.pop(kind, None)
+        if session is None:
+            return None
+        if session.timer is not None:
+            session.timer.cancel()
+        try:
+            if kind == "cpu":
+                report = self._stop_cpu(session, reason)
+            elif kind == "memory":
+                report = self._stop_memory(session, reason)
+            else:
+                report = self._stop_stacks(session, reason)
+        except Exception as e:
+            self.counts["failed"] += 1
+            logging.error(f"Profiling {kind}: Bericht fehlgeschlagen: {e}", exc_info=True)
+            return {"kind": kind, "error": str(e)}
+        logging.info(f"Profiling {kind} beendet ({reason}) nach {report['duration_s']:.1f}s.")
+        summary = {"kind": kind, "duration_s": report["duration_s"], "reason": reason}
+        if publish:
+            summary["published_bytes"] = self._emit(report)
+        return summary
+
+    def stop_all(self, reason="stop", publish=True):
+        return [summary for summary in (self.stop(kind, reason, publish) for kind in list(self._sessions)) if summary]
+
+    def active(self):
+        return list(self._sessions)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            active = {kind: {"remaining_s": round(max(0.0, session.started_mono + session.duration - now), 1),
+                             "top": session.top}
+                      for kind, session in self._sessions.items()}
+        return {**self.counts, "active": active, "last": dict(self.last), "max_duration_s": self.max_duration}
+
+    # --- cpu: cProfile in the event loop thread ---
+
+    def _in_loop(self, func):
+        """func im Thread des Event-Loops ausführen (cProfile misst nur den Thread, in dem es läuft)"""
+        loop = self.loop
+        if loop is None or loop.is_closed() or not loop.is_running():
+            raise ProfilerError("unavailable", "Event-Loop läuft nicht")
+        try:
+            if asyncio.get_running_loop() is loop:
+                return func()
+        except RuntimeError:
+            pass  # Not in a loop thread
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(func())
+            except Exception as e:
+                future.set_exception(e)
+        loop.call_soon_threadsafe(run)
+        return future.result(timeout=5)
+
+    def _start_cpu(self, session):
+        import cProfile
+
+        session.profile = cProfile.Profile()
+        self._in_loop(session.profile.enable)
+
+    def _stop_cpu(self, session, reason):
+        import pstats
+
+        try:
+            self._in_loop(session.profile.disable)
+        except (ProfilerError, concurrent.futures.TimeoutError):
+            session.profile.disable()  # Loop gone (shutdown): a profile never enabled here is a no-op
+        stats = pstats.Stats(session.profile)
+        entries = stats.stats  # (file, line, func) -> (primitive calls, calls, own time, cumulative time, callers)
+        by_cum = sorted(entries.items(), key=lambda item: item[1][3], reverse=True)[:session.top]
+        by_own = sorted(entries.items(), key=lambda item: item[1][2], reverse=True)[:session.top]
+        rows = []
+        seen = set()
+        for (filename, line, func), (cc, nc, tt, ct, _) in by_cum + by_own:
+            if (filename, line, func) in seen:
+                continue
+            seen.add((filename, line, func))
+            rows.append([_short_path(filename), line, func, nc, cc, round(tt, 6), round(ct, 6)])
+        return self._report(session, reason, thread="event loop", total_calls=stats.total_calls,
+                            total_s=round(stats.total_tt, 6),
+                            columns=["file", "line", "function", "calls", "primitive_calls", "own_s", "cumulative_s"],
+                            functions=rows)
+
+    # --- memory: tracemalloc ---
+
+    def _start_memory(self, session):
+        import tracemalloc
+
+        if tracemalloc.is_tracing():
+            raise ProfilerError("busy", "tracemalloc läuft bereits (PYTHONTRACEMALLOC?)")
+        session.params = {"frames": _number(session.params, "frames", DEFAULT_FRAMES, 1, MAX_FRAMES, integer=True)}
+        session.rss_start = _rss_kb()
+        _short_path(__file__)  # Path prefixes and pstats imported before, not counted in the report
+        importlib.import_module("pstats")
+        tracemalloc.start(session.params["frames"])
+
+    def _stop_memory(self, session, reason):
+        import tracemalloc
+
+        try:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        # Without the profiler itself (stack samples, reports) and imports it triggers while stopping
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, __file__, all_frames=True),
+                                           tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                                           tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")))
+        by_line = snapshot.statistics("lineno")
+        top = [[_short_path(stat.traceback[0].filename), stat.traceback[0].lineno, stat.size, stat.count]
+               for stat in by_line[:session.top]]
+        tracebacks = [{"size": stat.size, "count": stat.count,
+                       "frames": [[_short_path(frame.filename), frame.lineno] for frame in stat.traceback]}
+                      for stat in snapshot.statistics("traceback")[:MEMORY_TRACEBACKS]]
+        return self._report(session, reason, current_bytes=current, peak_bytes=peak,
+                            blocks=sum(stat.count for stat in by_line), rss_kb_start=session.rss_start,
+                            rss_kb_end=_rss_kb(), columns=["file", "line", "bytes", "blocks"],
+                            top=top, tracebacks=tracebacks)
+
+    # --- stacks: sampling all threads ---
+
+    def _start_stacks(self, session):
+        session.params = {"interval": _number(session.params, "interval", DEFAULT_INTERVAL, MIN_INTERVAL, 10.0)}
+        session.done = threading.Event()
+        session.stacks = collections.Counter()
+        session.thread = threading.Thread(target=self._sample, args=(session,), name="Profiler_stacks", daemon=True)
+        session.thread.start()
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self, session):
+        own = threading.get_ident()
+        interval = session.params["interval"]
+        while not session.done.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or names.get(ident, "").startswith("Profiler_"):
+                    continue  # Sampler and timers of running measurements
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                session.stacks[";".join(reversed(stack))] += 1  # Collapsed format: thread;outer;...;inner
+            session.samples += 1
+
+    def _stop_stacks(self, session, reason):
+        session.done.set()
+        session.thread.join(5)
+        per_thread = collections.Counter()
+        for stack, count in session.stacks.items():
+            per_thread[stack.split(";", 1)[0]] += count
+        return self._report(session, reason, samples=session.samples, threads=dict(per_thread),
+                            stacks=[[stack, count] for stack, count in session.stacks.most_common(session.top)],
+                            distinct_stacks=len(session.stacks))
+
+    def _dump_stacks(self):
+        names = {thread.ident: (thread.name, thread.daemon) for thread in threading.enumerate()}
+        threads = []
+        for ident, frame in sys._current_frames().items():
+            stack = []
+            while frame is not None:
+                stack.append([_short_path(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name])
+                frame = frame.f_back
+            name, daemon = names.get(ident, (str(ident), None))
+            threads.append({"name": name, "ident": ident, "daemon": daemon, "stack": stack[::-1]})
+        return threads
+
+    # --- report ---
+
+    def _report(self, session, reason, **data):
+        return {
+            "kind": session.kind,
+            **self.context,
+            "pid": os.getpid(),
+            "python": sys.version.split()[0],
+            "started": datetime.fromtimestamp(session.started, timezone.utc).isoformat(),
+            "duration_s": round(time.monotonic() - session.started_mono, 3),
+            "requested_s": session.duration,
+            "reason": reason,
+            "params": session.params,
+            **data,
+        }
+
+    def _emit(self, report):
+        payload = encode_report(report)
+        try:
+            sent = self.publish(report["kind"], payload)
+        except Exception as e:
+            sent = False
+            logging.error(f"Diagnosebericht {report['kind']} konnte nicht gesendet werden: {e}")
+        self.counts["published" if sent is not False else "failed"] += 1
+        self.last[report["kind"]] = {"started": report["started"], "duration_s": report["duration_s"],
+                                     "reason": report["reason"], "bytes": len(payload), "sent": sent is not False}
+        return len(payload)
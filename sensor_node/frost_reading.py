@@ -0,0 +1,158 @@
+"""
+Kompakter Messwert-Datensatz für das Frostwarnsystem
+
+Bisher war jeder Messwert ein dict mit rund 18 Schlüsseln, darunter Strings
+wie der ISO-Zeitstempel, uptime_str und ip_address, und wurde je Messzyklus
+mehrfach kopiert (letzter Messwert, CSV, MQTT). Der Puffer hält bis zu
+max_buffer_size davon - auf dem Pi Zero mit 512 MB zählt das. Reading hat
+ein festes Schema (__slots__, kein dict je Messwert):
+
+- Der Zeitstempel steht als Epoch-Sekunden (float) im Datensatz; der
+  ISO-String entsteht erst beim Kodieren (JSON, Pufferdatei, lokale API).
+- uptime_str wird aus uptime_seconds abgeleitet; device_id und ip_address
+  sind internierte Strings, alle Messwerte teilen sich ein Objekt.
+- Ein Messwert wird nach dem Anlegen nicht mehr verändert. Letzter
+  Messwert, lokale API, Uplink-Puffer und Zustellbuch teilen sich dasselbe
+  Objekt statt Kopien.
+
+Lesend verhält sich Reading wie der bisherige dict (get, [], in, Iteration
+über die vorhandenen Felder in der bisherigen Reihenfolge), die Kodierer in
+frost_codec brauchen keine Anpassung. as_dict() liefert den dict an der
+JSON-Grenze; from_dict() liest Pufferdateien und dekodierte Ringdatensätze.
+"""
+
+import sys
+from collections.abc import Mapping
+from datetime import datetime, timezone
+
+# Always present (None = not measured), in the order of the former dict
+CORE_FIELDS = ("device_id", "seq", "boot", "dry_temp", "wet_temp", "humidity", "calc_wet_temp",
+               "effective_wet_temp", "battery_percent", "battery_voltage", "dcdc_voltage")
+# Present only with a value (get_system_info() may fail, decoded binary readings omit missing fields)
+SYSTEM_FIELDS = ("cpu_percent", "memory_percent", "disk_percent", "uptime_seconds", "ip_address")
+_FIELD_SET = frozenset(CORE_FIELDS + SYSTEM_FIELDS)
+
+
+def uptime_text(seconds):
+    """uptime_seconds -> "1d 3h 12m" (wie bisher get_system_info())"""
+    seconds = int(seconds)
+    return f"{seconds // 86400}d {(seconds % 86400) // 3600}h {(seconds % 3600) // 60}m"
+
+
+def parse_timestamp(value):
+    """ISO-8601 (auch mit 'Z', ohne Zone = UTC) oder Epoch-Sekunden -> Epoch-Sekunden (float)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _shared(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Reading(Mapping):
+    """Ein Messwert mit festem Schema (siehe Moduldokumentation); extra hält unbekannte Felder alter Pufferdateien"""
+
+    __slots__ = ("epoch",) + CORE_FIELDS + SYSTEM_FIELDS + ("extra",)
+
+    def __init__(self, epoch, device_id=None, seq=None, boot=None, dry_temp=None, wet_temp=None, humidity=None,
+                 calc_wet_temp=None, effective_wet_temp=None, battery_percent=None, battery_voltage=None,
+                 dcdc_voltage=None, cpu_percent=None, memory_percent=None, disk_percent=None,
+                 uptime_seconds=None, ip_address=None, extra=None):
+        self.epoch = epoch
+        self.device_id = _shared(device_id)
+        self.seq = seq
+        self.boot = boot
+        self.dry_temp = dry_temp
+        self.wet_temp = wet_temp
+        self.humidity = humidity
+        self.calc_wet_temp = calc_wet_temp
+        self.effective_wet_temp = effective_wet_temp
+        self.battery_percent = battery_percent
+        self.battery_voltage = battery_voltage
+        self.dcdc_voltage = dcdc_voltage
+        self.cpu_percent = cpu_percent
+        self.memory_percent = memory_percent
+        self.disk_percent = disk_percent
+        self.uptime_seconds = uptime_seconds
+        self.ip_address = _shared(ip_address)
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, data, device_id=None):
+        """Messwert-Dict (Pufferdatei, decode_binary_reading()) -> Reading; KeyError/ValueError ohne gültigen Zeitstempel"""
+        values = {key: value for key, value in data.items() if key not in _FIELD_SET}
+        epoch = parse_timestamp(values.pop("timestamp"))
+        values.pop("uptime_str", None)  # Derived from uptime_seconds
+        fields = {name: data.get(name) for name in _FIELD_SET}
+        if fields["device_id"] is None:
+            fields["device_id"] = device_id
+        return cls(epoch, extra=values, **fields)
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.epoch, timezone.utc).isoformat()
+
+    @property
+    def uptime_str(self):
+        return uptime_text(self.uptime_seconds) if self.uptime_seconds is not None else None
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            return default if value is None and key in SYSTEM_FIELDS else value
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key):
+        if key == "timestamp":
+            return self.timestamp
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is None and key in SYSTEM_FIELDS:
+                raise KeyError(key)
+            return value
+        if key == "uptime_str" and self.uptime_seconds is not None:
+            return self.uptime_str
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield "timestamp"
+        yield from CORE_FIELDS
+        for name in SYSTEM_FIELDS:
+            if name == "ip_address" and self.uptime_seconds is not None:
+                yield "uptime_str"  # Former key order: ..., uptime_seconds, uptime_str, ip_address
+            if getattr(self, name) is not None:
+                yield name
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def as_dict(self, exclude=()):
+        """dict wie bisher update_sensor_data() (JSON, Pufferdatei, lokale API); exclude: weggelassene Felder"""
+        data = {"timestamp": self.timestamp}
+        for name in CORE_FIELDS:
+            data[name] = getattr(self, name)
+        for name in SYSTEM_FIELDS:
+            if name == "ip_address" and self.uptime_seconds is not None:
+                data["uptime_str"] = self.uptime_str
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        if self.extra:
+            data.update(self.extra)
+        for name in exclude:
+            data.pop(name, None)
+        return data
+
+    def __repr__(self):
+        return f"Reading({self.as_dict()!r})"
@@ -0,0 +1,335 @@
+"""
+Namensauflösung für den MQTT-Broker (DDNS) mit Cache
+
+Jeder Reconnect von paho löst mqtt_broker neu über die GPRS-Verbindung auf -
+das kostet Round-Trips und scheitert ganz, wenn das DNS des Mobilfunknetzes
+hakt, obwohl sich die IP gar nicht geändert hat. BrokerResolver hält die
+Adresse mit der TTL aus der DNS-Antwort im Speicher und die zuletzt
+erfolgreich verbundene Adresse ("last known good") in einer Datei:
+
+- Connect geht an die gemerkte IP, auch wenn die TTL abgelaufen ist; die
+  Auffrischung läuft dann parallel im Hintergrund.
+- Schlägt der Connect an die gemerkte IP fehl (DDNS-Adresse hat sich
+  geändert), wird das Ergebnis der Auffrischung abgewartet bzw. sofort neu
+  aufgelöst und die neue IP versucht.
+- Nur ohne jede gemerkte Adresse blockiert die Auflösung den Connect. Diese
+  Zeit wird als DNS-bedingte Reconnect-Verzögerung erfasst.
+
+Die TTL kommt aus einer einfachen A-Abfrage (UDP) an die Nameserver aus
+/etc/resolv.conf; schlägt die fehl, wird getaddrinfo() mit default_ttl
+verwendet. ResolvingMQTTClient verbindet den TCP-Socket an die Adresse aus
+dem Resolver, der Hostname bleibt für TLS (SNI, Zertifikatsprüfung) erhalten.
+"""
+
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from frost_uplink import LatencyHistogram
+
+DNS_PORT = 53
+DNS_TYPE_A = 1
+DNS_CLASS_IN = 1
+DNS_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30)
+
+
+def system_nameservers(path="/etc/resolv.conf"):
+    """Nameserver aus resolv.conf (pppd schreibt mit usepeerdns die des Providers)"""
+    servers = []
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    servers.append(parts[1])
+    except OSError:
+        pass
+    return servers
+
+
+def _encode_name(hostname):
+    return b"".join(bytes([len(label)]) + label for label in hostname.encode("idna").split(b".") if label) + b"\0"
+
+
+def _skip_name(data, offset):
+    """Überspringt einen (ggf. komprimierten) Namen in einer DNS-Nachricht"""
+    while True:
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:  # compression pointer
+            return offset + 2
+        offset += 1 + length
+
+
+def build_a_query(hostname, query_id):
+    header = struct.pack(">HHHHHH", query_id, 0x0100, 1, 0, 0, 0)  # recursion desired, one question
+    return header + _encode_name(hostname) + struct.pack(">HH", DNS_TYPE_A, DNS_CLASS_IN)
+
+
+def parse_a_response(data, query_id):
+    """DNS-Antwort -> ([IPv4-Adressen], kleinste TTL der Antwortkette); ValueError bei Fehlern"""
+    if len(data) < 12:
+        raise ValueError("DNS-Antwort zu kurz")
+    rid, flags, qdcount, ancount, _, _ = struct.unpack_from(">HHHHHH", data)
+    if rid != query_id:
+        raise ValueError("DNS-Antwort mit falscher ID")
+    if flags & 0x0200:
+        raise ValueError("DNS-Antwort abgeschnitten")
+    rcode = flags & 0x000F
+    if rcode:
+        raise ValueError(f"DNS-Fehler (RCODE {rcode})")
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+    addresses = []
+    ttls = []
+    for _ in range(ancount):
+        offset = _skip_name(data, offset)
+        rtype, rclass, ttl, rdlength = struct.unpack_from(">HHIH", data, offset)
+        offset += 10
+        ttls.append(ttl)  # CNAMEs in the chain count too
+        if rtype == DNS_TYPE_A and rclass == DNS_CLASS_IN and rdlength == 4:
+            addresses.append(socket.inet_ntoa(data[offset:offset + 4]))
+        offset += rdlength
+    if not addresses:
+        raise ValueError("Keine A-Einträge in der DNS-Antwort")
+    return addresses, min(ttls)
+
+
+def query_a(hostname, nameserver, timeout=3.0, port=DNS_PORT):
+    """Eine A-Abfrage per UDP: ([Adressen], TTL)"""
+    query_id = random.getrandbits(16)
+    family = socket.AF_INET6 if ":" in nameserver else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect((nameserver, port))
+        sock.send(build_a_query(hostname, query_id))
+        deadline = time.monotonic() + timeout
+        while True:
+            data = sock.recv(1500)
+            # Late answer to an earlier query: keep waiting for ours
+            if data[:2] == struct.pack(">H", query_id) or time.monotonic() > deadline:
+                return parse_a_response(data, query_id)
+
+
+def _is_ip_literal(host):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except OSError:
+            pass
+    return False
+
+
+class BrokerResolver:
+    """
+    Cache für die Broker-Adresse (siehe Moduldokumentation). Threadsicher;
+    connect_address() und on_connect_failed() laufen im paho-Netzwerk-Thread.
+    """
+
+    def __init__(self, hostname, cache_file=None, min_ttl=60, max_ttl=86400, default_ttl=300,
+                 nameservers=None, timeout=3.0):
+        self.hostname = hostname
+        self.cache_file = cache_file
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.default_ttl = default_ttl
+        self.nameservers = nameservers
+        self.timeout = timeout
+        self.address = None
+        self.expires = 0.0  # wall clock (epoch), so it survives restarts via the cache file
+        self.last_good = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        self._last_attempt = None
+        self._lookup = LatencyHistogram(bounds=DNS_BUCKETS)
+        self._blocking = LatencyHistogram(bounds=DNS_BUCKETS)
+        self.last_reconnect_delay_s = None
+        self.counts = {"cache_hits": 0, "stale_hits": 0, "blocking_lookups": 0, "background_lookups": 0,
+                       "lookup_failures": 0, "fallbacks": 0, "address_changes": 0}
+
+    @property
+    def is_literal(self):
+        return _is_ip_literal(self.hostname)
+
+    # --- persistence ---
+
+    def load(self):
+        """Zuletzt erfolgreich verbundene Adresse aus der Cache-Datei übernehmen"""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"DNS-Cache {self.cache_file} nicht lesbar: {e}")
+            return False
+        if data.get("hostname") != self.hostname or not data.get("address"):
+            return False  # broker changed in the config
+        with self._lock:
+            self.address = self.last_good = data["address"]
+            self.expires = float(data.get("expires", 0))
+        logging.info(f"Broker-Adresse aus DNS-Cache: {self.hostname} -> {self.address}")
+        return True
+
+    def _save(self):
+        if not self.cache_file:
+            return
+        with self._lock:
+            data = {"hostname": self.hostname, "address": self.last_good, "expires": self.expires,
+                    "verified": time.time()}
+        tmp = self.cache_file + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            logging.warning(f"DNS-Cache {self.cache_file} konnte nicht gespeichert werden: {e}")
+
+    # --- lookups ---
+
+    def resolve(self):
+        """Löst den Hostnamen auf (mit TTL) und aktualisiert den Cache; liefert die Adresse oder None"""
+        started = time.monotonic()
+        addresses, ttl = None, None
+        for nameserver in self.nameservers if self.nameservers is not None else system_nameservers():
+            try:
+                addresses, ttl = query_a(self.hostname, nameserver, self.timeout)
+                break
+            except (OSError, ValueError, struct.error, IndexError) as e:
+                logging.debug(f"DNS-Abfrage {self.hostname} bei {nameserver} fehlgeschlagen: {e}")
+        if not addresses:
+            try:
+                infos = socket.getaddrinfo(self.hostname, None, socket.AF_INET, socket.SOCK_STREAM)
+                addresses, ttl = [info[4][0] for info in infos], self.default_ttl
+            except OSError as e:
+                logging.warning(f"DNS-Auflösung von {self.hostname} fehlgeschlagen: {e}")
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._lookup.observe(elapsed)
+            if not addresses:
+                self.counts["lookup_failures"] += 1
+                return None
+            address = self.address if self.address in addresses else addresses[0]
+            if self.address and address != self.address:
+                self.counts["address_changes"] += 1
+                logging.info(f"Broker-Adresse geändert: {self.hostname} {self.address} -> {address}")
+            self.address = address
+            self.expires = time.time() + max(self.min_ttl, min(self.max_ttl, ttl))
+            return address
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self.counts["background_lookups"] += 1
+            self._refresh_thread = threading.Thread(target=self.resolve, name="DNSRefresh", daemon=True)
+            self._refresh_thread.start()
+
+    def connect_address(self):
+        """Adresse für den nächsten Connect; blockiert nur, wenn noch nie eine Adresse bekannt war"""
+        if self.is_literal:
+            return self.hostname
+        with self._lock:
+            address, expired = self.address, time.time() >= self.expires
+        if address:
+            with self._lock:
+                self.counts["stale_hits" if expired else "cache_hits"] += 1
+                self.last_reconnect_delay_s = 0.0
+                self._last_attempt = address
+            if expired:
+                self._refresh_in_background()
+            return address
+        started = time.monotonic()
+        address = self.resolve()
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.counts["blocking_lookups"] += 1
+            self._blocking.observe(elapsed)
+            self.last_reconnect_delay_s = elapsed
+            self._last_attempt = address
+        if address is None:
+            raise socket.gaierror(socket.EAI_AGAIN, f"Broker {self.hostname} nicht auflösbar")
+        return address
+
+    def on_connect_failed(self, address):
+        """TCP-Connect an address schlug fehl: neue Adresse zum sofortigen Nachversuch oder None"""
+        if self.is_literal:
+            return None
+        with self._lock:
+            thread = self._refresh_thread
+        started = time.monotonic()
+        if thread is not None and thread.is_alive():
+            thread.join(self.timeout * 2)
+            fresh = self.address
+        else:
+            fresh = self.resolve()
+        with self._lock:
+            self._blocking.observe(time.monotonic() - started)
+            self.last_reconnect_delay_s = time.monotonic() - started
+            if fresh and fresh != address:
+                self.counts["fallbacks"] += 1
+                self._last_attempt = fresh
+                return fresh
+        return None
+
+    def on_connected(self):
+        """MQTT-Connect erfolgreich: verwendete Adresse als last known good speichern"""
+        with self._lock:
+            address = self._last_attempt
+            changed = address and address != self.last_good
+            if address:
+                self.last_good = address
+        if changed:
+            self._save()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hostname": self.hostname,
+                "address": self.address,
+                "last_good": self.last_good,
+                "ttl_remaining_s": round(self.expires - time.time()) if self.address else None,
+                **self.counts,
+                "reconnect_delay_s": round(self.last_reconnect_delay_s, 3)
+                if self.last_reconnect_delay_s is not None else None,
+                "lookup": self._lookup.as_dict(),
+                "blocking": self._blocking.as_dict(),
+            }
+
+
+class ResolvingMQTTClient(mqtt.Client):
+    """
+    paho-Client, der den TCP-Socket an die Adresse aus dem BrokerResolver
+    verbindet. Überschreibt den internen Verbindungsaufbau von paho 2.1
+    (_create_socket_connection); Proxy-Verbindungen bleiben unverändert.
+    """
+
+    def __init__(self, *args, resolver=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.resolver = resolver
+
+    def _create_socket_connection(self):
+        if self.resolver is None or self._get_proxy():
+            return super()._create_socket_connection()
+        source = (self._bind_address, self._bind_port)
+        address = self.resolver.connect_address()
+        try:
+            return socket.create_connection((address, self._port), timeout=self._connect_timeout,
+                                            source_address=source)
+        except OSError as e:
+            fallback = self.resolver.on_connect_failed(address)
+            if not fallback:
+                raise
+            logging.warning(f"Connect an {address} fehlgeschlagen ({e}), versuche neu aufgelöste Adresse {fallback}.")
+            return socket.create_connection((fallback, self._port), timeout=self._connect_timeout,
+                                            source_address=source)
@@ -0,0 +1,237 @@
+"""
+Gemeinsamer Ringpuffer für den Zwei-Prozess-Betrieb des Frostwarnsystems
+
+Im Zwei-Prozess-Betrieb (frost_warning_mqtt.py acquire / uplink) misst ein
+Prozess nur (1-Wire, DHT22, ADS1115) und schreibt jeden Messwert als Datensatz
+fester Größe in diesen Ring; der Uplink-Prozess liest, kodiert, puffert und
+sendet. Ein hängender Socket, ein großes json.dumps des Rückstands oder der
+GIL im Uplink verzögern die Messung so nicht mehr.
+
+Der Ring ist eine per mmap (MAP_SHARED) geteilte Datei: beide Prozesse sehen
+dieselben Seiten im Page-Cache, ein Neustart eines Prozesses verliert nichts.
+
+    Kopf (64 Bytes)
+        magic b"FWRR", Version, Slotgröße, Slotanzahl,
+        head  (nächster zu schreibender Index, vom Schreiber),
+        tail  (erster noch nicht sicher übernommener Index, vom Leser),
+        budget_level (Sparstufe, vom Uplink für die Messung)
+    Slots (je slot_size Bytes)
+        Index (uint64), CRC32, Art, Länge, Nutzdaten
+
+- Ein Schreiber, ein Leser. Ein Slot gilt nur, wenn sein Index stimmt und
+  die CRC passt; ein halb geschriebener Slot (Absturz, gleichzeitiges Lesen)
+  wird so erkannt, head im Kopf ist nur ein Hinweis.
+- Der Leser bestätigt (commit) erst, wenn die Messwerte in der Pufferdatei
+  des Uplinks stehen. Nach einem Neustart liest er ab tail erneut: ein
+  Messwert kommt mindestens einmal an (Duplikate erkennt der Server an seq).
+- Ist der Ring voll (Uplink sehr lange aus), überschreibt der Schreiber den
+  ältesten Datensatz; der Leser zählt die verlorenen Datensätze.
+
+RingNotifier weckt die Gegenseite über einen Unix-Datagram-Socket (abstrakter
+Namensraum, keine Datei), statt dass der Leser den Ring pollt: RECORDS vom
+Messprozess nach jedem Datensatz, SAMPLE vom Uplink für GET_STATUS.
+"""
+
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+import zlib
+
+RING_MAGIC = b"FWRR"
+RING_VERSION = 1
+
+KIND_READING = 1  # Payload: frost_codec binary reading
+KIND_ALERT = 2    # Payload: JSON {"event", "message", ...}
+
+NOTIFY_RECORDS = b"R"  # acquire -> uplink: new records in the ring
+NOTIFY_SAMPLE = b"S"   # uplink -> acquire: take a reading now (GET_STATUS)
+
+_HEADER = struct.Struct("<4sBxHIQQB")  # magic, version, slot_size, slots, head, tail, budget_level
+_HEADER_SIZE = 64
+_HEAD_OFFSET = 12
+_TAIL_OFFSET = 20
+_BUDGET_OFFSET = 28
+_U64 = struct.Struct("<Q")
+_SLOT_HEADER = struct.Struct("<QIBxH")  # index, crc32, kind, length
+
+
+class SharedRing:
+    """Datensätze fester Größe in einer per mmap geteilten Datei (siehe Moduldokumentation)"""
+
+    def __init__(self, path, slots=2880, slot_size=256):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_payload = slot_size - _SLOT_HEADER.size
+        self.position = 0  # Reader: next index to read (committed up to tail)
+        self.counts = {"written": 0, "read": 0, "overwritten": 0, "lost": 0, "corrupt": 0}
+        self._map = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Ringdatei öffnen oder anlegen; Geometrie aus einer bestehenden Datei hat Vorrang"""
+        size = _HEADER_SIZE + self.slots * self.slot_size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            current = os.fstat(fd).st_size
+            header = os.pread(fd, _HEADER.size, 0) if current >= _HEADER_SIZE else b""
+            if len(header) == _HEADER.size and header[:4] == RING_MAGIC and header[4] == RING_VERSION:
+                _, _, self.slot_size, self.slots, _, _, _ = _HEADER.unpack(header)
+                self.max_payload = self.slot_size - _SLOT_HEADER.size
+                size = _HEADER_SIZE + self.slots * self.slot_size
+            else:
+                if current:
+                    logging.warning(f"Ringdatei {self.path} hat kein gültiges Format, lege sie neu an.")
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, _HEADER.pack(RING_MAGIC, RING_VERSION, self.slot_size, self.slots, 0, 0, 0), 0)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self.position = self.tail
+        return self
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    # --- header fields ---
+
+    def _get(self, offset):
+        return _U64.unpack_from(self._map, offset)[0]
+
+    @property
+    def head(self):
+        return self._get(_HEAD_OFFSET)
+
+    @property
+    def tail(self):
+        return self._get(_TAIL_OFFSET)
+
+    @property
+    def budget_level(self):
+        return self._map[_BUDGET_OFFSET]
+
+    @budget_level.setter
+    def budget_level(self, level):
+        self._map[_BUDGET_OFFSET] = max(0, min(255, int(level)))
+
+    # --- slots ---
+
+    def _slot(self, index):
+        offset = _HEADER_SIZE + (index % self.slots) * self.slot_size
+        slot_index, crc, kind, length = _SLOT_HEADER.unpack_from(self._map, offset)
+        if slot_index != index or not kind or length > self.max_payload:
+            return slot_index, None, None
+        start = offset + _SLOT_HEADER.size
+        payload = self._map[start:start + length]
+        if zlib.crc32(payload, kind) != crc:
+            return slot_index, None, None
+        return slot_index, kind, payload
+
+    def recover(self):
+        """Schreiber nach einem Neustart: vollständig geschriebene Slots hinter head übernehmen"""
+        head = self.head
+        while self._slot(head)[1] is not None:
+            head += 1
+        if head != self.head:
+            _U64.pack_into(self._map, _HEAD_OFFSET, head)
+        return head
+
+    def append(self, kind, payload):
+        """Schreiber: Datensatz anhängen; liefert den Index"""
+        if len(payload) > self.max_payload:
+            raise ValueError(f"Datensatz zu groß für den Ring ({len(payload)} > {self.max_payload} Bytes)")
+        with self._lock:
+            index = self.head
+            if index - self.tail >= self.slots:
+                self.counts["overwritten"] += 1  # Reader is a full ring behind, the oldest record goes
+            offset = _HEADER_SIZE + (index % self.slots) * self.slot_size
+            start = offset + _SLOT_HEADER.size
+            # Payload first, the slot header (index + crc) makes it valid
+            self._map[start:start + len(payload)] = payload
+            _SLOT_HEADER.pack_into(self._map, offset, index, zlib.crc32(payload, kind), kind, len(payload))
+            _U64.pack_into(self._map, _HEAD_OFFSET, index + 1)
+            self.counts["written"] += 1
+            return index
+
+    def read(self, limit=None):
+        """Leser: neue Datensätze ab position als Liste (index, kind, payload), ohne zu bestätigen"""
+        records = []
+        while limit is None or len(records) < limit:
+            slot_index, kind, payload = self._slot(self.position)
+            if kind is not None:
+                records.append((self.position, kind, payload))
+                self.position += 1
+                continue
+            if slot_index > self.position:
+                # The writer lapped us: skip to the oldest record still in the ring
+                oldest = max(self.position + 1, self.head - self.slots)
+                self.counts["lost"] += oldest - self.position
+                logging.warning(f"Ring übergelaufen: {oldest - self.position} Datensätze verloren.")
+                self.position = oldest
+                continue
+            if self.position >= self.head:
+                break  # Nothing new (or the writer is in the middle of this slot)
+            # head is stored after the slot, so it is complete: read once more in case we raced the writer
+            if self._slot(self.position)[1] is None:
+                self.counts["corrupt"] += 1
+                logging.warning(f"Ring-Datensatz {self.position} beschädigt, übersprungen.")
+                self.position += 1
+        self.counts["read"] += len(records)
+        return records
+
+    def commit(self, position=None):
+        """Leser: alles vor position ist sicher übernommen (Pufferdatei), darf überschrieben werden"""
+        position = self.position if position is None else position
+        if position > self.tail:
+            _U64.pack_into(self._map, _TAIL_OFFSET, position)
+
+    def __len__(self):
+        """Noch nicht bestätigte Datensätze"""
+        return max(0, self.head - self.tail)
+
+    def stats(self):
+        return {**self.counts, "head": self.head, "tail": self.tail, "pending": len(self),
+                "slots": self.slots, "slot_size": self.slot_size, "budget_level": self.budget_level}
+
+
+class RingNotifier:
+    """Weckt den anderen Prozess über einen Unix-Datagram-Socket (abstrakter Namensraum)"""
+
+    def __init__(self, ring_path, role):
+        peer = "uplink" if role == "acquire" else "acquire"
+        self.address = f"\0frost-ring:{ring_path}:{role}"
+        self.peer_address = f"\0frost-ring:{ring_path}:{peer}"
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind(self.address)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def notify(self, message):
+        """Nachricht an die Gegenseite; läuft sie nicht, geht die Nachricht verloren (sie liest beim Start ohnehin)"""
+        try:
+            self.sock.sendto(message, self.peer_address)
+            return True
+        except OSError:
+            return False
+
+    def receive(self):
+        """Alle anstehenden Nachrichten abholen (Menge, doppelte zählen einmal)"""
+        messages = set()
+        while True:
+            try:
+                messages.add(self.sock.recv(16))
+            except (BlockingIOError, InterruptedError):
+                return messages
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,544 @@
+"""
+Kommandos mit Antwort (RPC) über MQTT v5 für das Frostwarnsystem
+
+Anfrage auf frostsystem/<device_id>/cmd (JSON):
+
+    {"command": "GET_HISTORY", "params": {"from": "...", "to": "..."}, "id": "42"}
+
+Die Antwort geht an die Response-Topic-Property der Anfrage, mit derselben
+Correlation Data. Fehlt die Property (MQTT 3.1.1-Client), wird an das
+Standard-Antworttopic geantwortet, sofern die Anfrage eine "id" trägt -
+sonst bleibt das Kommando wie früher ohne Antwort. Ältere Anfragen mit
+"value" statt "params" funktionieren weiter.
+
+Antwort (JSON):
+
+    {"id": "42", "command": "SET_THRESHOLD", "status": "ok", "result": {...}}
+    {"id": "42", "command": "FOO", "status": "error", "error": {"code": "unknown_command", "message": "..."}}
+
+GET_HISTORY(from, to, fields) liest einen Zeitbereich aus der CSV-Logdatei
+und streamt ihn als komprimierte Batch-Envelopes (frost_codec) an das
+Antworttopic, je Envelope höchstens chunk_rows Zeilen. Jedes Envelope trägt
+die User Properties "chunk", "rows" und "resume"; die abschließende
+JSON-Antwort enthält Zeilen- und Chunkzahl, "complete" und - wenn max_rows
+erreicht wurde - einen Resume-Token. GET_HISTORY {"resume": token} setzt
+genau nach dem letzten empfangenen Envelope fort, auch nach einem Neustart
+des Nodes. Die Logdatei wird binär gesucht und muss chronologisch sein.
+
+PROFILE_START/PROFILE_STOP/PROFILE_STATUS steuern Messungen auf Abruf
+(CPU, Speicher, Thread-Stacks); der Bericht geht komprimiert an das
+Diagnose-Topic, siehe frost_profiler.
+
+Ausgeführt werden die Kommandos im CommandExecutor (eigener Thread,
+begrenzte Warteschlange, Timeout je Kommando); on_message im
+Netzwerk-Thread von paho reiht nur ein.
+"""
+
+import base64
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from frost_codec import encode_envelope
+
+# Columns of the CSV log (see log_data() in frost_warning_mqtt.py), without the timestamp
+HISTORY_FIELDS = (
+    "dry_temp", "wet_temp", "humidity", "calc_wet_temp", "effective_wet_temp",
+    "battery_percent", "battery_voltage", "dcdc_voltage",
+)
+CSV_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"  # UTC
+ENVELOPE_CONTENT_TYPE = "application/x-frost-envelope"
+_SEEK_LINEAR_BYTES = 64 * 1024  # below this the binary search scans line by line
+
+
+class RPCError(Exception):
+    """Fehler, der als strukturierte Antwort (status "error") an den Aufrufer geht"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class StreamingResult:
+    """
+    Ergebnis eines Handlers, das in mehreren Nachrichten gesendet wird:
+    parts liefert (payload, [(name, wert), ...]) je Nachricht, danach
+    liefert summary() das Ergebnis für die abschließende JSON-Antwort.
+    """
+
+    def __init__(self, parts, summary):
+        self.parts = parts
+        self.summary = summary
+
+
+def parse_time(value):
+    """ISO-8601 (mit 'Z') oder Epoch-Sekunden -> Epoch-Sekunden; RPCError bei ungültigem Wert"""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise RPCError("invalid_params", f"Ungültige Zeitangabe: {value!r}")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def encode_resume_token(state):
+    raw = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_resume_token(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        state = json.loads(raw)
+        int(state["o"])
+        return state
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise RPCError("invalid_resume", "Resume-Token ungültig")
+
+
+class HistoryReader:
+    """
+    Liest Zeitbereiche aus der CSV-Logdatei (append-only, chronologisch).
+    Gesucht wird per Binärsuche über Byte-Offsets, damit auch ein
+    mehrjähriges Log auf dem Pi Zero nicht ganz gelesen werden muss.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def _line_ts(line):
+        try:
+            stamp = line.split(b",", 1)[0].decode("ascii")
+            return datetime.strptime(stamp, CSV_TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def _seek_start(self, f, data_start, size, start_ts):
+        """Offset einer Zeile vor oder an der ersten Zeile mit Zeitstempel >= start_ts"""
+        lo, hi = data_start, size
+        while hi - lo > _SEEK_LINEAR_BYTES:
+            mid = (lo + hi) // 2
+            f.seek(mid)
+            f.readline()  # rest of the line mid points into
+            ts = self._line_ts(f.readline())
+            if ts is not None and ts < start_ts:
+                lo = mid
+            else:
+                hi = mid
+        if lo == data_start:
+            return lo
+        f.seek(lo)
+        f.readline()
+        return f.tell()
+
+    def iter_rows(self, start_ts=None, end_ts=None, fields=HISTORY_FIELDS, offset=None):
+        """
+        Liefert (offset_nach_zeile, reading) für start_ts <= ts <= end_ts.
+        offset (aus einem Resume-Token) setzt direkt an einer Zeile fort.
+        """
+        indexes = [(name, HISTORY_FIELDS.index(name) + 1) for name in fields]
+        with open(self.path, "rb") as f:
+            header = f.readline()
+            data_start = f.tell() if header.startswith(b"Zeitstempel") else 0
+            size = os.fstat(f.fileno()).st_size
+            if offset is not None:
+                position = max(data_start, min(offset, size))
+            elif start_ts is not None:
+                position = self._seek_start(f, data_start, size, start_ts)
+            else:
+                position = data_start
+            f.seek(position)
+            for line in f:
+                position += len(line)
+                if not line.endswith(b"\n"):
+                    break  # row still being written
+                ts = self._line_ts(line)
+                if ts is None or (start_ts is not None and ts < start_ts):
+                    continue
+                if end_ts is not None and ts > end_ts:
+                    break
+                values = line.rstrip(b"\r\n").decode("utf-8", "replace").split(",")
+                if len(values) != len(HISTORY_FIELDS) + 1:
+                    continue
+                reading = {"timestamp": datetime.fromtimestamp(ts, timezone.utc).isoformat()}
+                for name, index in indexes:
+                    if values[index] != "":
+                        try:
+                            reading[name] = float(values[index])
+                        except ValueError:
+                            pass
+                yield position, reading
+
+    def inode(self):
+        try:
+            return os.stat(self.path).st_ino
+        except OSError:
+            return None
+
+    def stream(self, params, chunk_rows=200, max_rows=5000, compression=9):
+        """
+        GET_HISTORY: prüft die Parameter und liefert ein StreamingResult,
+        das die Datei erst beim Senden Chunk für Chunk liest.
+        """
+        if not os.path.exists(self.path):
+            raise RPCError("no_history", f"Keine lokale Logdatei ({self.path})")
+        offset = None
+        if params.get("resume"):
+            state = decode_resume_token(params["resume"])
+            if state.get("i") != self.inode():
+                raise RPCError("resume_expired", "Logdatei wurde ersetzt, Anfrage mit from/to neu stellen")
+            offset, start_ts, end_ts, fields = state["o"], state.get("f"), state.get("t"), state.get("k")
+        else:
+            start_ts, end_ts, fields = parse_time(params.get("from")), parse_time(params.get("to")), params.get("fields")
+            if start_ts is not None and end_ts is not None and end_ts < start_ts:
+                raise RPCError("invalid_params", "'to' liegt vor 'from'")
+        fields = list(fields) if fields else list(HISTORY_FIELDS)
+        unknown = [name for name in fields if name not in HISTORY_FIELDS]
+        if unknown:
+            raise RPCError("invalid_params", f"Unbekannte Felder: {', '.join(unknown)} (erlaubt: {', '.join(HISTORY_FIELDS)})")
+        try:
+            max_rows = max(1, min(int(params.get("max_rows", max_rows)), max_rows))
+        except (TypeError, ValueError):
+            raise RPCError("invalid_params", "'max_rows' muss eine Zahl sein")
+        inode = self.inode()
+        summary = {"rows": 0, "chunks": 0, "complete": True, "resume": None}
+
+        def token(position):
+            return encode_resume_token({"o": position, "i": inode, "f": start_ts, "t": end_ts, "k": fields})
+
+        def parts():
+            chunk, consumed = [], offset  # consumed: file offset after the last row put into a chunk
+            try:
+                for position, reading in self.iter_rows(start_ts, end_ts, fields, offset):
+                    if summary["rows"] + len(chunk) >= max_rows:
+                        summary["complete"] = False
+                        break
+                    chunk.append(reading)
+                    consumed = position
+                    if len(chunk) >= chunk_rows:
+                        yield self._chunk_part(chunk, summary, token(consumed), compression)
+                        chunk = []
+            except OSError as e:
+                logging.error(f"Fehler beim Lesen der Historie aus {self.path}: {e}")
+                summary["complete"] = False
+                summary["error"] = str(e)
+            if chunk:
+                yield self._chunk_part(chunk, summary, token(consumed), compression)
+            if not summary["complete"] and consumed is not None:
+                summary["resume"] = token(consumed)
+
+        return StreamingResult(parts(), lambda: summary)
+
+    @staticmethod
+    def _chunk_part(chunk, summary, resume, compression):
+        summary["rows"] += len(chunk)
+        summary["chunks"] += 1
+        properties = [("chunk", str(summary["chunks"])), ("rows", str(len(chunk))), ("resume", resume)]
+        return encode_envelope(chunk, compression), properties
+
+
+class CommandExecutor:
+    """
+    Führt Kommandos in einem eigenen Worker-Thread aus, damit der
+    Netzwerk-Thread von paho (Keepalive, PUBACKs) nie blockiert.
+
+    - Warteschlange mit fester Länge: ist sie voll, lehnt submit() ab.
+    - Zusammenfassen: Aufträge mit gleichem Schlüssel (z.B. eine Salve
+      GET_STATUS), die noch warten oder gerade laufen, bekommen das
+      Ergebnis desselben Durchlaufs.
+    - Timeout je Auftrag, gerechnet ab submit(): wer zu lange gewartet hat,
+      wird nicht mehr ausgeführt; ein Handler, der länger läuft, wird
+      aufgegeben und der Aufrufer bekommt den Fehler "timeout". Handler
+      laufen in einem einzigen, dauerhaften Handler-Thread; ein aufgegebener
+      läuft dort zu Ende (Ergebnis verworfen), bis dahin werden neue
+      Aufträge mit "busy" abgelehnt - es stauen sich keine hängenden
+      Threads, und kein Kommando wirkt noch, nachdem sein Aufrufer
+      "timeout" bekam, außer dem einen aufgegebenen.
+
+    Rückrufe on_done(result, error) laufen im Worker-Thread.
+    """
+
+    def __init__(self, max_queue=8, name="RPC_Executor"):
+        self.max_queue = max_queue
+        self.name = name
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._by_key = {}  # coalesce key -> job (waiting or running)
+        self._stop = False
+        self._thread = None
+        self._handler = None  # Long-lived thread running the handlers
+        self._handler_cond = threading.Condition()
+        self._handler_task = None  # Task handed to the handler thread, None once it has finished
+        self.counts = {"submitted": 0, "coalesced": 0, "rejected": 0, "executed": 0,
+                       "expired": 0, "timeouts": 0, "busy": 0, "errors": 0}
+
+    def submit(self, func, on_done, timeout, key=None):
+        """Auftrag einreihen: "queued", "coalesced", "full" oder "busy" (abgelehnt, ein aufgegebener Handler läuft noch)"""
+        if self.abandoned():
+            self.counts["busy"] += 1
+            return "busy"
+        with self._cond:
+            job = self._by_key.get(key) if key is not None else None
+            if job is not None:
+                job["callbacks"].append(on_done)
+                self.counts["coalesced"] += 1
+                return "coalesced"
+            if len(self._queue) >= self.max_queue:
+                self.counts["rejected"] += 1
+                return "full"
+            job = {"func": func, "callbacks": [on_done], "deadline": time.monotonic() + timeout, "key": key}
+            self._queue.append(job)
+            if key is not None:
+                self._by_key[key] = job
+            self.counts["submitted"] += 1
+            self._cond.notify()
+        return "queued"
+
+    def __len__(self):
+        return len(self._queue)
+
+    def start(self):
+        self._stop = False
+        if self._handler is None or not self._handler.is_alive():  # A hung handler keeps its thread
+            self._handler = threading.Thread(target=self._handle, name=f"{self.name}_job", daemon=True)
+            self._handler.start()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        with self._handler_cond:
+            self._handler_cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def abandoned(self):
+        """True, solange ein nach Timeout aufgegebener Handler noch läuft"""
+        with self._handler_cond:
+            return self._handler_task is not None and self._handler_task["abandoned"]
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        with self._cond:
+            return {**self.counts, "queued": len(self._queue), "max_queue": self.max_queue,
+                    "abandoned_running": self.abandoned()}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                job = self._queue.popleft()
+            try:
+                result, error = self._execute(job)
+            except Exception as e:  # never lose the worker
+                result, error = None, e
+            with self._cond:
+                if job["key"] is not None and self._by_key.get(job["key"]) is job:
+                    del self._by_key[job["key"]]
+                callbacks = list(job["callbacks"])
+            for on_done in callbacks:
+                try:
+                    on_done(result, error)
+                except Exception as e:
+                    self.counts["errors"] += 1
+                    logging.error(f"Fehler beim Beantworten eines Kommandos: {e}", exc_info=True)
+
+    def _handle(self):
+        while True:
+            with self._handler_cond:
+                while self._handler_task is None and not self._stop:
+                    self._handler_cond.wait()
+                if self._handler_task is None:
+                    return
+                task = self._handler_task
+            try:
+                task["result"] = task["func"]()
+            except Exception as e:
+                task["error"] = e
+            with self._handler_cond:
+                if task["abandoned"]:
+                    logging.warning(f"Aufgegebenes Kommando nach {time.monotonic() - task['started']:.1f}s beendet, "
+                                    f"Ergebnis verworfen.")
+                self._handler_task = None
+                task["done"].set()
+
+    def _execute(self, job):
+        remaining = job["deadline"] - time.monotonic()
+        if remaining <= 0:
+            self.counts["expired"] += 1
+            return None, RPCError("timeout", "Kommando hat zu lange in der Warteschlange gewartet")
+        with self._handler_cond:
+            if self._handler_task is not None:
+                self.counts["busy"] += 1
+                return None, RPCError("busy", "Ein aufgegebenes Kommando läuft noch, später erneut versuchen")
+            task = {"func": job["func"], "done": threading.Event(), "abandoned": False, "started": time.monotonic()}
+            self._handler_task = task
+            self._handler_cond.notify_all()
+        if not task["done"].wait(remaining):
+            with self._handler_cond:
+                if self._handler_task is task:
+                    task["abandoned"] = True
+            if task["abandoned"]:
+                self.counts["timeouts"] += 1
+                logging.warning("Kommando nach Timeout aufgegeben, läuft im Handler-Thread zu Ende; "
+                                "bis dahin werden neue Kommandos abgelehnt.")
+                return None, RPCError("timeout", "Kommando hat das Zeitlimit überschritten")
+        self.counts["executed"] += 1
+        return task.get("result"), task.get("error")
+
+
+class CommandDispatcher:
+    """
+    Nimmt Kommandos an und antwortet strukturiert. Handler bekommen die
+    Parameter als Dict und liefern ein Ergebnis-Dict, ein StreamingResult
+    oder werfen RPCError. Antworten gehen über send(messages): eine
+    Nachrichtenfolge [(topic, payload, qos, retain, properties), ...], die
+    der Uplink-Worker der Reihe nach und flussgesteuert sendet (Generatoren
+    werden erst beim Senden ausgewertet).
+
+    Mit executor prüft handle() nur die Anfrage und reiht sie ein -
+    geeignet für den Netzwerk-Thread von paho. Ohne executor läuft der
+    Handler direkt (Tests, frostctl).
+    """
+
+    def __init__(self, send, default_response_topic="", qos=1, executor=None, default_timeout=60.0):
+        self.send = send
+        self.default_response_topic = default_response_topic
+        self.qos = qos
+        self.executor = executor
+        self.default_timeout = default_timeout
+        self._handlers = {}  # command -> (handler, timeout, coalesce)
+        self.counts = {"requests": 0, "replies": 0, "errors": 0, "streams": 0}
+
+    def register(self, command, handler, timeout=None, coalesce=False):
+        """
+        coalesce: gleichzeitige Anfragen dieses Kommandos (gleiche Parameter)
+        teilen sich einen Durchlauf, jede bekommt ihre eigene Antwort.
+        """
+        self._handlers[command.upper()] = (handler, timeout or self.default_timeout, coalesce)
+
+    @property
+    def commands(self):
+        return sorted(self._handlers)
+
+    def handle(self, payload, properties=None):
+        """
+        Anfrage (bytes/str) mit MQTT v5 Properties. Ohne executor: Antwort
+        als Dict (ohne Stream-Teile); mit executor: "queued", "coalesced"
+        oder die Fehlerantwort, falls die Anfrage gleich abgelehnt wurde.
+        """
+        self.counts["requests"] += 1
+        response_topic = getattr(properties, "ResponseTopic", None) if properties is not None else None
+        correlation = getattr(properties, "CorrelationData", None) if properties is not None else None
+        reply = {"id": None, "command": "", "status": "ok"}
+        try:
+            request = self._parse(payload)
+            reply["id"] = request.get("id")
+            reply["command"] = command = str(request.get("command", "")).strip().upper()
+            params = request.get("params")
+            if params is None:
+                params = {"value": request["value"]} if "value" in request else {}
+            if not isinstance(params, dict):
+                raise RPCError("invalid_params", "'params' muss ein Objekt sein")
+            if command not in self._handlers:
+                raise RPCError("unknown_command", f"Unbekanntes Kommando '{command}' (bekannt: {', '.join(self.commands)})")
+        except RPCError as e:
+            return self._finish(reply, None, e, response_topic, correlation)
+        handler, timeout, coalesce = self._handlers[command]
+        logging.info(f"Verarbeite MQTT Kommando: {command}, Parameter: {params}")
+
+        def on_done(result, error):
+            self._finish(reply, result, error, response_topic, correlation)
+
+        if self.executor is None:
+            try:
+                result = handler(params)
+            except Exception as e:
+                return self._finish(reply, None, e, response_topic, correlation)
+            return self._finish(reply, result, None, response_topic, correlation)
+        key = (command, json.dumps(params, sort_keys=True, default=str)) if coalesce else None
+        state = self.executor.submit(lambda: handler(params), on_done, timeout, key)
+        if state == "full":
+            return self._finish(reply, None, RPCError("busy", "Zu viele Kommandos in der Warteschlange"),
+                                response_topic, correlation)
+        if state == "busy":
+            return self._finish(reply, None, RPCError("busy", "Ein aufgegebenes Kommando läuft noch, später erneut versuchen"),
+                                response_topic, correlation)
+        return state
+
+    @staticmethod
+    def _parse(payload):
+        try:
+            request = json.loads(payload)
+        except (TypeError, ValueError):
+            raise RPCError("invalid_request", "Payload ist kein JSON")
+        if not isinstance(request, dict):
+            raise RPCError("invalid_request", "Payload ist kein JSON-Objekt")
+        return request
+
+    def _finish(self, reply, result, error, response_topic, correlation):
+        """Antwort zusammenstellen und senden (an das Response Topic bzw. das Standardtopic bei "id")"""
+        reply = dict(reply)
+        command = reply["command"]
+        if isinstance(error, RPCError):
+            logging.warning(f"MQTT Kommando '{command}' abgelehnt: {error.code} - {error.message}")
+        elif error is not None:
+            logging.error(f"Fehler bei der Verarbeitung des MQTT Kommandos '{command}': {error}", exc_info=error)
+            error = RPCError("internal_error", str(error))
+        if error is not None:
+            self.counts["errors"] += 1
+            result = None
+            reply["status"] = "error"
+            reply["error"] = {"code": error.code, "message": error.message}
+
+        if not response_topic and reply["id"] is not None:
+            response_topic = self.default_response_topic
+        if not response_topic:
+            return reply  # fire-and-forget as with older servers
+        if isinstance(result, StreamingResult):
+            self.counts["streams"] += 1
+            self.send(self._stream_messages(response_topic, correlation, reply, result))
+        else:
+            if error is None:
+                reply["result"] = result
+            self.send([self._message(response_topic, correlation, json.dumps(reply, default=str))])
+        self.counts["replies"] += 1
+        return reply
+
+    def _message(self, topic, correlation, payload, user_properties=(), content_type="application/json"):
+        properties = Properties(PacketTypes.PUBLISH)
+        if correlation is not None:
+            properties.CorrelationData = correlation
+        properties.ContentType = content_type
+        for name, value in user_properties:
+            properties.UserProperty = (name, value)  # paho appends user properties
+        return topic, payload, self.qos, False, properties
+
+    def _stream_messages(self, topic, correlation, reply, result):
+        for payload, user_properties in result.parts:
+            yield self._message(topic, correlation, payload, user_properties, ENVELOPE_CONTENT_TYPE)
+        reply["result"] = result.summary()
+        yield self._message(topic, correlation, json.dumps(reply, default=str), [("final", "1")])
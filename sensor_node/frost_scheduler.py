@@ -0,0 +1,273 @@
+"""
+Zeitplaner für die wiederkehrenden Aufgaben des Frostwarnsystems
+
+Messung, Heartbeat, Metriken, Pufferdatei, Datenbudget, Überwachung und
+Konfigurationsprüfung laufen als Jobs eines Schedulers im asyncio-Loop
+statt in Schlafschleifen mit festen Takten:
+
+- Die Jobs liegen in einem Min-Heap nach Fälligkeit (monotone Zeit); der
+  Loop schläft genau bis zum nächsten fälligen Job. Gleichzeitig fällige
+  Jobs teilen sich ein Aufwachen.
+- trigger() und request() wecken sofort (threadsicher), z.B. für
+  GET_STATUS, eine geänderte Konfiguration oder eine PUBACK-Quittung, nach
+  der die Pufferdatei gespeichert werden muss. wake() wertet die
+  Intervalle nach einer Konfigurationsänderung neu aus.
+- interval kann eine Funktion sein (nach jedem Lauf neu ausgewertet, z.B.
+  Heartbeat je Datenbudget-Stufe). Gibt der Job selbst eine Zahl zurück,
+  ist das sein nächster Abstand ab Start (Messintervall). interval=None
+  heißt: läuft nur auf Anforderung.
+- Periodische Fälligkeiten bauen auf der vorigen Fälligkeit auf (keine
+  Drift). Startet ein Job mehr als tolerance Sekunden nach seiner
+  Fälligkeit, zählt er als verspätet; dabei ganz übersprungene Perioden
+  zählen als verpasst und werden nicht nachgeholt.
+"""
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+
+
+class Job:
+    """Ein Eintrag im Scheduler; Zähler für die Statistik"""
+
+    def __init__(self, name, func, interval, tolerance):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.tolerance = tolerance
+        self.due = None  # monotonic, None = not scheduled
+        self.running = False
+        self.on_demand = False  # The current/next run was triggered, not periodic
+        self.rerun_due = None  # request() while running: run again no later than this
+        self.version = 0  # Invalidates older heap entries
+        self.futures = []  # trigger(): resolved by the next run
+        self.rerun_futures = []  # trigger() while running: resolved by the rerun, not the run in progress
+        self.started = None
+        self.scheduled_due = None
+        self.counts = {"runs": 0, "triggered": 0, "late": 0, "missed": 0, "errors": 0}
+        self.max_late_s = 0.0
+        self.last_duration_s = None
+
+    def next_interval(self):
+        return self.interval() if callable(self.interval) else self.interval
+
+    def stats(self, now):
+        return {
+            **self.counts,
+            "max_late_s": round(self.max_late_s, 3),
+            "last_duration_s": round(self.last_duration_s, 3) if self.last_duration_s is not None else None,
+            "next_in_s": round(self.due - now, 1) if self.due is not None else None,
+            "running": self.running,
+        }
+
+
+class Scheduler:
+    """Deadline-basierter Job-Scheduler im asyncio-Loop (siehe Moduldokumentation)"""
+
+    def __init__(self, loop, tolerance=1.0, clock=time.monotonic):
+        self.loop = loop
+        self.tolerance = tolerance
+        self.clock = clock
+        self.jobs = {}
+        self.wakeups = 0
+        self._heap = []
+        self._counter = itertools.count()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._running = False
+        self._tasks = set()
+        self._loop_thread = threading.get_ident()
+
+    # --- configuration ---
+
+    def add(self, name, func, interval=None, delay=0.0, tolerance=None):
+        """Job anlegen; delay=None: erst auf Anforderung (trigger/request)"""
+        job = Job(name, func, interval, self.tolerance if tolerance is None else tolerance)
+        self.jobs[name] = job
+        if delay is not None:
+            self._schedule(job, self.clock() + delay)
+        return job
+
+    # --- thread-safe entry points ---
+
+    def _call(self, func, *args):
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def trigger(self, name):
+        """Job sofort ausführen; liefert ein concurrent.futures.Future mit dem Ergebnis des Laufs
+        (läuft der Job gerade: des Laufs danach, der nach der Anforderung beginnt)"""
+        future = Future()
+        self._call(self._trigger, name, future)
+        return future
+
+    def request(self, name, delay=0.0):
+        """Job spätestens in delay Sekunden ausführen (frühere Fälligkeit bleibt)"""
+        self._call(self._request, name, delay)
+
+    def wake(self):
+        """Intervalle neu auswerten (z.B. nach einer Konfigurationsänderung)"""
+        self._call(self._reevaluate)
+
+    def stop(self):
+        """Beenden; Futures von trigger(), deren Lauf nicht mehr beginnt, werden abgebrochen"""
+        self._call(self._stop)
+
+    @property
+    def running(self):
+        return self._running and not self._stopping
+
+    # --- loop side ---
+
+    def _schedule(self, job, due):
+        job.due = due
+        job.version += 1
+        heapq.heappush(self._heap, (due, next(self._counter), job.version, job))
+        self._wake.set()
+
+    def _trigger(self, name, future):
+        job = self.jobs[name]
+        if self._stopping:
+            future.cancel()  # No run will start any more
+            return
+        job.counts["triggered"] += 1
+        if job.running:
+            job.rerun_futures.append(future)
+            job.rerun_due = self.clock()  # Waits for the run in progress, then runs again
+        else:
+            job.futures.append(future)
+            job.on_demand = True
+            self._schedule(job, self.clock())
+
+    def _request(self, name, delay):
+        job = self.jobs[name]
+        due = self.clock() + delay
+        if job.running:
+            job.rerun_due = due if job.rerun_due is None else min(job.rerun_due, due)
+        elif job.due is None or due < job.due:
+            job.on_demand = job.due is None or job.on_demand
+            self._schedule(job, due)
+
+    def _reevaluate(self):
+        now = self.clock()
+        for job in self.jobs.values():
+            if job.running or job.due is None or job.started is None or not callable(job.interval):
+                continue
+            interval = job.next_interval()
+            if interval is not None and job.started + interval < job.due:
+                self._schedule(job, max(now, job.started + interval))
+
+    def _stop(self):
+        self._stopping = True
+        for job in self.jobs.values():
+            if not job.running:
+                self._cancel_futures(job)  # Due or on demand, but never started now
+        self._wake.set()
+
+    @staticmethod
+    def _cancel_futures(job):
+        for future in job.futures + job.rerun_futures:
+            future.cancel()
+        job.futures = []
+        job.rerun_futures = []
+
+    async def run(self):
+        """Jobs ausführen, bis stop() aufgerufen wird"""
+        self._running = True
+        try:
+            while not self._stopping:
+                now = self.clock()
+                while self._heap and self._heap[0][2] != self._heap[0][3].version:
+                    heapq.heappop(self._heap)  # Rescheduled meanwhile
+                if self._heap and self._heap[0][0] <= now:
+                    job = heapq.heappop(self._heap)[3]
+                    self._start(job, now)
+                    continue
+                self._wake.clear()
+                timeout = self._heap[0][0] - now if self._heap else None
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeups += 1
+        finally:
+            self._running = False
+
+    async def join(self, timeout=None):
+        """Auf laufende Jobs warten (beim Herunterfahren)"""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+
+    def _start(self, job, now):
+        late = now - job.due
+        if not job.on_demand and late > job.tolerance:
+            job.counts["late"] += 1
+            job.max_late_s = max(job.max_late_s, late)
+            logging.debug(f"Job {job.name} startet {late:.1f}s verspätet.")
+        job.scheduled_due = job.due
+        job.due = None
+        job.running = True
+        job.started = now
+        task = self.loop.create_task(self._run_job(job), name=f"job-{job.name}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_job(self, job):
+        result = None
+        try:
+            result = job.func()
+            if inspect.isawaitable(result):
+                result = await result
+        except Exception as e:
+            job.counts["errors"] += 1
+            logging.error(f"Fehler im Job {job.name}: {e}", exc_info=True)
+            result = None
+        now = self.clock()
+        job.counts["runs"] += 1
+        job.last_duration_s = now - job.started
+        job.running = False
+        futures, job.futures = job.futures, job.rerun_futures
+        job.rerun_futures = []
+        for future in futures:
+            if not future.done():
+                future.set_result(result)
+
+        on_demand, job.on_demand = job.on_demand, False
+        due = None
+        if isinstance(result, (int, float)) and not isinstance(result, bool):
+            due = job.started + result  # The job chose its next delay
+        else:
+            interval = job.next_interval()
+            if interval:
+                base = job.started if on_demand else job.scheduled_due
+                due = base + interval
+                if due <= now:
+                    # Overran whole periods (late start or long run): skip them, count them as missed
+                    skipped = math.floor((now - base) / interval)
+                    job.counts["missed"] += skipped
+                    due = base + (skipped + 1) * interval
+        if job.rerun_due is not None:
+            due = job.rerun_due if due is None else min(due, job.rerun_due)
+            job.on_demand = True
+            job.rerun_due = None
+        if due is not None and not self._stopping:
+            self._schedule(job, max(due, now))
+        elif self._stopping:
+            self._cancel_futures(job)  # The rerun they wait for will not happen
+
+    def stats(self):
+        now = self.clock()
+        return {
+            "wakeups": self.wakeups,
+            "late": sum(job.counts["late"] for job in self.jobs.values()),
+            "missed": sum(job.counts["missed"] for job in self.jobs.values()),
+            "jobs": {name: job.stats(now) for name, job in self.jobs.items()},
+        }
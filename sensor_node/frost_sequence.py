@@ -0,0 +1,67 @@
+"""
+Fortlaufende Messwert-Nummern für das Frostwarnsystem
+
+Jeder Messwert bekommt eine Sequenznummer ("seq"), die pro Gerät über
+Neustarts hinweg lückenlos weiterzählt, und die Boot-Epoche ("boot"), die
+bei jedem Start des Skripts um eins steigt. Damit kann der Server (Node-RED,
+"Detect Sequence Gaps") unterscheiden:
+
+- Lücke in seq: Messwert wurde erfasst, ist aber nie angekommen (Puffer
+  gekürzt, Absturz vor dem Speichern, ...),
+- Zeitlücke ohne Lücke in seq: es wurde nichts gemessen (Skript/Pi aus),
+- seq springt bei neuer Epoche zurück: Zählerstand verloren (Datei gelöscht,
+  SD-Karte getauscht), der Server beginnt eine neue Zählung.
+
+Der Stand wird nach jeder Nummer atomar geschrieben (eine kleine Datei pro
+Messung, wie die CSV-Zeile), damit ein Absturz keine Nummern doppelt vergibt.
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+class ReadingSequence:
+    """Vergibt (boot, seq) für Messwerte und hält den Stand in state_file"""
+
+    def __init__(self, state_file=None):
+        self.state_file = state_file
+        self.boot = 0
+        self.seq = 0  # Last number handed out
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Stand laden und eine neue Boot-Epoche beginnen (einmal beim Start)"""
+        data = {}
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Sequenzdatei {self.state_file} nicht lesbar: {e} - Zählung beginnt neu.")
+                data = {}
+        with self._lock:
+            self.seq = int(data.get("seq", 0))
+            self.boot = int(data.get("boot", 0)) + 1
+            self._save_locked()
+        logging.info(f"Messwert-Sequenz: Boot-Epoche {self.boot}, nächste Nummer {self.seq + 1}.")
+        return self.boot
+
+    def next(self):
+        """Nächste Nummer vergeben und sofort speichern: (boot, seq)"""
+        with self._lock:
+            self.seq += 1
+            self._save_locked()
+            return self.boot, self.seq
+
+    def _save_locked(self):
+        if not self.state_file:
+            return
+        tmp = self.state_file + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"boot": self.boot, "seq": self.seq}, f)
+            os.replace(tmp, self.state_file)
+        except OSError as e:
+            logging.warning(f"Sequenzdatei {self.state_file} konnte nicht gespeichert werden: {e}")
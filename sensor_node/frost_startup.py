@@ -0,0 +1,94 @@
+"""
+Startzeit-Messung für das Frostwarnsystem
+
+Nach einem Neustart durch den Watchdog zählt, wie schnell der erste Messwert
+beim Broker ist. StartupTimer misst die Phasen des Starts ab dem Start des
+Prozesses (inkl. Interpreter und Imports, aus /proc/self/stat):
+
+- phase(name): Dauer eines Abschnitts (auch parallel aus mehreren Threads,
+  z.B. 1-Wire, DHT22 und ADS1115 gleichzeitig),
+- mark(name): Zeitpunkt eines Ereignisses (erstes CONNACK, erster Messwert,
+  erster vom Broker bestätigter Messwert = time-to-first-publish).
+
+Der Bericht landet im Log, in der lokalen API (/status), im ersten
+Metrics-Paket und in einer JSON-Datei, die "frostctl startbench" nach
+Neustarts des Dienstes auswertet.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def process_start_monotonic():
+    """Start dieses Prozesses auf der time.monotonic()-Skala (Linux), sonst jetzt"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.monotonic() - max(0.0, age)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic()
+
+
+class StartupTimer:
+    """Phasen und Ereignisse des Starts relativ zum Prozessstart (siehe Moduldokumentation)"""
+
+    def __init__(self, t0=None):
+        self.t0 = process_start_monotonic() if t0 is None else t0
+        self.phases = {}  # name -> (start_s, duration_s)
+        self.marks = {}   # name -> s since process start (first occurrence)
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.monotonic() - self.t0
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = (round(start - self.t0, 3), round(time.monotonic() - start, 3))
+
+    def mark(self, name):
+        """Ereignis festhalten (nur das erste zählt); True, wenn es neu war"""
+        with self._lock:
+            if name in self.marks:
+                return False
+            self.marks[name] = round(self.elapsed(), 3)
+            return True
+
+    def report(self):
+        with self._lock:
+            return {
+                "phases": {name: {"start_s": start, "duration_s": duration}
+                           for name, (start, duration) in sorted(self.phases.items(), key=lambda item: item[1][0])},
+                "marks": dict(sorted(self.marks.items(), key=lambda item: item[1])),
+            }
+
+    def log_summary(self, target_s=None):
+        """Phasen ins Log schreiben; Warnung, wenn der erste Messwert das Ziel verfehlt hat"""
+        report = self.report()
+        for name, phase in report["phases"].items():
+            logging.info(f"Start: {name:<14} ab {phase['start_s']:6.2f}s, Dauer {phase['duration_s']:6.2f}s")
+        for name, at in report["marks"].items():
+            logging.info(f"Start: {name:<14} nach {at:6.2f}s")
+        first = report["marks"].get("first_publish")
+        if first is not None and target_s and first > target_s:
+            logging.warning(f"Erster Messwert erst nach {first:.1f}s beim Broker (Ziel {target_s:.0f}s).")
+        return report
+
+    def save(self, path, **extra):
+        """Bericht atomar als JSON schreiben (für frostctl startbench)"""
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({**self.report(), **extra}, f, indent=2)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"Startbericht {path} konnte nicht gespeichert werden: {e}")
@@ -0,0 +1,976 @@
+"""
+Uplink-Bausteine für das Frostwarnsystem (MQTT über GPRS)
+
+- DeliveryLedger: Verfolgt gesendete Messwerte per MID bis zur QoS-1-Bestätigung
+  (PUBACK -> on_publish). Erst dann gilt ein Messwert als zugestellt und fällt
+  aus dem dauerhaften Puffer. Unbestätigte Messwerte werden nach Ablauf des
+  Ack-Timeouts wieder in den Puffer gelegt.
+- AdaptiveBatchSizer: Batchgröße für Envelopes (siehe frost_codec.py) abhängig
+  von der Ack-Latenz.
+- SessionResumeStats: Zählt, wie oft eine persistente MQTT-v5-Sitzung beim
+  Reconnect übernommen wurde und wie viele Bytes dadurch nicht erneut
+  übertragen werden mussten.
+- ReplayFlowController: Flusskontrolle für den Pufferabbau - Fenster
+  unbestätigter Nachrichten (taktet über PUBACKs), Byte-Obergrenze pro
+  Sekunde und Anpassung des Fensters an die Ack-Latenz.
+- UplinkWorker: Ein einziger Thread besitzt Sendewarteschlangen und Puffer,
+  sendet nach Prioritätsklassen (Alarm > Live > Status > Rückstand) und wird
+  über Ereignisse geweckt (neuer Messwert, Connect, PUBACK).
+- TopicAliasManager: MQTT-v5-Topic-Aliase - das lange Topic
+  (frostsystem/<uuid>/...) wird pro Verbindung nur einmal übertragen.
+- TLSSessionCache: TLS-Sitzungswiederaufnahme (Session Ticket/ID) beim
+  Reconnect - spart Zertifikatskette und Schlüsselaustausch.
+"""
+
+import bisect
+import collections
+import contextlib
+import logging
+import ssl
+import threading
+import time
+from collections.abc import Mapping
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+# Obergrenzen der Ack-Latenz-Histogrammklassen in Sekunden (letzte Klasse = darüber)
+ACK_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120)
+
+
+class LatencyHistogram:
+    """Einfaches Histogramm mit festen Klassen (nicht threadsicher, Aufrufer sperrt)"""
+
+    def __init__(self, bounds=ACK_LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def as_dict(self):
+        labels = [f"le_{b}" for b in self.bounds] + ["inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.total,
+            "avg_s": round(self.sum / self.total, 3) if self.total else None,
+            "max_s": round(self.max, 3),
+        }
+
+
+class DeliveryLedger:
+    """
+    Zustellbuch für QoS-1-Messwerte.
+
+    track(mid, payloads) nach erfolgreichem client.publish(), ack(mid) aus
+    on_publish. Eine MID kann einen einzelnen Messwert oder ein ganzes
+    Batch-Envelope (Liste) abdecken. PUBACKs können vor track() eintreffen
+    (Netzwerk-Thread ist schneller als der Aufrufer) - solche frühen Acks
+    werden kurz vorgemerkt.
+
+    Nach einem Reconnect sendet paho offene QoS-1-Nachrichten selbst erneut
+    (mit oder ohne übernommene Sitzung), on_reconnect() startet nur deren
+    Timeout neu. Was trotzdem ohne PUBACK bleibt, gibt expire() nach
+    ack_timeout zum erneuten Puffern heraus.
+
+    on_ack(latency_s) und on_timeout() werden ohne gehaltene Sperre aufgerufen
+    (z.B. für die adaptive Batchgröße).
+    """
+
+    def __init__(self, ack_timeout=120.0, on_ack=None, on_timeout=None):
+        self.ack_timeout = ack_timeout
+        self.on_ack = on_ack
+        self.on_timeout = on_timeout
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict()  # mid -> [payloads, sent_ts, first_sent_ts]
+        self._early_acks = collections.OrderedDict()  # mid -> ack_ts
+        self._histogram = LatencyHistogram()
+        self.counts = {"tracked": 0, "acked": 0, "requeued": 0, "resent_by_client": 0}
+
+    def track(self, mid, payloads):
+        """payloads: ein Messwert (dict oder frost_reading.Reading) oder eine Liste (Batch) unter einer MID"""
+        if isinstance(payloads, Mapping):
+            payloads = [payloads]
+        now = time.monotonic()
+        with self._lock:
+            self.counts["tracked"] += len(payloads)
+            early = self._early_acks.pop(mid, None)
+            if early is None:
+                self._pending[mid] = [payloads, now, now]
+                return
+            self.counts["acked"] += len(payloads)
+            self._histogram.observe(0.0)
+        if self.on_ack:
+            self.on_ack(0.0)
+
+    def ack(self, mid):
+        """Bestätigt eine MID. Liefert die Messwerte (Liste) oder None (unbekannte MID, z.B. Status)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._pending.pop(mid, None)
+            if entry is None:
+                self._early_acks[mid] = now
+                while len(self._early_acks) > 256:
+                    self._early_acks.popitem(last=False)
+                return None
+            latency = now - entry[2]
+            self.counts["acked"] += len(entry[0])
+            self._histogram.observe(latency)
+        if self.on_ack:
+            self.on_ack(latency)
+        return entry[0]
+
+    def on_reconnect(self):
+        """Paho sendet offene QoS-1-Nachrichten nach dem Reconnect selbst erneut (DUP) - Timeout neu starten"""
+        now = time.monotonic()
+        with self._lock:
+            for entry in self._pending.values():
+                entry[1] = now
+            self.counts["resent_by_client"] += len(self._pending)
+
+    def expire(self, now=None):
+        """Entfernt überfällige Einträge und liefert deren Messwerte zum erneuten Puffern (älteste zuerst)"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._lock:
+            for mid in [m for m, e in self._pending.items() if now - e[1] >= self.ack_timeout]:
+                expired.extend(self._pending.pop(mid)[0])
+            self.counts["requeued"] += len(expired)
+        if expired and self.on_timeout:
+            self.on_timeout()
+        return expired
+
+    def has_expired(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return any(now - e[1] >= self.ack_timeout for e in self._pending.values())
+
+    def pending_payloads(self):
+        """Kopie der unbestätigten Messwerte (für die dauerhafte Pufferdatei)"""
+        with self._lock:
+            return [p for e in self._pending.values() for p in e[0]]
+
+    def __len__(self):
+        """Anzahl unbestätigter Messwerte (nicht MIDs)"""
+        with self._lock:
+            return sum(len(e[0]) for e in self._pending.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counts,
+                "pending": sum(len(e[0]) for e in self._pending.values()),
+                "pending_mids": len(self._pending),
+                "ack_latency": self._histogram.as_dict(),
+            }
+
+
+def subscribe_packet_bytes(topic):
+    """Größe SUBSCRIBE (MQTT v5, ein Topic, leere Properties) + SUBACK in Bytes"""
+    topic_len = len(topic.encode("utf-8"))
+    remaining = 2 + 1 + 2 + topic_len + 1  # Packet-ID, Property-Länge, Topic, Optionen
+    subscribe = 1 + _varint_len(remaining) + remaining
+    suback = 2 + 2 + 1 + 1  # Fixed Header, Packet-ID, Property-Länge, Reason Code
+    return subscribe + suback
+
+
+def _varint_len(value):
+    length = 1
+    while value >= 128:
+        value //= 128
+        length += 1
+    return length
+
+
+# Property-Bytes für einen Topic Alias (Identifier 0x23 + uint16)
+TOPIC_ALIAS_PROPERTY_BYTES = 3
+
+
+def publish_packet_bytes(topic, payload_len, qos=1, property_len=0):
+    """Größe eines PUBLISH (MQTT v5) + PUBACK in Bytes; property_len z.B. TOPIC_ALIAS_PROPERTY_BYTES"""
+    remaining = 2 + len(topic.encode("utf-8")) + (2 if qos else 0) + 1 + property_len + payload_len
+    publish = 1 + _varint_len(remaining) + remaining
+    return publish + (4 if qos else 0)
+
+
+class AdaptiveBatchSizer:
+    """
+    Batchgröße für den Pufferabbau nach Verbindungsqualität (AIMD):
+    schnelle PUBACKs -> Batch wächst additiv, Timeouts/Fehler -> Batch halbiert.
+    """
+
+    def __init__(self, initial=50, minimum=5, maximum=500, target_latency=5.0):
+        self._lock = threading.Lock()
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.size = max(minimum, min(maximum, initial))
+
+    def on_ack(self, latency):
+        with self._lock:
+            if latency <= self.target_latency:
+                self.size = min(self.maximum, self.size + max(1, self.size // 4))
+            elif latency > 2 * self.target_latency:
+                self.size = max(self.minimum, int(self.size * 0.75))
+
+    def on_failure(self):
+        with self._lock:
+            self.size = max(self.minimum, self.size // 2)
+
+    def current(self):
+        with self._lock:
+            return self.size
+
+
+class SessionResumeStats:
+    """Statistik über Reconnects mit/ohne übernommene Broker-Sitzung"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.resumed = 0
+        self.subscribe_bytes_saved = 0
+        self.inflight_resumed = 0
+        self.last = None
+
+    def record(self, session_present, subscribe_bytes=0, inflight_msgs=0):
+        """
+        Erfasst einen Connect. Bei übernommener Sitzung entfällt das erneute
+        Abonnieren; offene QoS-1-Nachrichten laufen in der Sitzung weiter.
+        """
+        with self._lock:
+            self.connects += 1
+            saved = 0
+            if session_present:
+                self.resumed += 1
+                self.subscribe_bytes_saved += subscribe_bytes
+                self.inflight_resumed += inflight_msgs
+                saved = subscribe_bytes
+            self.last = {"session_present": bool(session_present), "bytes_saved": saved,
+                         "inflight_msgs": inflight_msgs}
+            return saved
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "resumed": self.resumed,
+                "subscribe_bytes_saved": self.subscribe_bytes_saved,
+                "inflight_resumed": self.inflight_resumed,
+                "last": self.last,
+            }
+
+
+class _TimedSSLSocket(ssl.SSLSocket):
+    """SSLSocket, der die Dauer des Handshakes festhält (paho ruft do_handshake() selbst auf)"""
+
+    handshake_seconds = None
+
+    def do_handshake(self, *args, **kwargs):
+        start = time.monotonic()
+        super().do_handshake(*args, **kwargs)
+        self.handshake_seconds = time.monotonic() - start
+
+
+class _ResumingSSLContext(ssl.SSLContext):
+    """SSLContext, der jedem neuen Socket die zuletzt gemerkte Sitzung mitgibt"""
+
+    sslsocket_class = _TimedSSLSocket
+    session_cache = None
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        cache = self.session_cache
+        if cache is not None and cache.enabled and kwargs.get("session") is None and not kwargs.get("server_side"):
+            kwargs["session"] = cache.session_for(self)
+        return super().wrap_socket(sock, *args, **kwargs)
+
+
+class TLSSessionCache:
+    """
+    Merkt sich die TLS-Sitzung der letzten MQTT-Verbindung und bietet sie
+    beim nächsten Connect zur Wiederaufnahme an (TLS 1.3 PSK/Session
+    Ticket, TLS 1.2 Session ID/Ticket). Ein wiederaufgenommener Handshake
+    überträgt keine Zertifikatskette und braucht bei TLS 1.2 einen
+    Round-Trip weniger.
+
+    context() liefert den SSLContext für client.tls_set_context() (einmal
+    anlegen - eine Sitzung gilt nur für den Kontext, der sie erzeugt hat),
+    capture(client.socket()) in on_connect übernimmt die Sitzung (bei
+    TLS 1.3 kommt das Ticket erst nach dem Handshake, spätestens mit dem
+    CONNACK). Lehnt der Server die Sitzung ab (z.B. neue Ticket-Schlüssel
+    nach Neustart), folgt ein normaler voller Handshake.
+
+    Die Sitzung liegt nur im Speicher: Pythons ssl-Modul kann SSLSession
+    nicht serialisieren, nach einem Neustart des Skripts ist der erste
+    Handshake daher wieder voll.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.session = None
+        self._session_context = None
+        self._lock = threading.Lock()
+        self.counts = {"full": 0, "resumed": 0}
+        self._handshake = {"full": LatencyHistogram(bounds=(0.5, 1, 2, 5, 10, 30)),
+                           "resumed": LatencyHistogram(bounds=(0.5, 1, 2, 5, 10, 30))}
+        self.last = None
+
+    def context(self, ca_certs=None, certfile=None, keyfile=None, insecure=False):
+        """Client-SSLContext mit Zertifikatsprüfung (System-CAs oder ca_certs)"""
+        ctx = _ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        if ca_certs:
+            ctx.load_verify_locations(cafile=ca_certs)
+        else:
+            ctx.load_default_certs()
+        if certfile:
+            ctx.load_cert_chain(certfile, keyfile or None)
+        if insecure:
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        ctx.session_cache = self
+        return ctx
+
+    def capture(self, sock):
+        """Nach erfolgreichem Connect: Handshake auswerten und Sitzung für den nächsten Connect merken"""
+        if not isinstance(sock, ssl.SSLSocket):
+            return None
+        kind = "resumed" if sock.session_reused else "full"
+        seconds = getattr(sock, "handshake_seconds", None)
+        with self._lock:
+            self.counts[kind] += 1
+            if seconds is not None:
+                self._handshake[kind].observe(seconds)
+            self.last = {"kind": kind, "handshake_s": round(seconds, 3) if seconds is not None else None,
+                         "version": sock.version()}
+            if self.enabled:
+                session = sock.session
+                if session is not None:
+                    self.session = session
+                    self._session_context = sock.context
+            return kind
+
+    def session_for(self, context):
+        """Gemerkte Sitzung, falls sie zu diesem SSLContext gehört"""
+        with self._lock:
+            return self.session if self._session_context is context else None
+
+    def clear(self):
+        with self._lock:
+            self.session = None
+            self._session_context = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                **self.counts,
+                "cached": self.session is not None,
+                "last": self.last,
+                "handshake_full": self._handshake["full"].as_dict(),
+                "handshake_resumed": self._handshake["resumed"].as_dict(),
+            }
+
+
+class TopicAliasManager:
+    """
+    Vergibt MQTT-v5-Topic-Aliase (1..TopicAliasMaximum aus dem CONNACK).
+
+    Die erste Nachricht auf einem Topic überträgt Topic + Alias, alle weiteren
+    nur noch den Alias mit leerem Topic. Die Zuordnung gilt nur für eine
+    Verbindung: on_connect() setzt sie zurück und schreibt die von paho noch
+    gehaltenen Nachrichten (werden nach dem CONNACK erneut gesendet) wieder
+    auf das volle Topic um. resolve() und client.publish() müssen unter
+    derselben Sperre laufen, damit die Reihenfolge auf der Leitung stimmt.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.maximum = 0
+        self._aliases = {}  # topic -> alias (auf dieser Verbindung bekannt)
+        self._topics = {}  # alias -> topic
+        self.counts = {"full": 0, "aliased": 0, "bytes_saved": 0}
+
+    def on_connect(self, properties=None, client=None):
+        """Nach CONNACK: Alias-Maximum übernehmen, Zuordnung zurücksetzen, paho-Warteschlange umschreiben"""
+        maximum = getattr(properties, "TopicAliasMaximum", 0) if properties is not None else 0
+        with self._lock:
+            self.maximum = maximum if self.enabled else 0
+            topics = dict(self._topics)
+            self._aliases.clear()
+            self._topics.clear()
+        if client is not None and topics:
+            self._restore_topics(client, topics)
+
+    @staticmethod
+    def _restore_topics(client, topics):
+        # Messages still held by paho are re-sent on the new connection, where the
+        # alias mapping is unknown to the broker -> send them with the full topic.
+        # paho has no public API for this, hence the access to _out_messages.
+        with client._out_message_mutex:
+            for message in client._out_messages.values():
+                alias = getattr(message.properties, "TopicAlias", None) if message.properties else None
+                if alias is None:
+                    continue
+                if not message.topic and alias in topics:
+                    message.topic = topics[alias].encode("utf-8")  # setter expects bytes
+                del message.properties.TopicAlias
+
+    def resolve(self, topic, properties=None):
+        """Liefert (topic, properties) für client.publish(); vorhandene PUBLISH-Properties werden ergänzt"""
+        with self._lock:
+            alias = self._aliases.get(topic)
+            if alias is not None:
+                self.counts["aliased"] += 1
+                self.counts["bytes_saved"] += len(topic.encode("utf-8")) - TOPIC_ALIAS_PROPERTY_BYTES
+                return "", self._with_alias(properties, alias)
+            self.counts["full"] += 1
+            if len(self._aliases) >= self.maximum:
+                return topic, properties
+            alias = len(self._aliases) + 1
+            self._aliases[topic] = alias
+            self._topics[alias] = topic
+            self.counts["bytes_saved"] -= TOPIC_ALIAS_PROPERTY_BYTES
+            return topic, self._with_alias(properties, alias)
+
+    @staticmethod
+    def _with_alias(properties, alias):
+        properties = properties if properties is not None else Properties(PacketTypes.PUBLISH)
+        properties.TopicAlias = alias
+        return properties
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, "maximum": self.maximum, "active": len(self._aliases)}
+
+
+class ReplayFlowController:
+    """
+    Flusskontrolle für den Pufferabbau über eine langsame Verbindung.
+
+    try_acquire(nbytes) gibt einen Sendeplatz frei, wenn im Fenster Platz ist
+    (weniger als `window` unbestätigte Replay-Nachrichten) und die
+    Byte-Obergrenze das Senden erlaubt - sonst die Wartezeit in Sekunden.
+    Jeder PUBACK (on_ack) gibt einen Platz frei - das Senden wird so von der
+    Ack-Rate getaktet. Das Fenster wächst additiv bei schnellen Acks
+    und wird bei langsamen Acks bzw. Timeouts verkleinert (AIMD).
+    """
+
+    THROUGHPUT_WINDOW = 60.0  # s, gleitendes Fenster für die Durchsatzmessung
+
+    def __init__(self, window=4, min_window=1, max_window=20, max_bytes_per_sec=0, target_latency=5.0):
+        self._lock = threading.Lock()
+        self.min_window = min_window
+        self.max_window = max_window
+        self.window = max(min_window, min(max_window, window))
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.target_latency = target_latency
+        self._inflight = {}  # mid -> (sent_ts, nbytes, readings)
+        self._next_send = 0.0
+        self._acked = collections.deque()  # (ack_ts, nbytes, readings)
+        self._histogram = LatencyHistogram()
+        self._blocked_since = 0.0
+        self.counts = {"sent_msgs": 0, "sent_bytes": 0, "acked_msgs": 0, "acked_bytes": 0, "acked_readings": 0,
+                       "window_shrinks": 0, "wait_s": 0.0}
+
+    def try_acquire(self, nbytes, poll=1.0):
+        """0 = Senden erlaubt (Platz reserviert), sonst Sekunden bis zum nächsten Versuch"""
+        with self._lock:
+            now = time.monotonic()
+            if len(self._inflight) >= self.window:
+                self._blocked_since = self._blocked_since or now
+                return poll  # on_ack wakes the sender earlier
+            if now < self._next_send:
+                self._blocked_since = self._blocked_since or now
+                return self._next_send - now
+            if self._blocked_since:
+                self.counts["wait_s"] += now - self._blocked_since
+                self._blocked_since = 0.0
+            if self.max_bytes_per_sec > 0:
+                # Pace: the next message may start once this one has drained at the ceiling rate
+                self._next_send = now + nbytes / float(self.max_bytes_per_sec)
+            return 0
+
+    def on_sent(self, mid, nbytes, readings=1):
+        with self._lock:
+            self._inflight[mid] = (time.monotonic(), nbytes, readings)
+            self.counts["sent_msgs"] += 1
+            self.counts["sent_bytes"] += nbytes
+
+    def on_ack(self, mid):
+        """PUBACK aus on_publish; liefert True für Replay-Nachrichten"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._inflight.pop(mid, None)
+            if entry is None:
+                return False
+            sent_ts, nbytes, readings = entry
+            latency = now - sent_ts
+            self._histogram.observe(latency)
+            self._acked.append((now, nbytes, readings))
+            self.counts["acked_msgs"] += 1
+            self.counts["acked_bytes"] += nbytes
+            self.counts["acked_readings"] += readings
+            if latency <= self.target_latency:
+                self.window = min(self.max_window, self.window + 1)
+            elif latency > 2 * self.target_latency:
+                self._shrink()
+            return True
+
+    def _shrink(self):
+        self.window = max(self.min_window, self.window // 2)
+        self.counts["window_shrinks"] += 1
+
+    def on_timeout(self):
+        """Ack-Timeout im Zustellbuch - Leitung überlastet"""
+        with self._lock:
+            self._shrink()
+
+    def on_disconnect(self):
+        """Verbindung weg: offene Replay-Nachrichten nicht mehr zählen (paho sendet sie neu)"""
+        with self._lock:
+            self._inflight.clear()
+            self._next_send = 0.0
+            self._blocked_since = 0.0
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._acked and now - self._acked[0][0] > self.THROUGHPUT_WINDOW:
+                self._acked.popleft()
+            recent_bytes = sum(b for _, b, _ in self._acked)
+            recent_readings = sum(r for _, _, r in self._acked)
+            return {
+                **{k: round(v, 1) if isinstance(v, float) else v for k, v in self.counts.items()},
+                "window": self.window,
+                "inflight": len(self._inflight),
+                "throughput_bps": round(recent_bytes / self.THROUGHPUT_WINDOW, 1),
+                "throughput_readings_per_min": recent_readings,
+                "ack_latency": self._histogram.as_dict(),
+            }
+
+
+# Priority classes of the uplink scheduler (lower value = sent first)
+PRIORITY_ALERT = 0
+PRIORITY_LIVE = 1
+PRIORITY_STATUS = 2
+PRIORITY_BACKLOG = 3
+
+BACKLOG_ORDERS = ("oldest", "newest")
+
+
+class UplinkWorker:
+    """
+    Einziger Sende-Thread des Uplinks mit Prioritätsklassen:
+    Alarme > neue Messwerte > Status/Metriken > Antworten (RPC-Streams) >
+    Rückstand (Puffer).
+
+    Der Worker besitzt den Puffer (chronologisch) und ist der einzige, der
+    ihn verändert - andere Threads legen nur per submit()/submit_message()
+    in die Eingänge. Geweckt wird über wake() (Connect, PUBACK) statt über
+    Polling; ohne Ereignis läuft höchstens alle idle_interval Sekunden ein
+    Schritt (Ack-Timeouts). Der Rückstand wird häppchenweise gesendet; vor
+    jedem Häppchen kommen höher priorisierte Nachrichten zuerst dran.
+    backlog_order "oldest" sendet den Rückstand chronologisch, "newest"
+    die jüngsten Messwerte zuerst (jedes Häppchen in sich chronologisch).
+
+    Jeder Messwert ist zu jedem Zeitpunkt an genau einer Stelle: Eingang,
+    Puffer oder Zustellbuch (unbestätigt). Dadurch gibt es keine doppelten
+    Sendungen und keine Umsortierung durch parallele Flush-Threads.
+
+    Kennzahl "Zeit bis zum ersten aktuellen Messwert": Beim Connect
+    (on_connect()) wird der jüngste noch nicht gesendete Messwert gemerkt
+    (oder, falls keiner da ist, der nächste neue); on_delivered() misst die
+    Zeit bis zu seinem PUBACK.
+
+    Eingebundene Funktionen:
+      encode(readings) -> [(topic, payload, [dicts]), ...]; Messwerte, die
+          in keiner Nachricht vorkommen, gelten als nicht kodierbar und
+          werden verworfen. None: gerade nicht sendbar (z.B. kein Topic),
+          alles bleibt im Puffer
+      publish(topic, payload) -> mid oder None (nicht verbunden / Fehler)
+      publish_message(topic, payload, qos, retain, properties) -> mid bzw.
+          True bei Erfolg, sonst False (Status, Alarme, Antworten)
+      is_connected() -> bool
+      persist() -> schreibt snapshot() dauerhaft (optional)
+      on_drained() -> Rückstand vollständig gesendet (optional, z.B. Metriken)
+      defer_live(reading) -> True: Messwert nicht live senden, sondern in den
+          Puffer legen (optional, Datenbudget: später als Envelope)
+      hold_backlog(count, held_s) -> True: Rückstand noch zurückhalten, bis
+          sich genug für ein Envelope gesammelt hat (optional)
+      stage() -> Kontextmanager um jeden Schritt (optional, Watchdog: ein
+          hängender publish() oder persist() fällt so auf)
+
+    Antworten (submit_stream()) sind Nachrichtenfolgen, z.B. eine
+    RPC-Antwort oder ein Historien-Download in Envelopes. Sie werden erst
+    beim Senden erzeugt, der Reihe nach und wie der Rückstand über das
+    Replay-Fenster flussgesteuert gesendet - vor jeder Nachricht kommen
+    die höheren Klassen dran.
+    """
+
+    MAX_ALERTS = 100
+
+    def __init__(self, encode, publish, is_connected, ledger, flow, batch_size,
+                 max_buffer=1000, persist=None, on_drained=None, publish_message=None,
+                 backlog_order="oldest", defer_live=None, hold_backlog=None, idle_interval=30.0,
+                 name="MQTT_Uplink", stage=None):
+        self.encode = encode
+        self.publish = publish
+        self.publish_message = publish_message
+        self.is_connected = is_connected
+        self.ledger = ledger
+        self.flow = flow
+        self.batch_size = batch_size  # callable -> readings per backlog chunk
+        self.max_buffer = max_buffer
+        self.persist = persist
+        self.on_drained = on_drained
+        self.backlog_order = backlog_order
+        self.defer_live = defer_live
+        self.hold_backlog = hold_backlog
+        self.idle_interval = idle_interval
+        self.name = name
+        self.stage = stage
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._alerts = collections.deque(maxlen=self.MAX_ALERTS)  # (topic, payload, qos, retain, properties)
+        self._inbox = collections.deque()  # new readings
+        self._status = collections.OrderedDict()  # topic -> (topic, payload, qos, retain, properties), latest wins
+        self._streams = collections.deque()  # iterators of (topic, payload, qos, retain, properties)
+        self._stream_message = None  # next message of the current stream (kept while waiting/disconnected)
+        self._buffer = []
+        self._stop = False
+        self._thread = None
+        self._changed = False  # buffer grew during this step -> persist
+        self._hold_started = None  # monotonic start of the current hold
+        self._hold_released = False  # hold ended -> drain the buffer completely before holding again
+        self._connected_at = None
+        self._first_live_target = None  # reading whose PUBACK ends the measurement (None = next new one)
+        self._first_live = LatencyHistogram(bounds=(1, 5, 10, 30, 60, 120, 300, 600))
+        self.last_first_live_s = None
+        self.counts = {"alerts_sent": 0, "live_sent": 0, "status_sent": 0, "backlog_sent": 0, "replies_sent": 0,
+                       "buffered": 0, "deferred": 0, "dropped": 0, "requeued": 0, "wakeups": 0, "errors": 0}
+
+    # --- called from other threads ---
+
+    def submit(self, reading):
+        """Neuer Messwert (Sensor-Thread) - wird vor Status und Rückstand gesendet"""
+        self._inbox.append(reading)
+        self._wake.set()
+
+    def submit_message(self, topic, payload, priority, qos=1, retain=False):
+        """
+        Nachricht außerhalb des Messwert-Puffers (PRIORITY_ALERT oder
+        PRIORITY_STATUS). Status-Nachrichten je Topic überschreiben ältere
+        noch nicht gesendete; Alarme bleiben bis zum Senden im Speicher.
+        """
+        message = (topic, payload, qos, retain, None)
+        with self._lock:
+            if priority == PRIORITY_ALERT:
+                self._alerts.append(message)
+            else:
+                self._status.pop(topic, None)
+                self._status[topic] = message
+        self._wake.set()
+
+    def submit_stream(self, messages):
+        """Nachrichtenfolge (Iterable von (topic, payload, qos, retain, properties)) nach den Status-Nachrichten"""
+        self._streams.append(iter(messages))
+        self._wake.set()
+
+    def active_streams(self):
+        """Anzahl noch nicht vollständig gesendeter Nachrichtenfolgen"""
+        return len(self._streams)
+
+    def wake(self):
+        """Ereignis (PUBACK, Konfiguration) - Worker prüft sofort, ob er senden kann"""
+        self._wake.set()
+
+    def on_connect(self):
+        """Neue Verbindung: Messung 'Zeit bis zum ersten aktuellen Messwert' starten und senden"""
+        with self._lock:
+            self._connected_at = time.monotonic()
+            if self._inbox:
+                self._first_live_target = self._inbox[-1]
+            elif self._buffer:
+                self._first_live_target = self._buffer[-1]
+            else:
+                self._first_live_target = None
+        self._wake.set()
+
+    def on_delivered(self, readings):
+        """PUBACK für Messwerte (aus dem Zustellbuch) - beendet ggf. die Messung nach dem Connect"""
+        with self._lock:
+            if self._connected_at is None or self._first_live_target is None:
+                return
+            target = self._first_live_target
+            if not any(r is target for r in readings):
+                return
+            elapsed = time.monotonic() - self._connected_at
+            self._first_live.observe(elapsed)
+            self.last_first_live_s = elapsed
+            self._connected_at = None
+            self._first_live_target = None
+
+    def load(self, readings):
+        """Puffer beim Start aus der Pufferdatei übernehmen"""
+        with self._lock:
+            self._buffer = list(readings) + self._buffer
+            self._trim_locked()
+        self._wake.set()
+
+    def snapshot(self):
+        """Unbestätigte + gepufferte + eingehende Messwerte (für die Pufferdatei)"""
+        pending = self.ledger.pending_payloads()
+        with self._lock:
+            return pending + self._buffer + list(self._inbox)
+
+    def __len__(self):
+        """Anzahl gepufferter (noch nicht gesendeter) Messwerte"""
+        return len(self._buffer) + len(self._inbox)
+
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def is_alive(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counts,
+                "buffer": len(self._buffer),
+                "inbox": len(self._inbox),
+                "alerts_queued": len(self._alerts),
+                "streams_queued": len(self._streams),
+                "status_queued": len(self._status),
+                "backlog_order": self.backlog_order,
+                "holding": self._hold_started is not None,
+                "first_live_after_connect_s": round(self.last_first_live_s, 2)
+                if self.last_first_live_s is not None else None,
+                "first_live_after_connect": self._first_live.as_dict(),
+            }
+
+    # --- worker thread ---
+
+    def _run(self):
+        timeout = 0
+        while not self._stop:
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stop:
+                break
+            self.counts["wakeups"] += 1
+            try:
+                with self.stage() if self.stage else contextlib.nullcontext():
+                    timeout = self._step()
+            except Exception as e:
+                self.counts["errors"] += 1
+                logging.error(f"Fehler im Uplink-Worker: {e}", exc_info=True)
+                timeout = self.idle_interval
+
+    def _step(self):
+        """Ein Durchlauf: Eingänge nach Priorität, Ack-Timeouts, dann Rückstand im Rahmen der Flusskontrolle"""
+        self._changed = False
+        connected = self.is_connected()
+        had_backlog = bool(self._buffer)
+
+        # Readings whose PUBACK never came go back into the buffer (they are the oldest)
+        expired = self.ledger.expire()
+        if expired:
+            logging.warning(f"{len(expired)} Datenpunkte ohne PUBACK nach {self.ledger.ack_timeout}s. Sende erneut.")
+            with self._lock:
+                self._buffer[:0] = expired
+                self.counts["requeued"] += len(expired)
+                self._trim_locked()
+            self._changed = True
+
+        timeout = self.idle_interval
+        while not self._stop:
+            # Interleaved draining: before every backlog chunk the higher classes are emptied
+            connected = self._drain_priority_queues(connected)
+            if not connected:
+                break
+            if self._streams:
+                wait = self._send_stream_message()
+            elif self._buffer and not self._holding():
+                wait = self._send_backlog_chunk()
+            else:
+                break
+            if wait is None:  # publish failed -> connection is gone
+                connected = False
+            elif wait > 0:
+                timeout = min(timeout, wait)
+                break
+
+        if not self._buffer:
+            self._hold_started = None
+            self._hold_released = False
+        if self._changed and self.persist:
+            self.persist()
+        if had_backlog and not self._buffer and self.on_drained:
+            self.on_drained()
+        return timeout
+
+    def _drain_priority_queues(self, connected):
+        """Alarme, neue Messwerte und Status senden (ungetaktet, jeweils wenige hundert Bytes)"""
+        while connected and self._alerts:
+            with self._lock:
+                message = self._alerts[0]
+            if not self._send_message(message):
+                connected = False
+                break
+            with self._lock:
+                self._alerts.popleft()
+            self.counts["alerts_sent"] += 1
+
+        while self._inbox:
+            reading = self._inbox.popleft()
+            deferred = self.defer_live is not None and self.defer_live(reading)
+            if not deferred:
+                if connected and self._send_live(reading):
+                    continue
+                connected = False
+            with self._lock:
+                # Chronological position: new readings are always the newest
+                self._buffer.append(reading)
+                self.counts["deferred" if deferred else "buffered"] += 1
+                self._trim_locked()
+            self._changed = True
+
+        while connected and self._status:
+            with self._lock:
+                topic, message = next(iter(self._status.items()))
+            if not self._send_message(message):
+                connected = False
+                break
+            with self._lock:
+                if self._status.get(topic) is message:
+                    del self._status[topic]
+            self.counts["status_sent"] += 1
+        return connected
+
+    def _holding(self):
+        """Rückstand zurückhalten (hold_backlog)? Nach der Freigabe wird der Puffer ganz geleert"""
+        if self.hold_backlog is None or self._hold_released:
+            return False
+        now = time.monotonic()
+        if self._hold_started is None:
+            self._hold_started = now
+        if self.hold_backlog(len(self._buffer), now - self._hold_started):
+            return True
+        self._hold_started = None
+        self._hold_released = True
+        return False
+
+    def _send_message(self, message):
+        if not self.publish_message:
+            return True
+        topic, payload, qos, retain, properties = message
+        try:
+            return self.publish_message(topic, payload, qos, retain, properties)
+        except Exception as e:
+            self.counts["errors"] += 1
+            logging.error(f"Fehler beim Publishen via MQTT ({topic}): {e}", exc_info=True)
+            return False
+
+    def _send_stream_message(self):
+        """Nächste Nachricht der ältesten Folge; 0 = weiter, >0 = warten (s), None = Fehler"""
+        if self._stream_message is None:
+            try:
+                self._stream_message = next(self._streams[0])
+            except StopIteration:
+                self._streams.popleft()
+                return 0
+            except Exception as e:
+                self.counts["errors"] += 1
+                logging.error(f"Fehler beim Erzeugen einer Antwort, Folge verworfen: {e}", exc_info=True)
+                self._streams.popleft()
+                return 0
+        topic, payload, qos, retain, properties = self._stream_message
+        wait = self.flow.try_acquire(len(payload)) if qos else 0
+        if wait > 0:
+            return wait
+        mid = self._send_message(self._stream_message)
+        if not mid:
+            return None
+        if qos and mid is not True:
+            self.flow.on_sent(mid, len(payload), 0)
+        self._stream_message = None
+        self.counts["replies_sent"] += 1
+        return 0
+
+    def _send_live(self, reading):
+        messages = self.encode([reading])
+        if messages is None:
+            return False
+        for topic, payload, dicts in messages:
+            mid = self._publish(topic, payload)
+            if mid is None:
+                return False
+            self.ledger.track(mid, dicts)
+            self.counts["live_sent"] += len(dicts)
+        if self._connected_at is not None and self._first_live_target is None:
+            self._first_live_target = reading
+        return True
+
+    def _send_backlog_chunk(self):
+        """Sendet ein Häppchen vom Anfang oder Ende des Puffers; 0 = weiter, >0 = warten (s), None = Fehler"""
+        size = max(1, self.batch_size())
+        with self._lock:
+            start = 0 if self.backlog_order != "newest" else max(0, len(self._buffer) - size)
+            chunk = self._buffer[start:start + size]
+        messages = self.encode(chunk)
+        if messages is None:
+            return None
+        position = {id(d): i for i, d in enumerate(chunk)}
+        consumed = 0
+        for topic, payload, dicts in messages:
+            wait = self.flow.try_acquire(len(payload))
+            if wait > 0:
+                return wait
+            mid = self._publish(topic, payload)
+            if mid is None:
+                return None
+            self.ledger.track(mid, dicts)
+            self.flow.on_sent(mid, len(payload), len(dicts))
+            # Drop everything up to the last reading of this message from the buffer
+            # (readings the encoder skipped as not encodable go with it)
+            end = max(position[id(d)] for d in dicts) + 1
+            with self._lock:
+                del self._buffer[start:start + end - consumed]
+                self.counts["backlog_sent"] += len(dicts)
+            consumed = end
+        if consumed < len(chunk):  # nothing encodable left in this chunk
+            with self._lock:
+                del self._buffer[start:start + len(chunk) - consumed]
+        return 0
+
+    def _publish(self, topic, payload):
+        try:
+            return self.publish(topic, payload)
+        except Exception as e:
+            self.counts["errors"] += 1
+            logging.error(f"Fehler beim Publishen via MQTT: {e}", exc_info=True)
+            return None
+
+    def _trim_locked(self):
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            # Bei Überlauf die ältesten Einträge verwerfen (FIFO)
+            del self._buffer[:overflow]
+            self.counts["dropped"] += overflow
+            logging.warning(f"Datenpuffer überläuft (> {self.max_buffer}). {overflow} älteste Einträge verworfen.")
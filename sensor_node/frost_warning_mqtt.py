@@ -12,6 +12,7 @@ Funktionen:
 - Batteriespannungs- und DC-DC-Ausgangsspannungsüberwachung
 - MQTT-Datenübertragung (Sensordaten, Status)
 - Zuverlässige Online-/Offline-Statusmeldung via MQTT
+- MQTT-Kommandos mit strukturierter Antwort, Historien-Abruf aus dem Log
 - Datenaufzeichnung (lokal als CSV)
 - Datenpufferung bei MQTT-Verbindungsverlust
 - Systeminformationen (CPU, RAM, Disk, Uptime)
@@ -19,28 +20,48 @@ Funktionen:
 - Spannungskalibrierung
 """
 
+import asyncio
+import faulthandler
+import functools
 import time
 import os
 import glob
 # import serial # REMOVED: No longer needed for SMS/GSM
 import RPi.GPIO as GPIO
-import adafruit_dht
-import board
-import busio
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
+# Blinka/adafruit (board, busio, adafruit_dht, adafruit_ads1x15) and psutil are imported where they are
+# used: the slow Blinka board detection then runs in the parallel hardware init (init_hardware())
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 from datetime import datetime, timezone # Added timezone
 import subprocess # Still used for reboot? Check usage. -> Yes, used for reboot. Keep.
 import math
 import threading
 import json
-import psutil
 import logging
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import uuid
 import socket
 import signal # ADDED: For graceful shutdown
 import sys    # ADDED: For graceful shutdown and exit codes
+from frost_aio import MQTTDriver
+from frost_local_api import LocalQueryServer, ReadingRing
+from frost_budget import DataBudget
+from frost_config import ConfigSnapshot, ConfigStore, ConfigWatcher, validate_config
+from frost_codec import decode_binary_reading, encode_binary_reading, encode_envelope
+from frost_reading import Reading
+from frost_link import LinkMonitor
+from frost_profiler import DIAG_CONTENT_TYPE, Profiler, ProfilerError
+from frost_resolver import BrokerResolver, ResolvingMQTTClient
+from frost_ring import KIND_ALERT, KIND_READING, NOTIFY_RECORDS, NOTIFY_SAMPLE, RingNotifier, SharedRing
+from frost_rpc import CommandDispatcher, CommandExecutor, HistoryReader, RPCError
+from frost_scheduler import Scheduler
+from frost_sequence import ReadingSequence
+from frost_startup import StartupTimer
+from frost_watchdog import StageWatchdog, SystemdNotifier, pop_stall_report, save_stall_report
+from frost_uplink import (AdaptiveBatchSizer, DeliveryLedger, ReplayFlowController, SessionResumeStats,
+                          TLSSessionCache, TopicAliasManager, UplinkWorker, PRIORITY_ALERT, PRIORITY_STATUS,
+                          TOPIC_ALIAS_PROPERTY_BYTES, publish_packet_bytes, subscribe_packet_bytes)
 
 # Logging einrichten
 logging.basicConfig(
@@ -53,6 +74,12 @@ logging.basicConfig(
 CONFIG_FILE = "/home/pi/frost_config_mqtt.json" # Changed config filename
 LOG_FILE = "/home/pi/temp_log_mqtt.csv"         # Changed data log filename
 DATA_BUFFER_FILE = "/home/pi/unsent_data_mqtt.json" # Changed buffer filename
+DNS_CACHE_FILE = "/home/pi/mqtt_broker_dns.json"    # Last known good broker address (DDNS)
+DATA_BUDGET_FILE = "/home/pi/data_budget.json"      # GPRS data used in the current billing month
+SEQUENCE_FILE = "/home/pi/reading_sequence.json"    # Last reading number and boot epoch
+RING_FILE = "/home/pi/reading_ring.bin"             # Shared ring between the acquire and uplink processes (two-process mode)
+STARTUP_REPORT_FILE = "/home/pi/startup_report.json" # Phase timings of the last start (frostctl startbench)
+WATCHDOG_STALL_FILE = "/home/pi/watchdog_stall.json" # Stalled stage before a watchdog restart, reported after it
 
 DEFAULT_CONFIG = {
     # --- Core Settings ---
@@ -75,49 +102,185 @@ DEFAULT_CONFIG = {
     "mqtt_port": 1883,
     "mqtt_username": "",
     "mqtt_password": "",
+    "mqtt_tls_enabled": False,              # TLS to the broker (e.g. Caddy terminating port 8883 in front of Mosquitto)
+    "mqtt_tls_ca_certs": "",                # CA file (PEM); "" = system CAs (Let's Encrypt via Caddy)
+    "mqtt_tls_insecure": False,             # Skip certificate/hostname check (testing only!)
+    "mqtt_tls_session_resumption": True,    # Reuse the TLS session on reconnect (no certificate chain, fewer round trips)
+    "mqtt_dns_cache": True,                 # Connect to the cached broker IP (DNS TTL, last known good on disk), refresh in background
+    "mqtt_dns_min_ttl": 60,                 # Sec; lower bound for the cached TTL (DDNS providers often use 60 s)
     "mqtt_sensor_topic_template": "frostsystem/{device_id}/sensors", # Topic for sensor data
     "mqtt_status_topic_template": "frostsystem/{device_id}/status",   # Topic for status updates (online/offline)
-    "mqtt_command_topic_template": "frostsystem/{device_id}/cmd",     # Topic to listen for commands (Future Use)
+    "mqtt_command_topic_template": "frostsystem/{device_id}/cmd",     # Topic to listen for commands (RPC, see frost_rpc.py)
+    "mqtt_rpc_response_topic_template": "frostsystem/{device_id}/rpc/response", # Replies to requests with "id" but without MQTT v5 response topic
+    "rpc_history_chunk_rows": 200,          # GET_HISTORY: readings per envelope
+    "rpc_history_max_rows": 5000,           # GET_HISTORY: readings per request, the rest via resume token
+    "mqtt_diagnostics_topic_template": "frostsystem/{device_id}/diagnostics", # PROFILE_START results (compressed, see frost_profiler.py)
+    "diagnostics_max_duration": 600,        # Sec; upper bound for one profiling run
+    "mqtt_batch_topic_template": "frostsystem/{device_id}/sensors/batch", # Compressed batch envelopes (buffer replay)
+    "mqtt_batch_enabled": True,             # Pack buffered readings into batch envelopes
+    "mqtt_batch_size": 50,                  # Initial readings per envelope (adapts to ack latency)
+    "mqtt_batch_size_max": 500,
+    "mqtt_batch_compression": 6,            # zlib level 1-9
+    "mqtt_payload_format": "json",          # Live readings: "json" or "binary" (compact fixed-point, see frost_codec.py)
+    "mqtt_binary_topic_template": "frostsystem/{device_id}/sensors/bin", # Topic for binary live readings
     "mqtt_qos": 1,                          # QoS for reliable messaging
     "mqtt_keepalive": 60,                   # Keepalive interval for connection check
+    "mqtt_topic_alias_enabled": True,       # MQTTv5 topic aliases: long topics go over the wire once per connection
+    "mqtt_trim_payload": True,              # Omit fields the server derives (device_id from topic, uptime_str)
+    "mqtt_session_expiry": 3600,            # MQTTv5 session expiry (sec); broker keeps session across short link drops. 0 = clean session
     "mqtt_status_heartbeat_interval": 300,  # Interval (sec) to send "online" status heartbeat
+    "mqtt_ack_timeout": 120,                # Sec without PUBACK before a reading goes back into the buffer
+    "mqtt_replay_window": 4,                # Initial unacknowledged replay messages in flight (grows with fast PUBACKs)
+    "mqtt_replay_window_max": 16,           # Upper bound, keep below paho's max_inflight_messages (20)
+    "mqtt_replay_max_bytes_per_sec": 1500,  # Replay bandwidth ceiling (0 = unlimited); leaves room for live data and keepalive
+    "mqtt_replay_target_latency": 5,        # Sec; slower PUBACKs shrink the replay window
+    "mqtt_metrics_topic_template": "frostsystem/{device_id}/metrics", # Uplink metrics (replay throughput, queue depth, ack latency)
+    "mqtt_metrics_interval": 300,           # Sec between metrics messages (0 = off)
+    "mqtt_alert_topic_template": "frostsystem/{device_id}/alert", # Node-side alerts (critical temperature, sensor failure); sent before everything else
+    "mqtt_backlog_order": "newest",         # Buffer replay after an outage: "newest" first (current conditions reach Grafana first) or "oldest" first
+    "link_interface": "ppp0",               # GPRS interface watched for up/down events ("" = off, e.g. WLAN/LAN setups)
+    "link_poll_interval": 2,                # Sec between sysfs checks (fallback without netlink, and safety net)
+    "budget_monthly_mb": 0,                 # GPRS data plan per billing month (MB); 0 = count only, never save
+    "budget_reset_day": 1,                  # Day of month the plan resets
+    "budget_frost_band": 3.0,               # °C above warning_temp: inside this band the budget never widens intervals or holds data
+    "budget_hold_max_age": 3600,            # Sec; at budget level "knapp" readings are collected into envelopes for at most this long
+    "budget_watchdog_ping_interval": 120,   # Sec; sim800l_watchdog.py ping, estimated into the budget (0 = not running)
+    "budget_ssh_keepalive_interval": 60,    # Sec; autossh ServerAliveInterval, estimated into the budget (0 = no tunnel)
     "device_id": str(uuid.uuid4()),         # Auto-generate if not present
-    "max_buffer_size": 1000                 # Increased buffer size
+    "max_buffer_size": 1000,                # Increased buffer size
+
+    # --- Local Query API (diagnostics without broker / disk access) ---
+    "local_api_enabled": True,
+    "local_api_port": 8765,                 # Bound to 127.0.0.1 only
+    "local_api_socket": "",                 # Unix socket path; if set, used instead of the TCP port
+    "local_api_ring_size": 2880,            # Readings kept in memory (e.g. 10 days @ 5 min)
+
+    # --- Startup ---
+    "startup_connect_timeout": 5,           # Sec the first reading waits for the first CONNACK (goes out live instead of into the buffer)
+    "startup_target_first_publish": 20,     # Sec from process start until the broker acknowledged the first reading; warns if missed
+
+    # --- Watchdog (systemd WatchdogSec, see frostwarn.service.example) ---
+    "watchdog_sensor_budget": 90,           # Sec one reading (1-Wire, DHT22 retries, ADS1115, CSV write) may take
+    "watchdog_uplink_budget": 120,          # Sec one uplink step or buffer file write may take
+    "watchdog_check_interval": 30,          # Sec between stage checks without systemd watchdog (else WatchdogSec/2)
+
+    # --- Two-process mode (frost_warning_mqtt.py acquire / uplink) ---
+    "ring_slots": 2880                      # Readings the shared ring holds while the uplink process is down (10 days @ 5 min)
 }
 
+# Checked when the file is loaded (frost_config.validate_config); types come from DEFAULT_CONFIG
+CONFIG_LIMITS = {
+    "check_interval": (2, 86400), "check_interval_critical": (2, 86400),  # DHT22: at most one reading per 2s
+    "battery_r1": (1, None), "battery_r2": (1, None), "dcdc_r1": (1, None), "dcdc_r2": (1, None),
+    "mqtt_port": (1, 65535), "mqtt_qos": (0, 2), "mqtt_keepalive": (5, 65535), "mqtt_session_expiry": (0, None),
+    "mqtt_batch_size": (1, None), "mqtt_batch_size_max": (1, None), "mqtt_batch_compression": (1, 9),
+    "mqtt_replay_window": (1, 20), "mqtt_replay_window_max": (1, 20), "mqtt_replay_max_bytes_per_sec": (0, None),
+    "mqtt_ack_timeout": (1, None), "mqtt_status_heartbeat_interval": (10, None), "mqtt_metrics_interval": (0, None),
+    "max_buffer_size": (1, None), "budget_monthly_mb": (0, None), "budget_reset_day": (1, 28),
+    "watchdog_sensor_budget": (1, None), "watchdog_uplink_budget": (1, None), "watchdog_check_interval": (1, None),
+    "startup_connect_timeout": (0, 300), "ring_slots": (16, None), "diagnostics_max_duration": (1, 3600),
+}
+CONFIG_CHOICES = {
+    "mqtt_payload_format": ("json", "binary"),
+    "mqtt_backlog_order": ("newest", "oldest"),
+}
+# Hot reload (config_check_job): keys whose change needs a new broker connection, and keys that
+# only take effect after a restart. All other keys are read where they are used, or have a listener.
+MQTT_CONNECTION_KEYS = {"mqtt_broker", "mqtt_port", "mqtt_username", "mqtt_password", "mqtt_keepalive",
+                        "mqtt_session_expiry", "mqtt_dns_cache", "mqtt_dns_min_ttl", "mqtt_status_topic_template",
+                        "mqtt_topic_alias_enabled"}
+RESTART_KEYS = {"device_id", "mqtt_tls_enabled", "mqtt_tls_ca_certs", "mqtt_tls_insecure",
+                "mqtt_tls_session_resumption", "link_interface", "link_poll_interval", "local_api_enabled",
+                "local_api_port", "local_api_socket", "local_api_ring_size", "ring_slots"}
+CONFIG_RELOAD_DEBOUNCE = 0.2  # Sec after an inotify event before reloading (an editor may write twice)
+
 # --- REMOVED SMS Configuration Keys ---
 # "authorized_numbers", "sms_check_interval", "status_code",
 # "threshold_code", "reboot_code", "add_number_code",
 # "remove_number_code", "help_code"
 
 # Globale Variablen
-config = {}
-last_readings = {
-    "dry_temp": None,
-    "wet_temp": None,
-    "humidity": None,
-    "calc_wet_temp": None,
-    "battery_percent": None,
-    "battery_voltage": None,
-    "dcdc_voltage": None,
-    "last_update": None
-}
+config = ConfigSnapshot(DEFAULT_CONFIG)  # Current snapshot, replaced as a whole (config_store), never modified
+config_store = None
+last_readings = None  # Latest Reading (frost_reading), the same object as in the buffer and the local API ring
+last_update_ts = None  # time.time() of the last sensor cycle (also a failed one)
+startup = StartupTimer()  # Phase timings from process start (interpreter and imports included)
+systemd = SystemdNotifier()  # sd_notify READY/WATCHDOG/STATUS; no-op outside systemd
+stage_watchdog = StageWatchdog()  # Per-stage deadlines; the watchdog is only petted while all are met
+watchdog_stalls = set()  # Stages currently reported as stalled
+first_reading_payload = None  # First reading handed to the uplink; its PUBACK ends the time-to-first-publish
+hardware_init = None  # Future of init_hardware(), runs in parallel to MQTT connect and buffer load (main())
 shutdown_requested = False # Flag for graceful shutdown
+shutdown_complete = False  # shutdown_node() has run
+
+# "single": one process does everything; two-process mode: "acquire" (sensors only) and "uplink" (MQTT), see frost_ring.py
+process_role = "single"
+shared_ring = None  # Acquire writes readings and alerts, uplink reads them (init_shared_ring())
+ring_notifier = None  # Wakes the other process (new records / take a reading now)
+ring_reading_event = threading.Event()  # Uplink: set when a reading arrived from the ring (GET_STATUS)
+
+# asyncio runtime (run_node()): one event loop in the main thread drives MQTT, timers, link and local API
+event_loop = None
+shutdown_event = None  # asyncio.Event, set by request_shutdown()
+mqtt_ready = None  # asyncio.Event, set on each successful CONNACK (startup, broker change after a reload)
+sensor_executor = None  # Single thread for blocking sensor I/O (1-Wire, DHT22, ADS1115)
+scheduler = None  # Periodic jobs: sensor, heartbeat, metrics, buffer, budget, config (run_node())
+BUFFER_FLUSH_DELAY = 30  # Sec after the first ack until the buffer file is rewritten
+HOUSEKEEPING_INTERVAL = 120  # Sec between liveness checks (uplink worker, RPC executor, MQTT task) and budget updates
+BUDGET_SAVE_INTERVAL = 300  # Sec between saves of the data budget state
+CONFIG_CHECK_INTERVAL = 120  # Sec between checks of the config file for changes
+RING_POLL_INTERVAL = 300  # Uplink process: sec between ring checks besides the acquire process's notifications
 
 
 # Thread-Synchronisierung
 sensor_lock = threading.Lock()
 # gsm_lock = threading.Lock() # REMOVED: No longer needed
-buffer_lock = threading.Lock()  # For the unsent data buffer
+buffer_file_lock = threading.Lock()  # Serializes writes of the buffer file
 
 # MQTT Client Global Variables
 mqtt_client = None
+mqtt_driver = None  # Runs paho's network I/O in the event loop (init_mqtt_client())
 mqtt_connected = False
 mqtt_lock = threading.Lock()  # Lock for MQTT operations
+subscribed_command_topic = None  # Command topic subscribed in the current broker session (None = not yet in this process)
 device_id = ""  # Will be loaded from config
 
-# Unsent data buffer
-unsent_data_buffer = []
+# Unsent data buffer: owned by the uplink worker thread (init_uplink_worker())
+uplink_worker = None
+batch_sizer = AdaptiveBatchSizer()
+# Paces the buffer replay (in-flight window, bytes/s ceiling)
+replay_flow = ReplayFlowController()
+
+def _on_ack_timeout():
+    batch_sizer.on_failure()
+    replay_flow.on_timeout()
+
+# Readings handed to paho but not yet acknowledged (PUBACK) - part of the durable buffer
+delivery_ledger = DeliveryLedger(on_ack=batch_sizer.on_ack, on_timeout=_on_ack_timeout)
+buffer_dirty = False  # Buffer file is stale (acks arrived since the last save)
+session_stats = SessionResumeStats()
+topic_aliases = TopicAliasManager()
+tls_sessions = TLSSessionCache()
+tls_context = None  # Created once: a TLS session is only valid for the context that made it
+broker_resolver = None  # DNS cache for the DDNS broker name (init_mqtt_client())
+link_monitor = None  # Watches ppp0 (init_link_monitor())
+rpc_dispatcher = None  # Commands with structured replies (init_rpc())
+rpc_executor = None  # Runs commands off paho's network thread
+RPC_QUEUE_SIZE = 8  # Commands waiting for the executor; more are rejected with "busy"
+RPC_MAX_HISTORY_STREAMS = 2  # GET_HISTORY downloads queued at the same time
+RPC_REBOOT_DELAY = 3  # Sec between the REBOOT reply and the reboot
+profiler = None  # PROFILE_START/STOP/STATUS, idle (no hooks, no threads) until a command arrives (init_rpc())
+data_budget = None  # GPRS data accounting (init_data_budget())
+budget_level = 0  # 0 normal, 1 sparen, 2 knapp, 3 kritisch (update_data_budget())
+last_sensor_publish_time = 0  # A sensor message doubles as heartbeat while saving data
+reading_sequence = ReadingSequence(SEQUENCE_FILE)  # (boot, seq) on every reading, for gap detection on the server
+
+# Payload fields the server derives itself (device_id from the topic, uptime_str from uptime_seconds)
+TRIMMED_PAYLOAD_FIELDS = ("device_id", "uptime_str")
+
+# Local query API (in-memory ring of recent readings)
+reading_ring = None
+local_api = None
 
 # Batterie-Monitoring Variablen
 adc = None
@@ -133,28 +296,44 @@ GPIO.setwarnings(False)
 # GPIO.setup(RESET_PIN, GPIO.OUT)
 # GPIO.output(RESET_PIN, GPIO.HIGH)
 
-# 1-Wire für DS18B20 initialisieren
-try:
-    os.system('modprobe w1-gpio')
-    os.system('modprobe w1-therm')
-    base_dir = '/sys/bus/w1/devices/'
-    device_folders = glob.glob(base_dir + '28*')
-    device_files = [folder + '/w1_slave' for folder in device_folders]
-    if len(device_files) < 2:
-         logging.warning(f"Nur {len(device_files)} DS18B20 Sensoren gefunden. Benötige 2.")
-         # Assign what we have, handle None later
-         DRY_SENSOR = device_files[0] if len(device_files) > 0 else None
-         WET_SENSOR = None
-    else:
-        # Assuming order based on connection/discovery
-        DRY_SENSOR = device_files[0]
-        WET_SENSOR = device_files[1]
-        logging.info(f"DS18B20 Sensoren gefunden: Trocken={DRY_SENSOR}, Nass={WET_SENSOR}")
+# DS18B20 sensor files, found by init_onewire()
+DRY_SENSOR = None
+WET_SENSOR = None
+W1_DEVICES_DIR = '/sys/bus/w1/devices/'
+W1_DISCOVERY_TIMEOUT = 3.0  # Sec to wait for both DS18B20 to show up after loading the 1-Wire modules
+
+def init_onewire():
+    """1-Wire für DS18B20 initialisieren: Module nur laden, wenn nötig, dann auf beide Sensoren warten"""
+    global DRY_SENSOR, WET_SENSOR
+    try:
+        if not os.path.isdir(W1_DEVICES_DIR):
+            # Usually loaded at boot by dtoverlay=w1-gpio; modprobe only as a fallback
+            subprocess.run(['modprobe', 'w1-gpio'], check=False)
+            subprocess.run(['modprobe', 'w1-therm'], check=False)
+        # Readiness instead of a fixed sleep: the bus enumerates the sensors shortly after the module loads
+        deadline = time.monotonic() + W1_DISCOVERY_TIMEOUT
+        while True:
+            device_files = sorted(folder + '/w1_slave' for folder in glob.glob(W1_DEVICES_DIR + '28*'))
+            if len(device_files) >= 2 or time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+        if len(device_files) < 2:
+             logging.warning(f"Nur {len(device_files)} DS18B20 Sensoren gefunden. Benötige 2.")
+             # Assign what we have, handle None later
+             DRY_SENSOR = device_files[0] if len(device_files) > 0 else None
+             WET_SENSOR = None
+        else:
+            # Assuming order based on connection/discovery
+            DRY_SENSOR = device_files[0]
+            WET_SENSOR = device_files[1]
+            logging.info(f"DS18B20 Sensoren gefunden: Trocken={DRY_SENSOR}, Nass={WET_SENSOR}")
+        return DRY_SENSOR is not None
 
-except Exception as e:
-    logging.error(f"Fehler bei Initialisierung der DS18B20 Sensoren: {e}")
-    DRY_SENSOR = None
-    WET_SENSOR = None
+    except Exception as e:
+        logging.error(f"Fehler bei Initialisierung der DS18B20 Sensoren: {e}")
+        DRY_SENSOR = None
+        WET_SENSOR = None
+        return False
 
 
 # DHT22 Sensor global variable
@@ -231,6 +410,11 @@ def init_battery_monitor():
     global adc, battery_channel, dcdc_channel
 
     try:
+        import board
+        import busio
+        import adafruit_ads1x15.ads1115 as ADS
+        from adafruit_ads1x15.analog_in import AnalogIn
+
         # Initialisiere I2C-Bus
         i2c = busio.I2C(board.SCL, board.SDA)
 
@@ -259,56 +443,86 @@ def init_battery_monitor():
 
 # Hilfsfunktionen
 
+def _bind_config(snapshot):
+    global config
+    config = snapshot  # One assignment: other threads see the old or the new snapshot, never a mix
+
+def read_config_file():
+    """Konfigurationsdatei lesen und prüfen; liefert (Werte, Probleme). OSError/ValueError, wenn unlesbar"""
+    with open(CONFIG_FILE, 'r') as f:
+        loaded = json.load(f)
+    values, problems = validate_config(loaded, DEFAULT_CONFIG, CONFIG_LIMITS, CONFIG_CHOICES)
+    if device_id and not (isinstance(loaded, dict) and isinstance(loaded.get("device_id"), str) and loaded["device_id"]):
+        values["device_id"] = device_id  # Running node keeps its ID
+    return values, problems
+
 def load_config():
     """Lädt die Konfiguration aus der Datei oder erstellt Standardwerte"""
-    global config, device_id
+    global config_store, device_id
+    values = None
+    generated = False
     try:
         if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                loaded_config = json.load(f)
-                # Merge loaded config with defaults, ensuring all keys exist
-                config = {**DEFAULT_CONFIG, **loaded_config}
-                # Ensure Device ID exists and is valid
-                if "device_id" not in config or not config["device_id"] or not isinstance(config["device_id"], str):
-                    logging.warning("Device ID missing or invalid in config, generating new one.")
-                    config["device_id"] = str(uuid.uuid4())
-                    save_config() # Save the newly generated ID
-                logging.info("Konfiguration geladen")
+            values, problems = read_config_file()
+            for problem in problems:
+                logging.error(f"Konfiguration: {problem} - verwende Standardwert.")
+            # Ensure Device ID exists and is valid
+            if not values.get("device_id") or not isinstance(values["device_id"], str):
+                logging.warning("Device ID missing or invalid in config, generating new one.")
+                values["device_id"] = str(uuid.uuid4())
+                generated = True # Save the newly generated ID
+            logging.info("Konfiguration geladen")
         else:
-            config = DEFAULT_CONFIG.copy()
+            values = dict(DEFAULT_CONFIG)
             # Ensure a device ID is generated for new default config
-            if "device_id" not in config or not config["device_id"]:
-                 config["device_id"] = str(uuid.uuid4())
-            save_config()
+            if not values.get("device_id"):
+                 values["device_id"] = str(uuid.uuid4())
+            generated = True
             logging.info("Standardkonfiguration erstellt")
     except json.JSONDecodeError as e:
          logging.error(f"Fehler beim Parsen der Konfigurationsdatei {CONFIG_FILE}: {e}. Verwende Standardkonfiguration.")
-         config = DEFAULT_CONFIG.copy()
-         if "device_id" not in config or not config["device_id"]:
-              config["device_id"] = str(uuid.uuid4())
+         values = None
     except Exception as e:
         logging.error(f"Fehler beim Laden der Konfiguration: {e}. Verwende Standardkonfiguration.")
-        config = DEFAULT_CONFIG.copy()
-        if "device_id" not in config or not config["device_id"]:
-             config["device_id"] = str(uuid.uuid4())
+        values = None
     finally:
+        if values is None:
+            values = dict(DEFAULT_CONFIG)
+            if not values.get("device_id"):
+                 values["device_id"] = str(uuid.uuid4())
+        snapshot = ConfigSnapshot(values)
+        if config_store is None:
+            config_store = ConfigStore(snapshot, on_swap=_bind_config)
+        else:
+            config_store.swap(snapshot)
         # Ensure device_id global is set from the final config
         device_id = config.get("device_id", str(uuid.uuid4())) # Fallback just in case
         logging.info(f"Verwende Device ID: {device_id}")
+    if generated:
+        save_config()
 
 
 def save_config():
-    """Speichert die aktuelle Konfiguration in die Datei"""
-    global config
+    """Speichert die aktuelle Konfiguration in die Datei (atomar: der Watcher liest nie eine halbe Datei)"""
     try:
         # Ensure device ID is in the config being saved
-        config['device_id'] = device_id
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=4, sort_keys=True) # Sort keys for readability
+        data = {**config, 'device_id': device_id}
+        tmp = CONFIG_FILE + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=4, sort_keys=True) # Sort keys for readability
+        os.replace(tmp, CONFIG_FILE)
         logging.info("Konfiguration gespeichert")
     except Exception as e:
         logging.error(f"Fehler beim Speichern der Konfiguration: {e}")
 
+def update_config(**changes):
+    """Werte im laufenden Betrieb ändern (SET_THRESHOLD, Kalibrierung), Abnehmer benachrichtigen, speichern"""
+    changed, old = config_store.update(**changes)
+    if changed and event_loop is not None and event_loop.is_running():
+        asyncio.run_coroutine_threadsafe(config_store.apply(changed, old, config), event_loop)
+    save_config()
+    return changed
+
 # --- REMOVED send_command function ---
 # --- REMOVED send_sms function ---
 # --- REMOVED read_sms function ---
@@ -655,8 +869,7 @@ def calibrate_voltage_sensor(channel, r1, r2, name, config_key):
         calibration_factor = actual_voltage / raw_voltage
 
         # Speichere in Konfiguration
-        config[config_key] = calibration_factor
-        save_config() # Save immediately
+        update_config(**{config_key: calibration_factor}) # Saves immediately
 
         print("-" * 30)
         print(f"Neuer Kalibrierungsfaktor für {name}: {calibration_factor:.4f}")
@@ -690,8 +903,10 @@ def calibrate_dcdc_sensor():
 def get_system_info():
     """Sammelt Systeminformationen wie CPU-Last, Speicherverbrauch, etc."""
     try:
-        # CPU-Last (average over 1 second for more stability)
-        cpu_percent = psutil.cpu_percent(interval=1.0)
+        import psutil
+
+        # CPU-Last: average since the previous reading (primed in init_hardware(), no 1 s sleep per reading)
+        cpu_percent = psutil.cpu_percent(interval=None)
 
         # Speicherverbrauch
         memory = psutil.virtual_memory()
@@ -704,13 +919,7 @@ def get_system_info():
         # Systemlaufzeit
         boot_time_timestamp = psutil.boot_time()
         current_time_timestamp = time.time()
-        uptime_seconds = current_time_timestamp - boot_time_timestamp
-
-        # Format uptime
-        days = int(uptime_seconds // (24 * 3600))
-        hours = int((uptime_seconds % (24 * 3600)) // 3600)
-        minutes = int((uptime_seconds % 3600) // 60)
-        uptime_str = f"{days}d {hours}h {minutes}m"
+        uptime_seconds = current_time_timestamp - boot_time_timestamp  # uptime_str is derived by Reading
 
         # Get IP address (more robustly)
         ip_address = "N/A"
@@ -734,7 +943,6 @@ def get_system_info():
             "memory_percent": memory_percent,
             "disk_percent": disk_percent,
             "uptime_seconds": int(uptime_seconds),
-            "uptime_str": uptime_str,
             "ip_address": ip_address
         }
         logging.debug(f"System Info: {sysinfo}")
@@ -761,10 +969,11 @@ def log_data(timestamp, data_dict):
     # Format values, handle None -> "" for CSV
     log_values = []
     for key in data_keys:
-        value = data_dict.get(key) # Get value from the passed dictionary
         if key == "timestamp":
-            log_values.append(str(value)) # Already string formatted
-        elif isinstance(value, (int, float)):
+            log_values.append(str(timestamp)) # Already string formatted
+            continue
+        value = data_dict.get(key) # Get value from the passed reading
+        if isinstance(value, (int, float)):
             # Format numbers consistently
             precision = 2 if "temp" in key or "volt" in key else 1 if "hum" in key else 0
             log_values.append(f"{value:.{precision}f}")
@@ -796,11 +1005,9 @@ def log_data(timestamp, data_dict):
 
 def update_sensor_data():
     """Aktualisiert alle Sensorwerte, loggt sie (CSV) und sendet sie via MQTT."""
-    global last_readings
-    current_readings = {}
-    # Use UTC time for consistency across systems and MQTT
+    global last_readings, last_update_ts
+    # Use UTC time for consistency across systems and MQTT (ISO 8601 is formatted only when encoding)
     timestamp_dt = datetime.now(timezone.utc)
-    timestamp_iso = timestamp_dt.isoformat() # ISO 8601 format, good for MQTT/databases
     timestamp_log_fmt = timestamp_dt.strftime("%Y-%m-%d %H:%M:%S") # Local time format for CSV? Or keep UTC? Let's keep UTC for CSV too.
 
     dry_temp, wet_temp, humidity, calc_wet_temp, battery_voltage, battery_percent, dcdc_voltage, effective_wet_temp = (None,) * 8
@@ -832,56 +1039,58 @@ def update_sensor_data():
                 battery_voltage, battery_percent, dcdc_voltage = None, None, None
 
 
-            current_readings = {
-                "timestamp": timestamp_iso, # Use ISO format for MQTT/internal state
-                "device_id": device_id,
-                "dry_temp": dry_temp,
-                "wet_temp": wet_temp,       # Measured
-                "humidity": humidity,
-                "calc_wet_temp": calc_wet_temp, # Calculated
-                "effective_wet_temp": effective_wet_temp, # The one used for warnings/logic
-                "battery_percent": battery_percent,
-                "battery_voltage": battery_voltage,
-                "dcdc_voltage": dcdc_voltage,
-            }
-
-            # Add system info to the readings payload
-            system_info = get_system_info()
-            if system_info:
-                current_readings.update(system_info) # Merge system info dict
+            # Numbered only once the reading exists, so a gap in seq always means a lost reading
+            boot, seq = reading_sequence.next()
+
+            # Add system info to the reading
+            system_info = get_system_info() or {}
+
+            # One compact record per reading (frost_reading); everything below shares it instead of copying
+            reading = Reading(
+                timestamp_dt.timestamp(),
+                device_id=device_id,
+                seq=seq,
+                boot=boot,
+                dry_temp=dry_temp,
+                wet_temp=wet_temp,       # Measured
+                humidity=humidity,
+                calc_wet_temp=calc_wet_temp, # Calculated
+                effective_wet_temp=effective_wet_temp, # The one used for warnings/logic
+                battery_percent=battery_percent,
+                battery_voltage=battery_voltage,
+                dcdc_voltage=dcdc_voltage,
+                cpu_percent=system_info.get("cpu_percent"),
+                memory_percent=system_info.get("memory_percent"),
+                disk_percent=system_info.get("disk_percent"),
+                uptime_seconds=system_info.get("uptime_seconds"),
+                ip_address=system_info.get("ip_address"),
+            )
 
             # ---- Update global state *after* successful reading ----
-            last_readings = current_readings.copy()
-            # Add a simple last update timestamp for internal checks if needed
-            last_readings["last_update_ts"] = time.time()
+            last_readings = reading
+            last_update_ts = time.time()
 
+            # Keep a reference in the in-memory ring for the local query API (O(1), own lock)
+            if reading_ring is not None:
+                reading_ring.append(reading, reading.epoch)
 
             # ---- Log locally (CSV) ----
-            # Create a dict copy with the local time format for CSV logging if preferred
-            # Or just use the UTC ISO format everywhere. Let's stick to UTC ISO.
-            csv_log_payload = current_readings.copy()
-            csv_log_payload['timestamp'] = timestamp_log_fmt # Use the format for CSV
-            log_data(timestamp_log_fmt, csv_log_payload) # Pass the data dict
+            log_data(timestamp_log_fmt, reading) # CSV row with the local log time format
 
             # Log summary to system log
             temp_log_str = f"T:{fmt(dry_temp)} NasM:{fmt(wet_temp)} NasB:{fmt(calc_wet_temp)} Eff:{fmt(effective_wet_temp)} H:{fmt(humidity,0)}%"
             bat_log_str = f"Bat:{fmt(battery_percent,0)}%({fmt(battery_voltage,2)}V) DC:{fmt(dcdc_voltage,2)}V"
-            sys_log_str = f"CPU:{fmt(system_info.get('cpu_percent'),0)}% RAM:{fmt(system_info.get('memory_percent'),0)}% Disk:{fmt(system_info.get('disk_percent'),0)}%" if system_info else "SysInfo: N/A"
+            sys_log_str = f"CPU:{fmt(reading.cpu_percent,0)}% RAM:{fmt(reading.memory_percent,0)}% Disk:{fmt(reading.disk_percent,0)}%" if system_info else "SysInfo: N/A"
             logging.info(f"Sensoren: {temp_log_str} | {bat_log_str} | {sys_log_str}")
 
             # --- Sende Daten via MQTT (mit Buffer-Logik) ---
-            # Send a clean copy containing only sensor/system data, not internal state like 'last_update_ts'
-            mqtt_payload = current_readings.copy()
-            if 'last_update_ts' in mqtt_payload: del mqtt_payload['last_update_ts']
-            publish_or_buffer_data(mqtt_payload)
-            
-            return current_readings # Return the full dict including internal state
+            publish_or_buffer_data(reading)
+
+            return reading
 
     except Exception as e:
         logging.error(f"Schwerer Fehler im Sensor-Update-Zyklus: {e}", exc_info=True)
-        # Ensure last_readings has some timestamp even on error
-        last_readings["timestamp"] = timestamp_iso
-        last_readings["last_update_ts"] = time.time()
+        last_update_ts = time.time() # The cycle ran, even if it failed
         return None # Indicate failure
 
 # --- REMOVED format_status_message (Status is now handled by MQTT status topic) ---
@@ -902,139 +1111,153 @@ def check_critical_temp_condition(readings):
 
 # --- REMOVED Battery Warning SMS logic --- Battery warnings should be handled by MQTT consumer
 
-def sensor_monitoring_loop():
-    """Schleife für die Sensorüberwachung, Datenerfassung und MQTT-Versand."""
-    global last_readings # Access global state
-
-    logging.info("Sensorüberwachungsschleife gestartet")
-
-    consecutive_errors = 0
-    max_consecutive_errors = 10 # Threshold before logging critical error
-
-    while not shutdown_requested: # Check shutdown flag
-        start_time = time.monotonic()
-        readings = None
-        try:
-            # --- 1. Sensorwerte aktualisieren (includes logging, MQTT publish attempt) ---
-            readings = update_sensor_data()
-
-            if readings is None:
-                # Fehler beim Abrufen der Sensordaten
-                consecutive_errors += 1
-                logging.warning(f"Fehler beim Abrufen der Sensordaten (#{consecutive_errors}/{max_consecutive_errors})")
-
-                if consecutive_errors >= max_consecutive_errors:
-                    logging.critical(f"Maximale Anzahl ({max_consecutive_errors}) aufeinanderfolgender Sensorfehler erreicht!")
-                    # Consider triggering a special MQTT status or even a reboot?
-                    # For now, just log critically and reset counter to avoid log spam.
-                    # Optionally: publish_status(mqtt_client, "offline_sensor_error") ? Needs client access.
-                    consecutive_errors = 0 # Reset after critical log
-
-                sleep_time = 60 # Wait shorter after error before retry
-            else:
-                # Erfolgreich Daten gelesen, Fehlerzähler zurücksetzen
-                if consecutive_errors > 0:
-                     logging.info(f"Sensor-Lesen nach {consecutive_errors} Fehlern wieder erfolgreich.")
-                     consecutive_errors = 0
-
-                # --- 2. Messintervall anpassen ---
-                is_critical = check_critical_temp_condition(readings)
-                if is_critical:
-                    sleep_time = config.get('check_interval_critical', DEFAULT_CONFIG['check_interval_critical'])
-                else:
-                    sleep_time = config.get('check_interval', DEFAULT_CONFIG['check_interval'])
-
-                # --- 3. Batterie-Check für Energiesparmodus ---
-                # (Warning SMS removed, but critical level can still increase interval)
-                battery_level = readings.get("battery_percent")
-                critical_level = config.get('battery_critical_level', DEFAULT_CONFIG['battery_critical_level'])
-                if battery_level is not None and battery_level < critical_level:
-                    logging.warning(f"Kritisch niedriger Batteriestand ({battery_level}%) - Energiesparmodus (längeres Intervall)")
-                    # Increase sleep time, but not less than critical interval if temps are low
-                    sleep_time = max(sleep_time, 1800) # Ensure at least 30 min interval in critical battery state
-
-                logging.info(f"Nächste Messung in {sleep_time} Sekunden.")
+MAX_CONSECUTIVE_SENSOR_ERRORS = 10 # Threshold before logging critical error
+sensor_errors = 0 # Consecutive failed readings
+sensor_was_critical = False # Alert only on the transition into the critical temperature range
+last_cycle_readings = None # Result of the last sensor_cycle() (None = read failed), for GET_STATUS
 
+async def sensor_cycle():
+    """
+    Job "sensor": Sensorwerte erfassen und senden (Sensor-I/O im Executor), dann das
+    nächste Messintervall bestimmen. Rückgabe: Sekunden bis zur nächsten Messung.
+    """
+    global sensor_errors, sensor_was_critical, last_cycle_readings
+
+    # --- 1. Sensorwerte aktualisieren (includes logging, MQTT publish attempt) ---
+    with stage_watchdog.stage("sensor"):
+        readings = await asyncio.get_running_loop().run_in_executor(sensor_executor, update_sensor_data)
+    last_cycle_readings = readings
+
+    if readings is None:
+        # Fehler beim Abrufen der Sensordaten
+        sensor_errors += 1
+        logging.warning(f"Fehler beim Abrufen der Sensordaten (#{sensor_errors}/{MAX_CONSECUTIVE_SENSOR_ERRORS})")
+
+        if sensor_errors >= MAX_CONSECUTIVE_SENSOR_ERRORS:
+            logging.critical(f"Maximale Anzahl ({MAX_CONSECUTIVE_SENSOR_ERRORS}) aufeinanderfolgender Sensorfehler erreicht!")
+            publish_alert("sensor_error", f"{MAX_CONSECUTIVE_SENSOR_ERRORS} aufeinanderfolgende Sensorfehler")
+            # Reset after the critical log to avoid log spam
+            sensor_errors = 0
+
+        stage_watchdog.expect("sensor", 60)
+        return 60 # Wait shorter after error before retry
+
+    # Erfolgreich Daten gelesen, Fehlerzähler zurücksetzen
+    if startup.mark("first_reading") and process_role == "acquire":
+        finish_startup()  # Its part ends at the ring, the uplink process measures the publish
+    if sensor_errors > 0:
+        logging.info(f"Sensor-Lesen nach {sensor_errors} Fehlern wieder erfolgreich.")
+        sensor_errors = 0
+
+    # --- 2. Messintervall anpassen ---
+    is_critical = check_critical_temp_condition(readings)
+    if is_critical and not sensor_was_critical:
+        publish_alert("critical_temp", "Effektive Nasstemperatur unter Warnschwelle",
+                      effective_wet_temp=readings.get('effective_wet_temp'),
+                      warning_temp=config.get('warning_temp', DEFAULT_CONFIG['warning_temp']))
+    sensor_was_critical = is_critical
+    if is_critical:
+        sleep_time = config.get('check_interval_critical', DEFAULT_CONFIG['check_interval_critical'])
+    else:
+        sleep_time = config.get('check_interval', DEFAULT_CONFIG['check_interval'])
 
-            # --- 4. Schlafen bis zur nächsten Messung ---
-            # Calculate actual sleep time, accounting for processing time
-            elapsed_time = time.monotonic() - start_time
-            actual_sleep = max(0, sleep_time - elapsed_time)
-            if actual_sleep > 0:
-                time.sleep(actual_sleep)
+    # --- 3. Batterie-Check für Energiesparmodus ---
+    # (Warning SMS removed, but critical level can still increase interval)
+    battery_level = readings.get("battery_percent")
+    critical_level = config.get('battery_critical_level', DEFAULT_CONFIG['battery_critical_level'])
+    if battery_level is not None and battery_level < critical_level:
+        logging.warning(f"Kritisch niedriger Batteriestand ({battery_level}%) - Energiesparmodus (längeres Intervall)")
+        # Increase sleep time, but not less than critical interval if temps are low
+        sleep_time = max(sleep_time, 1800) # Ensure at least 30 min interval in critical battery state
 
-        except Exception as e:
-            # Catch errors within the loop itself (outside update_sensor_data)
-            consecutive_errors += 1
-            logging.error(f"Fehler in der Sensorüberwachungsschleife: {e} (Fehler #{consecutive_errors})", exc_info=True)
-            time.sleep(60) # Wait after unexpected loop error
+    # --- 3b. Datenbudget: außerhalb des Frostbereichs seltener messen ---
+    if budget_level >= 2 and outside_frost_band(readings.get('effective_wet_temp')):
+        sleep_time *= 4 if budget_level >= 3 else 2
+        logging.info(f"Datenbudget Stufe {budget_level}: Messintervall außerhalb des Frostbereichs verlängert.")
 
-    logging.info("Sensorüberwachungsschleife beendet.")
+    logging.info(f"Nächste Messung in {sleep_time} Sekunden.")
+    stage_watchdog.expect("sensor", sleep_time)
+    # The scheduler counts from the start of this cycle, the read time is already included
+    return sleep_time
 
 
 # --- Buffer functions remain largely the same ---
 def load_buffer():
-    """Lädt den Puffer für ungesendete Daten aus der Datei"""
-    global unsent_data_buffer
-    unsent_data_buffer = [] # Start with empty buffer
+    """Lädt den Puffer für ungesendete Daten aus der Datei (an den Uplink-Worker)"""
+    loaded = []
     if os.path.exists(DATA_BUFFER_FILE):
         try:
             with open(DATA_BUFFER_FILE, 'r') as f:
                 # Check if file is empty before trying to load JSON
                 if os.path.getsize(DATA_BUFFER_FILE) > 0:
-                    unsent_data_buffer = json.load(f)
-                    if isinstance(unsent_data_buffer, list):
-                         logging.info(f"Ungesendete Daten geladen: {len(unsent_data_buffer)} Einträge")
+                    loaded = json.load(f)
+                    if isinstance(loaded, list):
+                         logging.info(f"Ungesendete Daten geladen: {len(loaded)} Einträge")
                     else:
                          logging.warning(f"Datenpufferdatei {DATA_BUFFER_FILE} enthält kein gültiges JSON-Array. Ignoriere Inhalt.")
-                         unsent_data_buffer = []
+                         loaded = []
                 else:
                      logging.info(f"Datenpufferdatei {DATA_BUFFER_FILE} ist leer.")
         except json.JSONDecodeError as e:
              logging.error(f"Fehler beim Parsen des Datenpuffers {DATA_BUFFER_FILE}: {e}. Starte mit leerem Puffer.")
-             unsent_data_buffer = [] # Reset buffer on error
+             loaded = [] # Reset buffer on error
         except Exception as e:
             logging.error(f"Fehler beim Laden des Datenpuffers: {e}")
-            unsent_data_buffer = [] # Reset buffer on error
+            loaded = [] # Reset buffer on error
     else:
          logging.info(f"Keine Pufferdatei {DATA_BUFFER_FILE} gefunden. Starte mit leerem Puffer.")
+    readings = []
+    for entry in loaded:
+        try:
+            readings.append(Reading.from_dict(entry, device_id))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Ungültiger Eintrag im Datenpuffer verworfen: {e}")
+    uplink_worker.load(readings)
 
 
 def save_buffer():
     """Speichert den Puffer für ungesendete Daten in die Datei"""
-    global unsent_data_buffer # Ensure we use the global list
+    global buffer_dirty
+    if uplink_worker is None:
+        return False
     try:
-        with buffer_lock: # Protect access during save
-            max_size = config.get('max_buffer_size', DEFAULT_CONFIG['max_buffer_size'])
-            current_size = len(unsent_data_buffer)
-
-            if current_size > max_size:
-                # Bei Überlauf die ältesten Einträge verwerfen (FIFO)
-                items_to_remove = current_size - max_size
-                del unsent_data_buffer[:items_to_remove]
-                logging.warning(f"Datenpuffer überläuft ({current_size} > {max_size}). {items_to_remove} älteste Einträge verworfen.")
-
-            # Write the current buffer state to the file
+        with stage_watchdog.stage("storage"), buffer_file_lock: # One writer at a time (uplink worker, main loop, shutdown)
+            # Unacknowledged readings (sent, no PUBACK yet) are persisted in front of the buffer
+            # so a crash or restart before the broker confirms them does not lose them.
+            buffer_dirty = False
+            data = uplink_worker.snapshot()
             with open(DATA_BUFFER_FILE, 'w') as f:
-                 json.dump(unsent_data_buffer, f) # Save the potentially trimmed list
-            logging.debug(f"Datenpuffer gespeichert: {len(unsent_data_buffer)} Einträge")
-
+                 json.dump([reading.as_dict() for reading in data], f)
+            logging.debug(f"Datenpuffer gespeichert: {len(data)} Einträge (inkl. {len(delivery_ledger)} unbestätigt)")
+        return True
     except IOError as e:
          logging.error(f"Fehler beim Schreiben der Pufferdatei {DATA_BUFFER_FILE}: {e}")
     except Exception as e:
         logging.error(f"Fehler beim Speichern des Datenpuffers: {e}")
+    return False
 
 # --- MQTT Callback Functions (Enhanced) ---
 def on_connect(client, userdata, flags, rc, properties=None): # Added properties for MQTTv5
-    global mqtt_connected
+    global mqtt_connected, subscribed_command_topic
     # --- Lock only for critical state change ---
     connected_successfully = False
     if rc == 0:
         # Acquire lock briefly to update shared state
         with mqtt_lock:
             mqtt_connected = True
+            # New connection: alias mapping starts empty, paho's held messages go out with full topics
+            topic_aliases.on_connect(properties, client)
         connected_successfully = True # Mark success outside lock
+        startup.mark("connack")
+        if mqtt_ready is not None:
+            event_loop.call_soon_threadsafe(mqtt_ready.set)  # Startup and broker change after a config reload
         logging.info(f"Verbunden mit MQTT Broker: {config.get('mqtt_broker')} (Code: {rc})")
+        if broker_resolver is not None:
+            broker_resolver.on_connected() # Persist the address as last known good
+        # Remember the TLS session for the next reconnect (TLS 1.3: ticket arrived with the CONNACK at the latest)
+        handshake = tls_sessions.capture(client.socket())
+        if handshake:
+            logging.info(f"TLS Handshake: {handshake} ({tls_sessions.last.get('handshake_s')}s, {tls_sessions.last.get('version')}).")
     else:
         # Acquire lock briefly to update shared state
         with mqtt_lock:
@@ -1046,22 +1269,45 @@ def on_connect(client, userdata, flags, rc, properties=None): # Added properties
     # --- Actions after successful connect (NO LOCK HELD HERE) ---
     if connected_successfully:
         try:
-            # Subscribe (safe to do without lock, paho handles internally)
+            # Persistent session (clean_start=False + session expiry): the broker still has our
+            # subscription and in-flight QoS 1 state, no need to subscribe again.
+            session_present = bool(flags.get('session present', 0)) if isinstance(flags, dict) else False
             command_topic = config.get('mqtt_command_topic_template',"").format(device_id=device_id)
-            if command_topic:
-                qos = config.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos'])
-                client.subscribe(command_topic, qos=qos)
-                logging.info(f"Subscribed to command topic: {command_topic} (QoS: {qos})")
-            else:
+            # The session only holds the topic we subscribed last; a topic changed while offline is subscribed anew
+            resubscribe = not session_present or subscribed_command_topic != command_topic
+            saved = session_stats.record(
+                session_present,
+                subscribe_bytes=subscribe_packet_bytes(command_topic) if command_topic and not resubscribe else 0,
+                inflight_msgs=len(delivery_ledger),
+            )
+            if session_present:
+                logging.info(f"MQTT Sitzung übernommen (session present): {len(delivery_ledger)} offene Nachrichten laufen weiter, {saved} Bytes gespart.")
+
+            # Subscribe (safe to do without lock, paho handles internally)
+            if resubscribe:
+                if session_present and subscribed_command_topic:
+                    client.unsubscribe(subscribed_command_topic)
+                    logging.info(f"Unsubscribed from old command topic: {subscribed_command_topic}")
+                if command_topic:
+                    qos = config.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos'])
+                    client.subscribe(command_topic, qos=qos)
+                    logging.info(f"Subscribed to command topic: {command_topic} (QoS: {qos})")
+                subscribed_command_topic = command_topic
+            if not command_topic:
                 logging.debug("Kein Command Topic konfiguriert.")
 
             # Publish initial online status (this function handles its own lock)
             publish_status(client, "online")
 
-            # Try to send buffered data in a new thread
-            logging.info("MQTT verbunden, starte Thread zum Senden gepufferter Daten...")
-            # Start the thread *after* releasing the lock
-            threading.Thread(target=publish_or_buffer_data, args=(None,), name="MQTT_Buffer_Flush").start()
+            # Paho re-sends its in-flight QoS 1 messages itself; restart their ack timeout
+            delivery_ledger.on_reconnect()
+
+            # Wake the uplink worker: it replays the buffer (flow-controlled) and
+            # measures the time until the current reading is acknowledged
+            if uplink_worker is not None:
+                if len(uplink_worker):
+                    logging.info(f"MQTT verbunden, Pufferabbau von {len(uplink_worker)} Einträgen...")
+                uplink_worker.on_connect()
 
         except Exception as e:
             logging.error(f"Fehler in on_connect nach erfolgreicher Verbindung: {e}", exc_info=True) # Add exc_info
@@ -1076,12 +1322,31 @@ def on_disconnect(client, userdata, rc, properties=None): # Added properties for
         else:
             logging.info("MQTT Verbindung sauber getrennt.")
         mqtt_connected = False
-    # Automatic reconnection is handled by loop_start/loop_forever
+    # Stop the replay, paho re-sends its in-flight messages after reconnect
+    replay_flow.on_disconnect()
+    # Reconnection (with backoff) is handled by mqtt_driver.run()
 
 def on_publish(client, userdata, mid):
-    # This callback confirms the message has left the client.
-    # For QoS 1/2, broker confirmation handling happens internally in Paho.
-    logging.debug(f"MQTT Nachricht (MID: {mid}) erfolgreich an Broker übermittelt (lokale Bestätigung).")
+    # For QoS 1 Paho calls this only after the broker's PUBACK (QoS 0: once the message left the client).
+    # Only now a reading counts as delivered and may leave the durable buffer.
+    global buffer_dirty
+    if link_monitor is not None:
+        link_monitor.on_ack() # Ends the link-up -> first PUBACK measurement
+    if replay_flow.on_ack(mid) and uplink_worker is not None:
+        uplink_worker.wake() # A slot in the replay window is free
+    delivered = delivery_ledger.ack(mid)
+    if delivered is not None:
+        buffer_dirty = True
+        if scheduler is not None:
+            scheduler.request("buffer_flush", BUFFER_FLUSH_DELAY) # One file write for all acks within the delay
+        if uplink_worker is not None:
+            uplink_worker.on_delivered(delivered)
+        if first_reading_payload is not None and any(item is first_reading_payload for item in delivered) \
+                and startup.mark("first_publish"):
+            finish_startup()
+        logging.debug(f"MQTT Nachricht (MID: {mid}) vom Broker bestätigt (PUBACK).")
+    else:
+        logging.debug(f"MQTT Nachricht (MID: {mid}) bestätigt (nicht im Zustellbuch, z.B. Status).")
 
 def on_message(client, userdata, msg):
     """Callback for receiving MQTT messages (e.g., commands)."""
@@ -1094,62 +1359,142 @@ def on_message(client, userdata, msg):
         command_topic = config.get('mqtt_command_topic_template',"").format(device_id=device_id)
 
         if topic == command_topic:
-             process_mqtt_command(payload_str)
+             # MQTTv5: response topic and correlation data of the request are in the properties
+             process_mqtt_command(payload_str, getattr(msg, 'properties', None))
 
     except Exception as e:
         logging.error(f"Fehler bei der Verarbeitung der MQTT Nachricht von Topic {topic}: {e}")
 
-def process_mqtt_command(payload_str):
-    """Processes commands received via MQTT."""
-    global config # Allow modification of config
+def process_mqtt_command(payload_str, properties=None):
+    """
+    Queues commands received via MQTT for the RPC executor (see frost_rpc.py).
+    Runs on paho's network thread: only parse and enqueue, never block here.
+    """
+    if rpc_dispatcher is None:
+        logging.error("RPC nicht initialisiert. Kommando wird ignoriert.")
+        return None
+    return rpc_dispatcher.handle(payload_str, properties)
+
+def _rpc_reboot(params):
+    logging.warning("MQTT Reboot Kommando empfangen. Starte Neustart...")
+    # The reply goes out first; reboot once the uplink worker had a moment to send it
+    threading.Timer(RPC_REBOOT_DELAY, _reboot_now).start()
+    return {"rebooting": True, "delay_s": RPC_REBOOT_DELAY}
+
+def _reboot_now():
+    # Publish status before rebooting if possible
+    publish_status(mqtt_client, "rebooting")
+    time.sleep(2) # Give MQTT time
     try:
-        # Example: Expecting JSON like {"command": "reboot"} or {"command": "set_threshold", "value": 1.5}
-        command_data = json.loads(payload_str)
-        command = command_data.get("command", "").strip().upper()
-        value = command_data.get("value") # Might be None
-
-        logging.info(f"Verarbeite MQTT Kommando: {command}, Wert: {value}")
-
-        if command == "REBOOT":
-            logging.warning("MQTT Reboot Kommando empfangen. Starte Neustart...")
-            # Publish status before rebooting if possible
-            publish_status(mqtt_client, "rebooting")
-            time.sleep(2) # Give MQTT time
-            try:
-                # Use subprocess to detach the reboot process
-                subprocess.Popen(['sudo', 'reboot'])
-                # Call graceful shutdown to clean up before the reboot takes effect
-                graceful_shutdown(signal.SIGTERM, None) # Simulate TERM signal
-            except Exception as reboot_err:
-                logging.error(f"Fehler beim Ausführen des Neustart-Befehls: {reboot_err}")
-
-        elif command == "SET_THRESHOLD":
-            try:
-                new_threshold = float(value)
-                old_threshold = config.get('warning_temp', DEFAULT_CONFIG['warning_temp'])
-                config['warning_temp'] = new_threshold
-                save_config()
-                logging.info(f"Warnschwellwert via MQTT von {old_threshold}°C auf {new_threshold}°C geändert.")
-                # Optionally publish confirmation back or update status?
-            except (TypeError, ValueError) as e:
-                logging.error(f"Ungültiger Wert für SET_THRESHOLD Kommando: {value}. Fehler: {e}")
-            except Exception as e:
-                logging.error(f"Fehler beim Setzen des Schwellwerts via MQTT: {e}")
-
-        elif command == "GET_STATUS":
-             # Force a sensor update and publish
-             logging.info("GET_STATUS Kommando empfangen. Führe Sensor-Update aus.")
-             update_sensor_data() # This will publish new data
-
-        # Add more commands here (e.g., GET_CONFIG, SET_CONFIG_ITEM, ...)
+        # Use subprocess to detach the reboot process
+        subprocess.Popen(['sudo', 'reboot'])
+        # Call graceful shutdown to clean up before the reboot takes effect
+        graceful_shutdown(signal.SIGTERM, None) # Simulate TERM signal
+    except Exception as reboot_err:
+        logging.error(f"Fehler beim Ausführen des Neustart-Befehls: {reboot_err}")
+
+def _rpc_set_threshold(params):
+    try:
+        new_threshold = float(params.get("value"))
+    except (TypeError, ValueError):
+        raise RPCError("invalid_value", f"Ungültiger Wert für SET_THRESHOLD: {params.get('value')!r}")
+    if not math.isfinite(new_threshold):
+        raise RPCError("invalid_value", f"Ungültiger Wert für SET_THRESHOLD: {new_threshold}")
+    old_threshold = config.get('warning_temp', DEFAULT_CONFIG['warning_temp'])
+    update_config(warning_temp=new_threshold)
+    logging.info(f"Warnschwellwert via MQTT von {old_threshold}°C auf {new_threshold}°C geändert.")
+    return {"warning_temp": new_threshold, "previous": old_threshold}
+
+def _rpc_get_status(params):
+    # Force a sensor update and publish
+    logging.info("GET_STATUS Kommando empfangen. Führe Sensor-Update aus.")
+    if process_role == "uplink":
+        # The acquire process takes the reading; wait until it came through the ring
+        ring_reading_event.clear()
+        if not ring_notifier.notify(NOTIFY_SAMPLE) or not ring_reading_event.wait(50):
+            raise RPCError("sensor_error", "Messprozess antwortet nicht")
+        readings = last_readings
+    elif scheduler is not None and scheduler.running:
+        # Run the sensor job now: no read in parallel to a scheduled one, the next reading counts from here
+        try:
+            scheduler.trigger("sensor").result(timeout=55)
+        except CancelledError:
+            raise RPCError("sensor_error", "Dienst wird beendet, keine Messung mehr")
+        readings = last_cycle_readings
+    else:
+        readings = update_sensor_data() # This will publish new data
+    if readings is None:
+        raise RPCError("sensor_error", "Sensorwerte konnten nicht gelesen werden")
+    return {
+        "reading": wire_payload(readings),
+        "buffer_depth": len(uplink_worker) if uplink_worker else 0,
+        "unacked": len(delivery_ledger),
+        "warning_temp": config.get('warning_temp', DEFAULT_CONFIG['warning_temp']),
+        "budget_level": budget_level,
+    }
 
-        else:
-            logging.warning(f"Unbekanntes MQTT Kommando empfangen: {command}")
+def _rpc_get_history(params):
+    if uplink_worker is not None and uplink_worker.active_streams() >= RPC_MAX_HISTORY_STREAMS:
+        raise RPCError("busy", "Es laufen bereits Historien-Downloads, später erneut anfragen")
+    return HistoryReader(LOG_FILE).stream(
+        params,
+        chunk_rows=config.get('rpc_history_chunk_rows', DEFAULT_CONFIG['rpc_history_chunk_rows']),
+        max_rows=config.get('rpc_history_max_rows', DEFAULT_CONFIG['rpc_history_max_rows']),
+    )
 
-    except json.JSONDecodeError:
-        logging.error(f"Konnte MQTT Kommando-Payload nicht als JSON parsen: {payload_str}")
-    except Exception as e:
-        logging.error(f"Fehler bei der Verarbeitung des MQTT Kommandos: {e}")
+def _rpc_profile_start(params):
+    try:
+        return profiler.start(params.get("kind", "cpu"), params)
+    except ProfilerError as e:
+        raise RPCError(e.code, str(e))
+
+def _rpc_profile_stop(params):
+    kind = params.get("kind")
+    if kind is None:
+        return {"stopped": profiler.stop_all()}
+    summary = profiler.stop(kind)
+    if summary is None:
+        raise RPCError("invalid_value", f"Keine laufende Messung {kind!r}")
+    return {"stopped": [summary]}
+
+def _rpc_profile_status(params):
+    return profiler.stats()
+
+def publish_diagnostics(kind, payload):
+    """Diagnosebericht (frost_profiler) über den Uplink-Worker senden; nicht gepuffert, geht bei Verbindungsabbruch verloren"""
+    topic = config.get('mqtt_diagnostics_topic_template', "").format(device_id=device_id)
+    if not topic or uplink_worker is None:
+        return False
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.ContentType = DIAG_CONTENT_TYPE
+    properties.UserProperty = ("kind", kind)
+    uplink_worker.submit_stream([(topic, payload, config.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos']), False, properties)])
+    logging.info(f"Diagnosebericht {kind} ({len(payload)} Bytes) an {topic} übergeben.")
+    return True
+
+def init_rpc():
+    """Kommandos registrieren und den Executor starten; Antworten laufen über den Uplink-Worker"""
+    global rpc_dispatcher, rpc_executor, profiler
+    rpc_executor = CommandExecutor(max_queue=RPC_QUEUE_SIZE)
+    rpc_dispatcher = CommandDispatcher(
+        send=uplink_worker.submit_stream,
+        default_response_topic=config.get('mqtt_rpc_response_topic_template', "").format(device_id=device_id),
+        qos=config.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos']),
+        executor=rpc_executor,
+    )
+    rpc_dispatcher.register("REBOOT", _rpc_reboot, timeout=30)
+    rpc_dispatcher.register("SET_THRESHOLD", _rpc_set_threshold, timeout=30)
+    # A sensor cycle takes 5-20 s (DHT retries, CPU sample); a burst of requests shares one cycle
+    rpc_dispatcher.register("GET_STATUS", _rpc_get_status, timeout=60, coalesce=True)
+    rpc_dispatcher.register("GET_HISTORY", _rpc_get_history, timeout=30)  # only validates, the stream is read while sending
+    # In two-process mode this is the uplink process (event loop, uplink, RPC); stack samples show its threads only
+    profiler = Profiler(publish_diagnostics, context={"device_id": device_id, "role": process_role},
+                        max_duration=config.get('diagnostics_max_duration', DEFAULT_CONFIG['diagnostics_max_duration']))
+    rpc_dispatcher.register("PROFILE_START", _rpc_profile_start, timeout=30)
+    rpc_dispatcher.register("PROFILE_STOP", _rpc_profile_stop, timeout=60)  # builds and compresses the report
+    rpc_dispatcher.register("PROFILE_STATUS", _rpc_profile_status, timeout=10)
+    rpc_executor.start()
+    return rpc_dispatcher
 
 
 # --- Status Publishing Function (NEW) ---
@@ -1184,10 +1529,21 @@ def publish_status(client, status_string):
     }
     # Remove None values for cleaner JSON, especially ip_address
     payload = {k: v for k, v in payload.items() if v is not None}
+    if config.get('mqtt_trim_payload', DEFAULT_CONFIG['mqtt_trim_payload']):
+        payload.pop("device_id", None)  # Part of the topic
 
     payload_str = json.dumps(payload)
     qos = config.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos']) # Use configured QoS
 
+    # Regular status goes through the uplink scheduler (after alerts and live readings);
+    # offline statuses are sent directly, the worker is stopped during shutdown.
+    if "offline" not in status_string and uplink_worker is not None and uplink_worker.is_alive():
+        with mqtt_lock:
+            connected_now = mqtt_connected
+        uplink_worker.submit_message(status_topic, payload_str, PRIORITY_STATUS, qos=qos, retain=True)
+        logging.info(f"Status '{status_string}' für MQTT Topic '{status_topic}' eingereiht (Retained: True, QoS: {qos}).")
+        return connected_now
+
     msg_info = None
     try:
         # --- Lock ONLY around the publish call ---
@@ -1198,7 +1554,7 @@ def publish_status(client, status_string):
                  logging.warning(f"MQTT nicht verbunden, überspringe Status-Publish '{status_string}' (außer offline).")
                  return False
 
-            msg_info = client.publish(status_topic, payload_str, qos=qos, retain=True)
+            msg_info = mqtt_publish(client, status_topic, payload_str, qos=qos, retain=True)
         # --- Lock released ---
 
         # Optional: Wait for publish confirmation for important status messages like shutdown
@@ -1235,8 +1591,67 @@ def publish_status(client, status_string):
 
 
 # --- MQTT Initialization (Enhanced) ---
+def configure_mqtt_connection():
+    """
+    Verbindungsparameter aus der Konfiguration setzen (Broker, Zugang, LWT, Keepalive, Sitzung);
+    beim Start und nach einem Reload mit geänderten Broker-Einstellungen. Verbunden wird in mqtt_driver.run().
+    """
+    global broker_resolver
+    broker = config.get('mqtt_broker')
+    port = config.get('mqtt_port')
+    # Resolver cache: reconnects go to the cached IP instead of resolving the DDNS name over GPRS each time
+    if config.get('mqtt_dns_cache', DEFAULT_CONFIG['mqtt_dns_cache']):
+        if broker_resolver is None or broker_resolver.hostname != broker:
+            broker_resolver = BrokerResolver(broker, DNS_CACHE_FILE,
+                                             min_ttl=config.get('mqtt_dns_min_ttl', DEFAULT_CONFIG['mqtt_dns_min_ttl']))
+            broker_resolver.load()
+        broker_resolver.min_ttl = config.get('mqtt_dns_min_ttl', DEFAULT_CONFIG['mqtt_dns_min_ttl'])
+    else:
+        broker_resolver = None
+    mqtt_client.resolver = broker_resolver
+
+    # --- Configure Last Will and Testament (LWT) ---
+    status_topic = config.get('mqtt_status_topic_template',"").format(device_id=device_id)
+    if status_topic:
+        lwt_payload = json.dumps({
+            "status": "offline_unexpected",
+            # Timestamp will be when LWT is SET by client, not when triggered by broker
+            "timestamp_iso": datetime.now(timezone.utc).isoformat(),
+            "device_id": device_id
+        })
+        qos = config.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos'])
+        mqtt_client.will_set(status_topic, payload=lwt_payload, qos=qos, retain=True)
+        logging.info(f"LWT konfiguriert für Topic: '{status_topic}' (Retained: True, QoS: {qos})")
+    else:
+         logging.warning("Kein Status Topic Template konfiguriert - LWT nicht gesetzt.")
+
+    # Set username/password if configured
+    username = config.get('mqtt_username')
+    password = config.get('mqtt_password')
+    if username: # Check for username, assume password needed if user is set
+        mqtt_client.username_pw_set(username, password)
+        logging.info("MQTT Benutzernamen/Passwort gesetzt.")
+    else:
+        mqtt_client.username_pw_set(None)
+
+    # Connection parameters only; mqtt_driver.run() connects and reconnects
+    keepalive = config.get('mqtt_keepalive', DEFAULT_CONFIG['mqtt_keepalive'])
+    session_expiry = config.get('mqtt_session_expiry', DEFAULT_CONFIG['mqtt_session_expiry'])
+    connect_properties = Properties(PacketTypes.CONNECT)
+    if session_expiry > 0:
+        connect_properties.SessionExpiryInterval = int(session_expiry)
+    topic_aliases.enabled = config.get('mqtt_topic_alias_enabled', DEFAULT_CONFIG['mqtt_topic_alias_enabled'])
+    logging.info(f"Versuche Verbindung zu MQTT Broker: {broker}:{port} (Keepalive: {keepalive}s, Session Expiry: {session_expiry}s)")
+    # clean_start=False on every connect (also the first one after a restart, same client ID),
+    # so the broker resumes the session; paho keeps its outgoing queue in memory across reconnects.
+    mqtt_client.connect_async(broker, port, keepalive,
+                              clean_start=session_expiry <= 0,
+                              properties=connect_properties)
+    mqtt_driver.set_keepalive(keepalive)
+
 def init_mqtt_client():
-    global mqtt_client, device_id
+    """Legt den Client an; verbunden wird in mqtt_driver.run() (im Event-Loop)"""
+    global mqtt_client, mqtt_driver, device_id, tls_context
     if not device_id:
         logging.critical("Device ID nicht gesetzt, kann MQTT Client nicht initialisieren.")
         return False
@@ -1255,183 +1670,491 @@ def init_mqtt_client():
         with mqtt_lock:
             # Use device_id as client_id for uniqueness and clarity
             # Using MQTTv5 for better features like properties, reason codes
-            mqtt_client = mqtt.Client(client_id=device_id, protocol=mqtt.MQTTv5)
+            mqtt_client = ResolvingMQTTClient(client_id=device_id, protocol=mqtt.MQTTv5)
             logging.info(f"Initialisiere MQTT Client (ID: {device_id}, Protokoll: MQTTv5)")
 
-
-            # --- Configure Last Will and Testament (LWT) ---
-            status_topic = config.get('mqtt_status_topic_template',"").format(device_id=device_id)
-            if status_topic:
-                lwt_payload = json.dumps({
-                    "status": "offline_unexpected",
-                    # Timestamp will be when LWT is SET by client, not when triggered by broker
-                    "timestamp_iso": datetime.now(timezone.utc).isoformat(),
-                    "device_id": device_id
-                })
-                qos = config.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos'])
-                mqtt_client.will_set(status_topic, payload=lwt_payload, qos=qos, retain=True)
-                logging.info(f"LWT konfiguriert für Topic: '{status_topic}' (Retained: True, QoS: {qos})")
-            else:
-                 logging.warning("Kein Status Topic Template konfiguriert - LWT nicht gesetzt.")
-
             # Assign callbacks
             mqtt_client.on_connect = on_connect
             mqtt_client.on_disconnect = on_disconnect
             mqtt_client.on_publish = on_publish
             mqtt_client.on_message = on_message
 
-            # Set username/password if configured
-            username = config.get('mqtt_username')
-            password = config.get('mqtt_password')
-            if username: # Check for username, assume password needed if user is set
-                mqtt_client.username_pw_set(username, password)
-                logging.info("MQTT Benutzernamen/Passwort gesetzt.")
-
-            # Start the network loop in a background thread
-            # Handles reconnections automatically
-            mqtt_client.loop_start()
-            logging.info("MQTT Netzwerk-Loop gestartet (im Hintergrund).")
-
-
-            # Attempt initial connection (non-blocking)
-            keepalive = config.get('mqtt_keepalive', DEFAULT_CONFIG['mqtt_keepalive'])
-            logging.info(f"Versuche Verbindung zu MQTT Broker: {broker}:{port} (Keepalive: {keepalive}s)")
-            mqtt_client.connect_async(broker, port, keepalive)
+            # TLS (with session resumption across reconnects)
+            if config.get('mqtt_tls_enabled', DEFAULT_CONFIG['mqtt_tls_enabled']):
+                tls_sessions.enabled = config.get('mqtt_tls_session_resumption', DEFAULT_CONFIG['mqtt_tls_session_resumption'])
+                if tls_context is None:
+                    tls_context = tls_sessions.context(
+                        ca_certs=config.get('mqtt_tls_ca_certs') or None,
+                        insecure=config.get('mqtt_tls_insecure', DEFAULT_CONFIG['mqtt_tls_insecure']),
+                    )
+                mqtt_client.tls_set_context(tls_context)
+                logging.info(f"MQTT TLS aktiviert (Sitzungswiederaufnahme: {'an' if tls_sessions.enabled else 'aus'}).")
+
+            # Network I/O in the event loop via paho's socket callbacks instead of a loop_start() thread
+            mqtt_driver = MQTTDriver(mqtt_client, event_loop)
+            mqtt_driver.attach()
+            configure_mqtt_connection()
+            logging.info(f"MQTT Netzwerk-I/O im Event-Loop (Keepalive-Prüfung alle {mqtt_driver.misc_interval:.0f}s).")
 
             return True # Indicates initialization started
 
     except Exception as e:
         logging.critical(f"Kritischer Fehler bei MQTT Initialisierung: {e}", exc_info=True)
-        if mqtt_client: # Ensure loop is stopped if connect fails badly
-             try: mqtt_client.loop_stop()
-             except: pass
         mqtt_client = None # Ensure client is None on failure
+        mqtt_driver = None
         return False
 
+def mqtt_publish(client, topic, payload, qos, retain=False, properties=None):
+    """
+    client.publish() mit MQTTv5 Topic Alias (falls vom Broker erlaubt).
+    Aufrufer hält mqtt_lock, damit Alias-Vergabe und Senden in derselben Reihenfolge erfolgen.
+    Gesendete Bytes werden je Verkehrsklasse im Datenbudget gezählt.
+    """
+    global last_sensor_publish_time
+    traffic_class = _traffic_class(topic)
+    topic, properties = topic_aliases.resolve(topic, properties)
+    msg_info = client.publish(topic, payload=payload, qos=qos, retain=retain, properties=properties)
+    if mqtt_driver is not None:
+        mqtt_driver.wake_writer()  # Publishes from worker threads: make sure the loop watches for writability
+    if data_budget is not None and msg_info.rc == mqtt.MQTT_ERR_SUCCESS:
+        aliased = properties is not None and getattr(properties, "TopicAlias", None) is not None
+        nbytes = publish_packet_bytes(topic, len(payload) if payload else 0, qos,
+                                      TOPIC_ALIAS_PROPERTY_BYTES if aliased else 0)
+        data_budget.record(traffic_class, nbytes, packets=2 if qos else 1)  # PUBLISH (+ PUBACK)
+    if traffic_class in ("sensor", "backlog") and msg_info.rc == mqtt.MQTT_ERR_SUCCESS:
+        last_sensor_publish_time = time.time()
+    return msg_info
+
+def _traffic_class(topic):
+    """Verkehrsklasse eines Topics für das Datenbudget"""
+    for key, traffic_class in (('mqtt_sensor_topic_template', "sensor"), ('mqtt_binary_topic_template', "sensor"),
+                               ('mqtt_batch_topic_template', "backlog"), ('mqtt_status_topic_template', "status"),
+                               ('mqtt_metrics_topic_template', "metrics"), ('mqtt_alert_topic_template', "alert")):
+        if topic == config.get(key, "").format(device_id=device_id):
+            return traffic_class
+    return "other_mqtt"
+
+def wire_payload(reading):
+    """Messwert als dict für JSON, ohne die Felder, die der Server selbst ableitet (mqtt_trim_payload)"""
+    if not config.get('mqtt_trim_payload', DEFAULT_CONFIG['mqtt_trim_payload']):
+        return reading.as_dict()
+    return reading.as_dict(exclude=TRIMMED_PAYLOAD_FIELDS)
+
+def build_publish_messages(payload_dicts, sensor_topic):
+    """
+    Kodiert Messwerte in MQTT-Nachrichten: Liste von (topic, payload, [dicts]).
+    Mehrere Messwerte (Pufferabbau) -> Batch-Envelopes in adaptiver Größe,
+    ein einzelner Messwert -> JSON oder Binärformat (mqtt_payload_format).
+    Nicht kodierbare Werte werden verworfen.
+    """
+    messages = []
+    batch_topic = config.get('mqtt_batch_topic_template', "").format(device_id=device_id)
+    if config.get('mqtt_batch_enabled', DEFAULT_CONFIG['mqtt_batch_enabled']) and batch_topic and len(payload_dicts) > 1:
+        size = batch_sizer.current()
+        level = config.get('mqtt_batch_compression', DEFAULT_CONFIG['mqtt_batch_compression'])
+        if budget_level >= 1:
+            level = 9  # Saving data: a few ms of CPU per envelope are cheaper than GPRS bytes
+        for start in range(0, len(payload_dicts), size):
+            chunk = payload_dicts[start:start + size]
+            try:
+                messages.append((batch_topic, encode_envelope([wire_payload(d) for d in chunk], level), chunk))
+            except (TypeError, ValueError) as enc_err:
+                logging.error(f"Fehler beim Kodieren des Batch-Envelopes: {enc_err}. Sende Datenpunkte einzeln.")
+                messages.extend(_encode_single_messages(chunk, sensor_topic))
+    else:
+        messages.extend(_encode_single_messages(payload_dicts, sensor_topic))
+    return messages
+
+def _encode_single_messages(payload_dicts, sensor_topic):
+    binary_topic = ""
+    if config.get('mqtt_payload_format', DEFAULT_CONFIG['mqtt_payload_format']) == "binary":
+        binary_topic = config.get('mqtt_binary_topic_template', "").format(device_id=device_id)
+    messages = []
+    for payload_dict in payload_dicts:
+        if binary_topic:
+            try:
+                messages.append((binary_topic, encode_binary_reading(payload_dict), [payload_dict]))
+                continue
+            except (KeyError, TypeError, ValueError, OverflowError) as bin_err:
+                logging.warning(f"Binärkodierung fehlgeschlagen ({bin_err}). Sende Datenpunkt als JSON.")
+        try:
+            messages.append((sensor_topic, json.dumps(wire_payload(payload_dict)), [payload_dict]))
+        except (TypeError, ValueError) as json_err:
+            logging.error(f"Fehler beim Kodieren der Daten zu JSON: {json_err}. Überspringe Datenpunkt: {payload_dict}")
+            # Do not re-buffer data that cannot be encoded
+    return messages
+
 # --- Publish or Buffer Data function (Modified to handle JSON conversion) ---
 def publish_or_buffer_data(data_payload):
     """
-    Versucht, Daten via MQTT zu publishen. Puffert bei Fehlschlag.
-    Verarbeitet auch den Buffer, wenn Verbindung besteht.
-    Expects data_payload to be a dictionary.
+    Übergibt einen neuen Messwert an den Uplink-Worker. Der Worker sendet ihn
+    sofort (vor dem Rückstand) oder puffert ihn, wenn keine Verbindung besteht.
+    Expects data_payload to be a Reading (frost_reading).
     """
-    global unsent_data_buffer, mqtt_connected # Use global buffer and connection status
-
-    data_to_publish_dicts = []
-    with buffer_lock: # Protect buffer operations
-        # Add all items from the current buffer
-        data_to_publish_dicts.extend(unsent_data_buffer)
-        unsent_data_buffer.clear() # Optimistically clear buffer, will re-add failed items
+    global first_reading_payload
+    if not isinstance(data_payload, Reading):
+        logging.warning(f"Ungültiger Datentyp für publish_or_buffer_data erhalten: {type(data_payload)}. Erwarte Reading.")
+        return
+    if process_role == "acquire":
+        # Two-process mode: the uplink process picks it up from the ring
+        write_ring_record(KIND_READING, encode_binary_reading(data_payload))
+        return
+    if uplink_worker is None:
+        logging.error("Uplink-Worker nicht initialisiert. Messwert wird nicht gesendet.")
+        return
+    if first_reading_payload is None:
+        first_reading_payload = data_payload  # Its PUBACK ends the startup measurement
+    uplink_worker.submit(data_payload)
 
-        # Add the new payload if one was provided
-        if isinstance(data_payload, dict):
-            data_to_publish_dicts.append(data_payload)
-        elif data_payload is not None:
-            logging.warning(f"Ungültiger Datentyp für publish_or_buffer_data erhalten: {type(data_payload)}. Erwarte Dictionary.")
+def _uplink_encode(payload_dicts):
+    sensor_topic = config.get('mqtt_sensor_topic_template',"").format(device_id=device_id)
+    if not sensor_topic:
+        logging.error("Sensor Topic nicht konfiguriert. Puffere alle Daten.")
+        return None  # Not a skip: the worker keeps everything buffered
+    return build_publish_messages(payload_dicts, sensor_topic)
 
-    if not data_to_publish_dicts:
-        logging.debug("Keine neuen oder gepufferten Daten zum Senden via MQTT.")
-        return # Nothing to do
+def _uplink_publish(topic, payload):
+    """Publish für den Uplink-Worker: MID bei Erfolg, sonst None (Datenpunkte bleiben im Puffer)"""
+    qos = config.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos'])
+    with mqtt_lock:
+        # Check connection just before sending, as it might have dropped
+        if not mqtt_connected or not mqtt_client:
+            return None
+        msg_info = mqtt_publish(mqtt_client, topic, payload, qos=qos, retain=False) # Sensor data usually not retained
+    if msg_info.rc == mqtt.MQTT_ERR_SUCCESS:
+        # Queued in paho only - stays in the durable buffer (ledger) until on_publish confirms
+        logging.debug(f"Nachricht erfolgreich in MQTT Publish-Warteschlange (MID: {msg_info.mid}).")
+        return msg_info.mid
+    logging.error(f"MQTT Publish Fehler (Code: {msg_info.rc}). Puffere Datenpunkt(e).")
+    batch_sizer.on_failure()
+    return None
 
-    failed_payloads = [] # List to hold dictionaries that failed to send
-    successfully_published_count = 0
+def _uplink_publish_message(topic, payload, qos, retain, properties=None):
+    """Publish für Status/Alarme/Metriken/RPC-Antworten aus dem Uplink-Worker (nicht im Zustellbuch); MID oder False"""
+    with mqtt_lock:
+        if not mqtt_connected or not mqtt_client:
+            return False
+        msg_info = mqtt_publish(mqtt_client, topic, payload, qos=qos, retain=retain, properties=properties)
+    if msg_info.rc == mqtt.MQTT_ERR_SUCCESS:
+        logging.debug(f"Nachricht an '{topic}' in MQTT Publish-Warteschlange (MID: {msg_info.mid}).")
+        return msg_info.mid
+    logging.error(f"MQTT Publish Fehler an '{topic}' (Code: {msg_info.rc}).")
+    return False
+
+def _uplink_connected():
+    # Link down: pause publishing, paho would only queue futile writes
+    if link_monitor is not None and link_monitor.is_down():
+        return False
+    with mqtt_lock:
+        return mqtt_connected
+
+def init_uplink_worker():
+    """Erzeugt den Uplink-Worker (einziger Sende-Thread, besitzt den Puffer)"""
+    global uplink_worker
+    uplink_worker = UplinkWorker(
+        encode=_uplink_encode,
+        publish=_uplink_publish,
+        is_connected=_uplink_connected,
+        ledger=delivery_ledger,
+        flow=replay_flow,
+        batch_size=batch_sizer.current,
+        max_buffer=config.get('max_buffer_size', DEFAULT_CONFIG['max_buffer_size']),
+        persist=save_buffer,
+        on_drained=lambda: publish_metrics(mqtt_client),
+        publish_message=_uplink_publish_message,
+        backlog_order=config.get('mqtt_backlog_order', DEFAULT_CONFIG['mqtt_backlog_order']),
+        defer_live=_budget_defer_live,
+        hold_backlog=_budget_hold_backlog,
+        stage=lambda: stage_watchdog.stage("uplink"),
+    )
+    return uplink_worker
+
+def get_uplink_metrics():
+    """Kennzahlen für das Metrics-Topic und die lokale API"""
+    return {
+        "queue_depth": len(uplink_worker) if uplink_worker else 0,
+        "unacked": len(delivery_ledger),
+        "replay": replay_flow.stats(),
+        "ack_latency": delivery_ledger.stats()["ack_latency"],
+        "first_live_after_connect_s": uplink_worker.last_first_live_s if uplink_worker else None,
+        "link_up_to_first_ack_s": link_monitor.last_up_to_ack_s if link_monitor else None,
+        "tls_resumed": tls_sessions.counts["resumed"],
+        "dns_reconnect_delay_s": broker_resolver.last_reconnect_delay_s if broker_resolver else None,
+        "tls_full": tls_sessions.counts["full"],
+        "batch_size": batch_sizer.current(),
+        "budget": _budget_metrics(),
+        "scheduler": {key: value for key, value in scheduler.stats().items() if key != "jobs"} if scheduler else None,
+        "startup_first_publish_s": startup.marks.get("first_publish"),
+        "config_reload_latency_s": round(config_store.last_latency_s, 3) if config_store.last_latency_s is not None else None,
+        "config_rejected": config_store.counts["rejected"],
+    }
 
-    # Get MQTT config needed for publishing
-    sensor_topic = config.get('mqtt_sensor_topic_template',"").format(device_id=device_id)
+def publish_metrics(client):
+    """Reiht Uplink-Kennzahlen (Replay-Durchsatz, Puffertiefe, Ack-Latenz) für das Metrics-Topic ein (QoS 0)"""
+    metrics_topic = config.get('mqtt_metrics_topic_template', "").format(device_id=device_id)
+    if not client or not metrics_topic or uplink_worker is None:
+        return False
+    payload = {"timestamp": datetime.now(timezone.utc).isoformat(), **get_uplink_metrics()}
+    uplink_worker.submit_message(metrics_topic, json.dumps(payload), PRIORITY_STATUS, qos=0)
+    return True
+
+def publish_alert(event, message, **details):
+    """Reiht einen Alarm ein - höchste Priorität, wird vor Messwerten und Rückstand gesendet (QoS 1)"""
+    payload = {"event": event, "message": message, "timestamp": datetime.now(timezone.utc).isoformat(), **details}
+    if process_role == "acquire":
+        logging.warning(f"Alarm an den Uplink-Prozess: {event} - {message}")
+        return write_ring_record(KIND_ALERT, json.dumps(payload, default=str).encode("utf-8"))
+    alert_topic = config.get('mqtt_alert_topic_template', "").format(device_id=device_id)
+    if not alert_topic or uplink_worker is None:
+        return False
     qos = config.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos'])
+    uplink_worker.submit_message(alert_topic, json.dumps(payload, default=str), PRIORITY_ALERT, qos=qos)
+    logging.warning(f"Alarm eingereiht: {event} - {message}")
+    return True
+
+
+# --- GPRS Link Monitor ---
+def on_link_change(up):
+    """Rückruf des LinkMonitors (im Event-Loop): ppp0 hoch -> sofort verbinden, runter -> Senden pausieren"""
+    if up:
+        reconnect_mqtt_now()
+        if uplink_worker is not None:
+            uplink_worker.wake()
+        return
+    with mqtt_lock:
+        client, connected = mqtt_client, mqtt_connected
+    if client and connected:
+        # The TCP connection died with the interface; without this paho notices only after the keepalive
+        sock = client.socket()
+        if sock is not None:
+            logging.info("Link unten: schließe MQTT Socket, Senden pausiert bis der Link wieder oben ist.")
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
-    if not sensor_topic:
-        logging.error("Sensor Topic nicht konfiguriert. Puffere alle Daten.")
-        failed_payloads.extend(data_to_publish_dicts) # Buffer everything
-    else:
-        # --- Check connection status ONCE before the loop ---
-        # Minimal lock duration here
-        client_instance = None
-        initial_connection_check = False
-        with mqtt_lock:
-            initial_connection_check = mqtt_connected
-            client_instance = mqtt_client # Get instance while locked
+def reconnect_mqtt_now():
+    """Verbindet sofort neu, statt auf den exponentiellen Reconnect-Backoff von paho zu warten"""
+    with mqtt_lock:
+        connected = mqtt_connected
+    if mqtt_driver is None or connected or shutdown_requested:
+        return False
+    logging.info("Link oben: verbinde MQTT sofort neu.")
+    mqtt_driver.reconnect_now()  # Cuts the driver's backoff wait short
+    return True
+
+def init_link_monitor():
+    """Startet die Überwachung von ppp0 (Netlink, sonst sysfs), falls konfiguriert"""
+    global link_monitor
+    interface = config.get('link_interface', DEFAULT_CONFIG['link_interface'])
+    if not interface:
+        logging.info("Link-Überwachung deaktiviert.")
+        return False
+    link_monitor = LinkMonitor(interface, on_change=on_link_change,
+                               poll_interval=config.get('link_poll_interval', DEFAULT_CONFIG['link_poll_interval']))
+    link_monitor.start(loop=event_loop)  # Netlink socket in the event loop, no monitor thread
+    if not link_monitor.seen:
+        logging.info(f"Interface {interface} existiert (noch) nicht - Senden wird erst nach dem ersten Link-Up an seinen Zustand gebunden.")
+    return True
+
+
+# --- GPRS Data Budget ---
+def init_data_budget():
+    """Legt den Verbrauchszähler an und lädt den Stand des laufenden Abrechnungsmonats"""
+    global data_budget
+    data_budget = DataBudget(
+        monthly_bytes=int(config.get('budget_monthly_mb', DEFAULT_CONFIG['budget_monthly_mb']) * 1_000_000),
+        reset_day=config.get('budget_reset_day', DEFAULT_CONFIG['budget_reset_day']),
+        interface=config.get('link_interface', DEFAULT_CONFIG['link_interface']),
+        state_file=DATA_BUDGET_FILE,
+        watchdog_interval=config.get('budget_watchdog_ping_interval', DEFAULT_CONFIG['budget_watchdog_ping_interval']),
+        ssh_keepalive_interval=config.get('budget_ssh_keepalive_interval', DEFAULT_CONFIG['budget_ssh_keepalive_interval']),
+    )
+    data_budget.keepalive = config.get('mqtt_keepalive', DEFAULT_CONFIG['mqtt_keepalive'])
+    data_budget.load()
+    data_budget.sample()
+    return data_budget
+
+def update_data_budget():
+    """Aus der Hauptschleife: Zähler übernehmen und Sparstufe neu bestimmen"""
+    global budget_level
+    if data_budget is None:
+        return budget_level
+    with mqtt_lock:
+        data_budget.set_connected(mqtt_connected)
+    data_budget.sample()
+    projection = data_budget.projection()
+    level = data_budget.level(projection)
+    if level != budget_level:
+        name = data_budget.stats()["level_name"]
+        logging.warning(f"Datenbudget: Stufe {budget_level} -> {level} ({name}), "
+                        f"{projection['used_bytes'] / 1e6:.2f} von {projection['budget_bytes'] / 1e6:.0f} MB, "
+                        f"Hochrechnung {projection['projected_bytes'] / 1e6:.2f} MB.")
+        if level >= 2 and level > budget_level:
+            publish_alert("data_budget", f"Datenbudget {name}: Messintervall außerhalb des Frostbereichs verlängert",
+                          level=level, used_bytes=projection['used_bytes'],
+                          remaining_bytes=projection['remaining_bytes'], projected_bytes=projection['projected_bytes'])
+        budget_level = level
+    if shared_ring is not None and process_role == "uplink":
+        shared_ring.budget_level = level  # The acquire process widens its interval from this
+    return level
+
+def outside_frost_band(effective_wet_temp):
+    """True, wenn die Temperatur sicher über dem Frostbereich liegt (unbekannt zählt als Frostbereich)"""
+    if effective_wet_temp is None:
+        return False
+    warning_temp = config.get('warning_temp', DEFAULT_CONFIG['warning_temp'])
+    return effective_wet_temp > warning_temp + config.get('budget_frost_band', DEFAULT_CONFIG['budget_frost_band'])
 
-        if not initial_connection_check or not client_instance:
-            logging.warning("MQTT nicht verbunden (beim Start von publish_or_buffer). Puffere Daten.")
-            failed_payloads.extend(data_to_publish_dicts)
-        else:
-            # Connection seems okay, proceed to loop and publish
-            logging.info(f"Versuche {len(data_to_publish_dicts)} Datenpunkte via MQTT zu senden...")
-            for payload_dict in data_to_publish_dicts:
-                msg_info = None
-                publish_error = False
-                try:
-                    # Ensure payload has device_id (should be added by update_sensor_data)
-                    if 'device_id' not in payload_dict:
-                        payload_dict['device_id'] = device_id
-
-                    # Convert dict to JSON string
-                    payload_str = json.dumps(payload_dict)
-
-                    # --- Lock ONLY around the publish call ---
-                    with mqtt_lock:
-                        # Check connection *again* just before sending, as it might have dropped
-                        if not mqtt_connected:
-                            logging.warning("MQTT Verbindung während Publish-Loop verloren. Puffere.")
-                            publish_error = True # Mark error to handle outside lock
-                        else:
-                            # Actual publish call using the client instance obtained earlier
-                            msg_info = client_instance.publish(
-                                sensor_topic,
-                                payload=payload_str,
-                                qos=qos,
-                                retain=False # Sensor data usually not retained
-                            )
-                    # --- Lock Released ---
-
-                    # --- Process result outside the lock ---
-                    if publish_error:
-                        # If connection lost inside lock check, buffer current item and stop loop
-                        failed_payloads.append(payload_dict)
-                        # Add remaining items back to the buffer list
-                        remaining_index = data_to_publish_dicts.index(payload_dict) + 1
-                        failed_payloads.extend(data_to_publish_dicts[remaining_index:])
-                        logging.warning(f"Publish-Loop unterbrochen, {len(failed_payloads)} Elemente zurück in Buffer.")
-                        break # Stop trying for this batch
-
-                    # Check publish result if no error was flagged
-                    if msg_info and msg_info.rc == mqtt.MQTT_ERR_SUCCESS:
-                        logging.debug(f"Datenpunkt erfolgreich in MQTT Publish-Warteschlange (MID: {msg_info.mid}).")
-                        successfully_published_count += 1
-                    elif msg_info: # msg_info exists but rc is not success
-                        logging.error(f"MQTT Publish Fehler (Code: {msg_info.rc}). Puffere Datenpunkt.")
-                        failed_payloads.append(payload_dict)
-                        # Consider breaking loop if error suggests persistent issue? Maybe not for QoS 1 retries.
-                    else:
-                         # This case should ideally not be reached if publish_error was False
-                         logging.error("Unerwarteter Zustand nach Publish-Versuch (kein msg_info / publish_error=False). Puffere Datenpunkt.")
-                         failed_payloads.append(payload_dict)
+def _budget_defer_live(reading):
+    # Level "knapp": readings outside the frost band wait in the buffer and go out together as an envelope
+    return budget_level >= 2 and outside_frost_band(reading.get('effective_wet_temp'))
+
+def _budget_hold_backlog(count, held_s):
+    if budget_level < 2 or last_readings is None or not outside_frost_band(last_readings.effective_wet_temp):
+        return False
+    return count < batch_sizer.current() and held_s < config.get('budget_hold_max_age', DEFAULT_CONFIG['budget_hold_max_age'])
+
+def _budget_metrics():
+    """Kompakte Budget-Kennzahlen für das Metrics-Topic"""
+    if data_budget is None:
+        return None
+    stats = data_budget.stats()
+    return {key: stats[key] for key in ("level", "used_bytes", "remaining_bytes", "projected_bytes",
+                                        "daily_allowance_bytes", "days_left", "unattributed_bytes", "classes")}
 
-                except json.JSONEncodeError as json_err:
-                    logging.error(f"Fehler beim Kodieren der Daten zu JSON: {json_err}. Überspringe Datenpunkt: {payload_dict}")
-                    # Do not re-buffer data that cannot be encoded
-                except Exception as e:
-                    logging.error(f"Fehler beim Vorbereiten/Publishen via MQTT: {e}. Puffere Datenpunkt.", exc_info=True)
-                    failed_payloads.append(payload_dict) # Buffer on unexpected errors
 
+# --- Local Query API ---
+def get_local_api_last():
+    """Letzte Messwerte für die lokale API (nur Speicher, keine Sperre über Sensor-I/O)"""
+    reading = last_readings.as_dict() if last_readings is not None else {}
+    return {**reading, "last_update_ts": last_update_ts}
 
-    # --- Update buffer with any failed payloads outside the publish loop ---
-    if failed_payloads:
-        with buffer_lock: # Protect buffer access
-            # Prepend failed items back to the start of the buffer
-            # so they are retried first next time.
-            unsent_data_buffer = failed_payloads + unsent_data_buffer
-            save_buffer() # Persist buffer immediately after adding failed items
+def get_local_api_status():
+    """Puffertiefe und Uplink-Zustand für die lokale API"""
+    return {
+        "device_id": device_id,
+        "mqtt_connected": mqtt_connected,
+        "mqtt_broker": config.get('mqtt_broker'),
+        "mqtt_io": mqtt_driver.stats() if mqtt_driver else None,
+        "buffer_depth": len(uplink_worker) if uplink_worker else 0,
+        "uplink": uplink_worker.stats() if uplink_worker else None,
+        "delivery": delivery_ledger.stats(),
+        "session": session_stats.as_dict(),
+        "topic_aliases": topic_aliases.stats(),
+        "replay": replay_flow.stats(),
+        "link": link_monitor.stats() if link_monitor else None,
+        "tls": tls_sessions.stats(),
+        "dns": broker_resolver.stats() if broker_resolver else None,
+        "rpc": {**rpc_dispatcher.counts, "executor": rpc_executor.stats()} if rpc_dispatcher else None,
+        "profiler": profiler.stats() if profiler else None,
+        "budget": data_budget.stats() if data_budget else None,
+        "scheduler": scheduler.stats() if scheduler else None,
+        "ring": shared_ring.stats() if shared_ring else None,
+        "startup": startup.report(),
+        "config": {**config_store.stats(), "inotify": config_watcher.counts if config_watcher else None},
+        "watchdog": {"stages": stage_watchdog.stats(), "stalled": sorted(watchdog_stalls),
+                     "systemd": {**systemd.counts, "watchdog_s": systemd.watchdog_s}},
+        "batch_size": batch_sizer.current(),
+        "max_buffer_size": config.get('max_buffer_size', DEFAULT_CONFIG['max_buffer_size']),
+        "last_update_ts": last_update_ts,
+    }
 
-    log_level = logging.INFO if successfully_published_count > 0 or failed_payloads else logging.DEBUG
-    logging.log(log_level, f"MQTT Publish Ergebnis: Erfolgreich/In Queue: {successfully_published_count}, Neu gepuffert: {len(failed_payloads)}, Aktueller Buffer: {len(unsent_data_buffer)}")
+def start_local_api():
+    """Startet den lokalen Abfrage-Endpunkt (127.0.0.1 oder Unix-Socket), falls aktiviert"""
+    global reading_ring, local_api
+    ring_size = config.get('local_api_ring_size', DEFAULT_CONFIG['local_api_ring_size'])
+    reading_ring = ReadingRing(ring_size)
+    if not config.get('local_api_enabled', DEFAULT_CONFIG['local_api_enabled']):
+        logging.info("Lokale Abfrage-API deaktiviert.")
+        return False
+    try:
+        local_api = LocalQueryServer(
+            reading_ring, get_local_api_last, get_local_api_status,
+            port=config.get('local_api_port', DEFAULT_CONFIG['local_api_port']),
+            socket_path=config.get('local_api_socket', DEFAULT_CONFIG['local_api_socket']),
+        )
+        local_api.start(loop=event_loop)
+        return True
+    except Exception as e:
+        logging.error(f"Lokale Abfrage-API konnte nicht gestartet werden: {e}")
+        local_api = None
+        return False
 
 
+# --- Two-process mode (shared ring) ---
+def init_shared_ring():
+    """Öffnet den Ring zwischen Mess- und Uplink-Prozess (beide Rollen) und den Weck-Socket"""
+    global shared_ring, ring_notifier
+    shared_ring = SharedRing(RING_FILE, slots=config.get('ring_slots', DEFAULT_CONFIG['ring_slots'])).open()
+    ring_notifier = RingNotifier(RING_FILE, process_role)
+    if process_role == "acquire":
+        shared_ring.recover()  # A record written just before a crash counts
+    logging.info(f"Zwei-Prozess-Betrieb ({process_role}): Ring {RING_FILE}, {len(shared_ring)} Datensätze noch nicht übernommen.")
 
-# --- Graceful Shutdown Handler (NEW) ---
-def graceful_shutdown(signum, frame):
-    """Handles SIGINT and SIGTERM for clean shutdown."""
+def write_ring_record(kind, payload):
+    """Messprozess: Datensatz in den Ring schreiben und den Uplink-Prozess wecken"""
+    try:
+        shared_ring.append(kind, payload)
+    except Exception as e:
+        logging.error(f"Datensatz konnte nicht in den Ring geschrieben werden: {e}")
+        return False
+    ring_notifier.notify(NOTIFY_RECORDS)  # Not running: it reads the ring when it starts
+    return True
+
+def accept_ring_reading(reading):
+    """Uplink-Prozess: Messwert aus dem Ring wie eine eigene Messung übernehmen"""
+    global last_readings, last_update_ts
+    last_readings = reading
+    last_update_ts = time.time()
+    if reading_ring is not None:
+        reading_ring.append(reading, reading.epoch)
+    publish_or_buffer_data(reading)
+    ring_reading_event.set()
+
+def drain_ring():
+    """Uplink-Prozess: neue Datensätze übernehmen; bestätigt wird nach dem Speichern der Pufferdatei"""
+    records = shared_ring.read()
+    for index, kind, payload in records:
+        try:
+            if kind == KIND_READING:
+                accept_ring_reading(Reading.from_dict(decode_binary_reading(payload, device_id)))
+            elif kind == KIND_ALERT:
+                alert = json.loads(payload)
+                publish_alert(alert.pop("event"), alert.pop("message"), **alert)
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"Ring-Datensatz {index} nicht lesbar, übersprungen: {e}")
+    if records:
+        scheduler.request("ring_commit")
+    # No return value: the scheduler would take a number as the delay to the next "ring_poll" run
+
+async def ring_commit_job():
+    """Job "ring_commit": Pufferdatei schreiben, dann den Ring bis dorthin freigeben"""
+    position = shared_ring.position
+    if await asyncio.get_running_loop().run_in_executor(None, save_buffer):
+        shared_ring.commit(position)
+
+def on_ring_notify():
+    """Weck-Socket lesbar (im Event-Loop): neue Datensätze (Uplink) oder Messung anfordern (Messprozess)"""
+    messages = ring_notifier.receive()
+    if process_role == "uplink" and NOTIFY_RECORDS in messages:
+        drain_ring()
+    elif process_role == "acquire" and NOTIFY_SAMPLE in messages:
+        scheduler.trigger("sensor")
+
+async def acquire_cycle():
+    """Job "sensor" im Messprozess: Sparstufe vom Uplink-Prozess übernehmen, dann messen"""
+    global budget_level
+    budget_level = shared_ring.budget_level
+    return await sensor_cycle()
+
+
+# --- Graceful Shutdown ---
+def graceful_shutdown(signum, frame=None):
+    """
+    SIGINT/SIGTERM (oder Neustart-Kommando): Herunterfahren anstoßen. Threadsicher;
+    das Aufräumen selbst macht shutdown_node() im Event-Loop in fester Reihenfolge.
+    """
     global shutdown_requested
     if shutdown_requested: # Avoid running multiple times if signal received again
         return
@@ -1441,53 +2164,627 @@ def graceful_shutdown(signum, frame):
     logging.warning(f"Signal {signame} ({signum}) empfangen. Fahre System sauber herunter...")
     print(f"\nSignal {signame} empfangen. Fahre herunter...") # Also print to console
 
-    # 1. Stop the Sensor Thread (by checking shutdown_requested flag)
-    #    Give it a moment to finish its current cycle if possible.
-    #    The main loop check will also stop trying to restart it.
+    if event_loop is not None and shutdown_event is not None:
+        try:
+            event_loop.call_soon_threadsafe(shutdown_event.set)
+        except RuntimeError:
+            pass  # Loop already closed
+
+async def wait_for_shutdown(timeout):
+    """Wartet bis timeout oder bis zum Herunterfahren; True, wenn heruntergefahren wird"""
+    try:
+        await asyncio.wait_for(shutdown_event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    return shutdown_event.is_set()
+
+async def shutdown_node():
+    """Aufräumen nach graceful_shutdown(), der Scheduler ist bereits beendet"""
+    global shutdown_complete
 
-    # 2. Publish the graceful offline status
+    # Running measurements end without a report (the connection goes down next)
+    if profiler is not None:
+        profiler.stop_all("shutdown", publish=False)
+
+    # 1. The graceful offline status, sent directly; the DISCONNECT below follows it on the same connection
     if mqtt_client and mqtt_connected:
         logging.info("Sende 'offline_graceful' Status via MQTT...")
         publish_status(mqtt_client, "offline_graceful")
-        # Give MQTT a moment to send the message
-        time.sleep(1.5) # Increased slightly
-
-    # 3. Stop the MQTT loop
-    if mqtt_client:
-        logging.info("Stoppe MQTT Netzwerk-Loop...")
-        try:
-            mqtt_client.loop_stop()
-        except Exception as e:
-             logging.error(f"Fehler beim Stoppen des MQTT Loops: {e}")
 
-    # 4. Disconnect MQTT client cleanly
-    if mqtt_client:
+    # 2. Disconnect MQTT once everything handed to paho is written (no fixed sleep)
+    if mqtt_driver is not None:
         logging.info("Trenne MQTT Verbindung...")
         try:
-            mqtt_client.disconnect()
+            await mqtt_driver.stop()
         except Exception as e:
              logging.error(f"Fehler beim Trennen der MQTT Verbindung: {e}")
 
-    # 5. Save the data buffer one last time
+    if link_monitor is not None:
+        link_monitor.stop()
+    if rpc_executor is not None:
+        rpc_executor.stop(timeout=1)
+    if data_budget is not None:
+        data_budget.sample()
+        data_budget.save()
+
+    # 3. Stop the uplink worker and save the data buffer one last time
+    if uplink_worker is not None:
+        uplink_worker.stop()
     logging.info("Speichere Datenpuffer...")
-    save_buffer()
+    if save_buffer() and shared_ring is not None:
+        shared_ring.commit()  # Everything read from the ring is in the buffer file now
+    if shared_ring is not None:
+        ring_notifier.close()
+        shared_ring.close()
+
+    # Stop the local query API
+    if local_api:
+        try:
+            local_api.stop()
+        except Exception as e:
+            logging.error(f"Fehler beim Stoppen der lokalen API: {e}")
 
-    # 6. Clean up GPIO
+    if sensor_executor is not None:
+        sensor_executor.shutdown(wait=False)
+
+    # 4. Clean up GPIO
     logging.info("Räume GPIO auf...")
     try:
          GPIO.cleanup()
     except Exception as e:
          logging.error(f"Fehler beim GPIO Cleanup: {e}")
 
-
+    shutdown_complete = True
     logging.warning("System heruntergefahren.")
     print("System heruntergefahren.")
-    sys.exit(0) # Exit cleanly
+
+
+# --- Scheduler-Jobs (run_node()) ---
+last_status_publish_time = 0
+config_mtime = None  # mtime of CONFIG_FILE at the last (re)load
+config_watcher = None  # inotify on the config directory (frost_config.ConfigWatcher), None = mtime polling only
+config_change_detected = None  # monotonic time of the first inotify event not yet reloaded
+
+def _heartbeat_interval():
+    interval = config.get('mqtt_status_heartbeat_interval', DEFAULT_CONFIG['mqtt_status_heartbeat_interval'])
+    return interval * 4 if budget_level >= 3 else interval
+
+def heartbeat_job():
+    """Job "heartbeat": "online"-Status als Lebenszeichen"""
+    global last_status_publish_time
+    with mqtt_lock:
+        connected = mqtt_connected
+    if not connected:
+        return
+    if budget_level >= 1 and last_sensor_publish_time > last_status_publish_time:
+        # Saving data: the sensor message since the last heartbeat already shows we are alive
+        last_status_publish_time = time.time()
+    elif publish_status(mqtt_client, "online"):
+        last_status_publish_time = time.time()
+    else:
+        # The driver's keepalive check notices a dead connection and reconnects.
+        logging.warning("Fehler beim Senden des 'online' Heartbeats. Verbindungsproblem?")
+
+def _metrics_interval():
+    interval = config.get('mqtt_metrics_interval', DEFAULT_CONFIG['mqtt_metrics_interval'])
+    if not interval:
+        return 3600  # Off: only look again for a config change
+    return interval * 4 if budget_level >= 1 else interval
+
+def metrics_job():
+    """Job "metrics": Uplink-Kennzahlen (Replay-Durchsatz, Puffertiefe, Ack-Latenz)"""
+    with mqtt_lock:
+        connected = mqtt_connected
+    if connected and config.get('mqtt_metrics_interval', DEFAULT_CONFIG['mqtt_metrics_interval']):
+        publish_metrics(mqtt_client)
+
+async def buffer_flush_job():
+    """Job "buffer_flush" (nach PUBACKs angefordert): Pufferdatei neu schreiben, Datei-I/O im Executor"""
+    if buffer_dirty:
+        await asyncio.get_running_loop().run_in_executor(None, save_buffer)
+
+def housekeeping_job(mqtt_task_holder):
+    """Job "housekeeping": Uplink-Worker, RPC-Executor und MQTT-Aufgabe prüfen, Datenbudget nachführen"""
+    if not uplink_worker.is_alive():
+        logging.error("Uplink-Worker ist unerwartet gestorben! Starte neu...")
+        uplink_worker.start()
+    if rpc_executor is not None and not rpc_executor.is_alive():
+        logging.error("RPC-Executor ist unerwartet gestorben! Starte neu...")
+        rpc_executor.start()
+    mqtt_task = mqtt_task_holder[0]
+    if mqtt_task is not None and mqtt_task.done():
+        error = None if mqtt_task.cancelled() else mqtt_task.exception()
+        logging.error(f"MQTT-Verbindungsaufgabe ist unerwartet beendet ({error})! Starte neu...")
+        mqtt_task_holder[0] = event_loop.create_task(mqtt_driver.run(), name="MQTT")
+    # GPRS data budget: take over the ppp0 counters, re-evaluate the saving level
+    level = budget_level
+    if update_data_budget() != level:
+        scheduler.wake()  # Heartbeat and metrics intervals depend on the level
+
+def init_watchdog():
+    """Stufen der Prozessrolle anlegen, Watchdog-Job einplanen, Hänger vor einem Neustart melden"""
+    uplink_budget = config.get('watchdog_uplink_budget', DEFAULT_CONFIG['watchdog_uplink_budget'])
+    if process_role != "uplink":
+        # Deadline of the next reading is set by sensor_cycle() from its interval (expect())
+        stage_watchdog.add("sensor", config.get('watchdog_sensor_budget', DEFAULT_CONFIG['watchdog_sensor_budget']))
+    if process_role != "acquire":
+        # The worker steps at least every idle_interval, also while offline
+        stage_watchdog.add("uplink", uplink_budget, period=uplink_worker.idle_interval)
+        stage_watchdog.add("storage", uplink_budget)
+    if systemd.watchdog_s:
+        interval = systemd.watchdog_s / 2
+        logging.info(f"systemd Watchdog aktiv (WatchdogSec={systemd.watchdog_s:.0f}s), Prüfung alle {interval:.0f}s.")
+    else:
+        interval = config.get('watchdog_check_interval', DEFAULT_CONFIG['watchdog_check_interval'])
+    scheduler.add("watchdog", watchdog_job, interval=interval, delay=0, tolerance=interval / 2)
+
+    report = pop_stall_report(WATCHDOG_STALL_FILE)
+    if report and report.get("stalls"):
+        stages = ", ".join(f"{stall['stage']} ({stall['reason']}, {stall['seconds']}s)" for stall in report["stalls"])
+        publish_alert("watchdog_restart", f"Neustart nach Hänger: {stages}", stalls=report["stalls"],
+                      role=report.get("role"), stalled_at=report.get("time"))
+
+async def watchdog_job():
+    """Job "watchdog": nur streicheln, wenn alle Stufen im Budget und in ihrer Frist sind"""
+    stalls = stage_watchdog.check()
+    if not stalls:
+        if watchdog_stalls:
+            logging.info(f"Stufen wieder im Rahmen ({', '.join(sorted(watchdog_stalls))}), Watchdog wird wieder bedient.")
+            watchdog_stalls.clear()
+            systemd.status(f"Läuft ({process_role})")
+        systemd.pet()
+        return
+
+    # No pet: systemd restarts the service after WatchdogSec unless the stage recovers first
+    text = ", ".join(f"{name} {'über Budget' if reason == 'budget' else 'überfällig'} ({seconds}s)"
+                     for name, reason, seconds in stalls)
+    systemd.status(f"Hängt: {text}")
+    new = {name for name, _, _ in stalls} - watchdog_stalls
+    if not new:
+        return
+    watchdog_stalls.update(new)
+    logging.error(f"Watchdog: Stufe hängt: {text}. Watchdog wird nicht mehr bedient.")
+    publish_alert("stall", f"Stufe hängt: {text}", stalls=[{"stage": name, "reason": reason, "seconds": seconds}
+                                                           for name, reason, seconds in stalls])
+    # May block on the same SD card that stalls: in the executor, the loop keeps running
+    await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(save_stall_report, WATCHDOG_STALL_FILE, stalls, role=process_role))
+
+async def budget_save_job():
+    """Job "budget_save": Stand des Datenbudgets speichern"""
+    if data_budget is not None:
+        await asyncio.get_running_loop().run_in_executor(None, data_budget.save)
+
+def apply_uplink_config(keys=None):
+    """Uplink-Parameter aus der Konfiguration übernehmen (Start: alle, Reload: nur die geänderten keys)"""
+    def wanted(key):
+        return keys is None or key in keys
+    if wanted('mqtt_ack_timeout'):
+        delivery_ledger.ack_timeout = config.get('mqtt_ack_timeout', DEFAULT_CONFIG['mqtt_ack_timeout'])
+    # The adapted batch size and replay window are kept unless their own setting changed
+    if wanted('mqtt_batch_size'):
+        batch_sizer.size = config.get('mqtt_batch_size', DEFAULT_CONFIG['mqtt_batch_size'])
+    if wanted('mqtt_batch_size_max'):
+        batch_sizer.maximum = config.get('mqtt_batch_size_max', DEFAULT_CONFIG['mqtt_batch_size_max'])
+        batch_sizer.size = min(batch_sizer.size, batch_sizer.maximum)
+    if wanted('mqtt_replay_window_max'):
+        replay_flow.max_window = config.get('mqtt_replay_window_max', DEFAULT_CONFIG['mqtt_replay_window_max'])
+    if wanted('mqtt_replay_window') or wanted('mqtt_replay_window_max'):
+        window = config.get('mqtt_replay_window', DEFAULT_CONFIG['mqtt_replay_window']) if wanted('mqtt_replay_window') else replay_flow.window
+        replay_flow.window = min(replay_flow.max_window, window)
+    if wanted('mqtt_replay_max_bytes_per_sec'):
+        replay_flow.max_bytes_per_sec = config.get('mqtt_replay_max_bytes_per_sec', DEFAULT_CONFIG['mqtt_replay_max_bytes_per_sec'])
+    if wanted('mqtt_replay_target_latency'):
+        replay_flow.target_latency = config.get('mqtt_replay_target_latency', DEFAULT_CONFIG['mqtt_replay_target_latency'])
+    if uplink_worker is not None:
+        if wanted('max_buffer_size'):
+            uplink_worker.max_buffer = config.get('max_buffer_size', DEFAULT_CONFIG['max_buffer_size'])
+        if wanted('mqtt_backlog_order'):
+            uplink_worker.backlog_order = config.get('mqtt_backlog_order', DEFAULT_CONFIG['mqtt_backlog_order'])
+        if keys is not None:
+            uplink_worker.wake()  # A larger window or buffer may allow sending right away
+
+UPLINK_CONFIG_KEYS = {"mqtt_ack_timeout", "mqtt_batch_size", "mqtt_batch_size_max", "mqtt_replay_window",
+                      "mqtt_replay_window_max", "mqtt_replay_max_bytes_per_sec", "mqtt_replay_target_latency",
+                      "max_buffer_size", "mqtt_backlog_order"}
+BUDGET_CONFIG_KEYS = {"budget_monthly_mb", "budget_reset_day", "budget_watchdog_ping_interval",
+                      "budget_ssh_keepalive_interval", "mqtt_keepalive"}
+
+def _on_config_intervals(changed, old, new):
+    scheduler.wake()  # Heartbeat, metrics and other callable intervals are evaluated again
+
+def _on_config_sensor_interval(changed, old, new):
+    # A shorter interval applies to the pending reading, a longer one from the next reading on
+    job = scheduler.jobs.get("sensor")
+    if job is None or job.started is None:
+        return
+    key = 'check_interval_critical' if sensor_was_critical else 'check_interval'
+    scheduler.request("sensor", max(0.0, job.started + new.get(key, DEFAULT_CONFIG[key]) - time.monotonic()))
+
+def _on_config_uplink(changed, old, new):
+    apply_uplink_config(changed)
+
+async def _on_config_broker(changed, old, new):
+    if mqtt_driver is None:
+        logging.warning("MQTT war beim Start nicht konfiguriert - Broker-Einstellungen wirken erst nach einem Neustart.")
+        return
+    logging.info(f"Broker-Einstellungen geändert ({', '.join(sorted(changed))}), verbinde MQTT neu.")
+    mqtt_ready.clear()
+    await mqtt_driver.reconnect(configure=configure_mqtt_connection)
+    await mqtt_ready.wait()  # The change has taken effect with the CONNACK from the (new) broker
+
+def _on_config_command_topic(changed, old, new):
+    global subscribed_command_topic
+    old_topic = subscribed_command_topic
+    new_topic = new.get('mqtt_command_topic_template', "").format(device_id=device_id)
+    with mqtt_lock:
+        connected = mqtt_connected
+    if mqtt_client is None or not connected:
+        return  # on_connect() sees that the session still holds subscribed_command_topic and switches
+    if old_topic:
+        mqtt_client.unsubscribe(old_topic)
+    if new_topic:
+        mqtt_client.subscribe(new_topic, qos=new.get('mqtt_qos', DEFAULT_CONFIG['mqtt_qos']))
+    subscribed_command_topic = new_topic
+    logging.info(f"Command Topic gewechselt: '{old_topic}' -> '{new_topic}'")
+
+def _on_config_budget(changed, old, new):
+    data_budget.monthly_bytes = int(new.get('budget_monthly_mb', DEFAULT_CONFIG['budget_monthly_mb']) * 1_000_000)
+    data_budget.reset_day = new.get('budget_reset_day', DEFAULT_CONFIG['budget_reset_day'])
+    data_budget.watchdog_interval = new.get('budget_watchdog_ping_interval', DEFAULT_CONFIG['budget_watchdog_ping_interval'])
+    data_budget.ssh_keepalive_interval = new.get('budget_ssh_keepalive_interval', DEFAULT_CONFIG['budget_ssh_keepalive_interval'])
+    data_budget.keepalive = new.get('mqtt_keepalive', DEFAULT_CONFIG['mqtt_keepalive'])
+    update_data_budget()
+    scheduler.wake()  # A new level changes the sensor interval
+
+def _on_config_watchdog(changed, old, new):
+    for stage, key in (("sensor", 'watchdog_sensor_budget'), ("uplink", 'watchdog_uplink_budget'),
+                       ("storage", 'watchdog_uplink_budget')):
+        if stage in stage_watchdog.stages:
+            stage_watchdog.stages[stage].budget = new.get(key, DEFAULT_CONFIG[key])
+
+def _on_config_profiler(changed, old, new):
+    profiler.max_duration = new.get('diagnostics_max_duration', DEFAULT_CONFIG['diagnostics_max_duration'])
+
+def _on_config_restart(changed, old, new):
+    logging.warning(f"Konfiguration: {', '.join(sorted(changed))} wirkt erst nach einem Neustart des Dienstes.")
+
+def init_config_listeners():
+    """Abnehmer der Prozessrolle anmelden: bei einem Reload reagieren nur die betroffenen Teilsysteme"""
+    config_store.subscribe("scheduler", None, _on_config_intervals)
+    config_store.subscribe("watchdog", {'watchdog_sensor_budget', 'watchdog_uplink_budget'}, _on_config_watchdog)
+    config_store.subscribe("restart", RESTART_KEYS, _on_config_restart)
+    if process_role != "uplink":
+        config_store.subscribe("sensor_interval", {'check_interval', 'check_interval_critical'}, _on_config_sensor_interval)
+    if process_role != "acquire":
+        config_store.subscribe("uplink", UPLINK_CONFIG_KEYS, _on_config_uplink)
+        config_store.subscribe("mqtt_broker", MQTT_CONNECTION_KEYS, _on_config_broker)
+        config_store.subscribe("mqtt_command_topic", {'mqtt_command_topic_template'}, _on_config_command_topic)
+        if data_budget is not None:
+            config_store.subscribe("budget", BUDGET_CONFIG_KEYS, _on_config_budget)
+        if profiler is not None:
+            config_store.subscribe("profiler", {'diagnostics_max_duration'}, _on_config_profiler)
+
+def init_config_watcher():
+    """inotify auf die Konfigurationsdatei im Event-Loop; ohne inotify bleibt die Prüfung alle CONFIG_CHECK_INTERVAL s"""
+    global config_watcher
+    try:
+        config_watcher = ConfigWatcher(CONFIG_FILE)
+    except (OSError, AttributeError) as e:
+        logging.warning(f"inotify nicht verfügbar ({e}), Konfigurationsdatei wird alle {CONFIG_CHECK_INTERVAL}s geprüft.")
+        return None
+    event_loop.add_reader(config_watcher.fileno(), on_config_event)
+    return config_watcher
+
+def on_config_event():
+    """inotify-Deskriptor lesbar (im Event-Loop): Reload kurz verzögert anfordern (mehrere Schreibvorgänge = ein Reload)"""
+    global config_change_detected
+    if config_watcher.changed():
+        if config_change_detected is None:
+            config_change_detected = time.monotonic()  # Start of the reload-to-effect measurement
+        scheduler.request("config_check", CONFIG_RELOAD_DEBOUNCE)
+
+def _config_file_mtime():
+    try:
+        return os.stat(CONFIG_FILE).st_mtime
+    except OSError:
+        return None
+
+async def config_check_job():
+    """
+    Job "config_check" (per inotify angefordert, sonst als Rückfallebene alle CONFIG_CHECK_INTERVAL s):
+    geänderte Datei prüfen, als Snapshot übernehmen und nur die betroffenen Teilsysteme umstellen.
+    """
+    global config_mtime, config_change_detected
+    detected_at, config_change_detected = config_change_detected, None
+    mtime = _config_file_mtime()
+    if mtime == config_mtime:
+        return
+    config_mtime = mtime
+    try:
+        values, problems = read_config_file()
+    except (OSError, ValueError) as e:
+        problems = [str(e)]
+    if problems:
+        # A broken or half-edited file never replaces a working configuration
+        config_store.reject(problems)
+        logging.error(f"Konfigurationsdatei {CONFIG_FILE} abgelehnt, laufende Konfiguration bleibt: {'; '.join(problems)}")
+        if process_role != "acquire":  # Both processes watch the file, the uplink reports it once
+            publish_alert("config_rejected", "Konfigurationsdatei abgelehnt, laufende Konfiguration bleibt", problems=problems)
+        return
+    changed = await config_store.reload(ConfigSnapshot(values), detected_at)
+    if changed:
+        logging.info(f"Konfiguration neu geladen ({', '.join(sorted(changed))}), "
+                     f"wirksam nach {config_store.last_latency_s:.2f}s.")
+
+def init_scheduler(mqtt_task_holder):
+    """Legt die periodischen Jobs der Prozessrolle an; die erste Messung läuft sofort"""
+    global scheduler, config_mtime
+    scheduler = Scheduler(event_loop)
+    config_mtime = _config_file_mtime()
+    if process_role == "single":
+        # interval=60 is only the retry after a failed cycle, sensor_cycle() returns the next delay itself
+        scheduler.add("sensor", sensor_cycle, interval=60, delay=0)
+    elif process_role == "acquire":
+        scheduler.add("sensor", acquire_cycle, interval=60, delay=0)
+    else:
+        # Records are announced on the notify socket; the poll only catches announcements sent while restarting
+        scheduler.add("ring_poll", drain_ring, interval=RING_POLL_INTERVAL, delay=0)
+        scheduler.add("ring_commit", ring_commit_job, delay=None)
+    if process_role != "acquire":
+        scheduler.add("heartbeat", heartbeat_job, interval=_heartbeat_interval, delay=_heartbeat_interval())
+        scheduler.add("metrics", metrics_job, interval=_metrics_interval, delay=_metrics_interval())
+        scheduler.add("buffer_flush", buffer_flush_job, delay=None)
+        scheduler.add("housekeeping", lambda: housekeeping_job(mqtt_task_holder), interval=HOUSEKEEPING_INTERVAL,
+                      delay=HOUSEKEEPING_INTERVAL)
+        scheduler.add("budget_save", budget_save_job, interval=BUDGET_SAVE_INTERVAL, delay=BUDGET_SAVE_INTERVAL)
+    # Same period as housekeeping: both share one wakeup
+    scheduler.add("config_check", config_check_job, interval=CONFIG_CHECK_INTERVAL, delay=CONFIG_CHECK_INTERVAL)
+    init_watchdog()
+    init_config_listeners()
+    init_config_watcher()
+    if ring_notifier is not None:
+        event_loop.add_reader(ring_notifier.fileno(), on_ring_notify)
+    return scheduler
+
+async def run_scheduler():
+    """Scheduler bis zum Herunterfahren laufen lassen (und neu starten, falls er unerwartet endet)"""
+    scheduler_task = event_loop.create_task(scheduler.run(), name="Scheduler")
+    systemd.ready(f"Läuft ({process_role})")
+    shutdown_waiter = event_loop.create_task(shutdown_event.wait())
+    try:
+        while not shutdown_event.is_set():
+            await asyncio.wait({scheduler_task, shutdown_waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if scheduler_task.done() and not shutdown_event.is_set():
+                error = None if scheduler_task.cancelled() else scheduler_task.exception()
+                logging.error(f"Scheduler ist unerwartet beendet ({error})! Starte neu...")
+                scheduler_task = event_loop.create_task(scheduler.run(), name="Scheduler")
+    finally:
+        shutdown_waiter.cancel()
+        systemd.stopping()
+        # No new jobs start; a reading in progress is finished first
+        scheduler.stop()
+        try:
+            await scheduler.join(timeout=30)
+            await asyncio.wait_for(scheduler_task, 1)
+        except (asyncio.TimeoutError, Exception) as e:
+            logging.warning(f"Scheduler beim Herunterfahren nicht sauber beendet: {e!r}")
+        if ring_notifier is not None:
+            event_loop.remove_reader(ring_notifier.fileno())
+        if config_watcher is not None:
+            event_loop.remove_reader(config_watcher.fileno())
+            config_watcher.close()
+
+def _setup_event_loop():
+    global event_loop, shutdown_event, sensor_executor, mqtt_ready
+    event_loop = asyncio.get_running_loop()
+    shutdown_event = asyncio.Event()
+    mqtt_ready = asyncio.Event()
+    if shutdown_requested:  # Signal arrived during the initialisation
+        shutdown_event.set()
+    sensor_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SensorIO")
+    if profiler is not None:
+        profiler.loop = event_loop  # cProfile is switched on in the loop thread
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        event_loop.add_signal_handler(sig, graceful_shutdown, sig)
+
+async def wait_for_hardware():
+    """Auf die Hardware-Initialisierung aus main() warten (läuft parallel zu Puffer und MQTT-Verbindung)"""
+    if hardware_init is None:
+        return
+    try:
+        await asyncio.wrap_future(hardware_init)
+    except Exception as e:
+        logging.error(f"Hardware-Initialisierung fehlgeschlagen: {e}", exc_info=True)
+
+async def wait_for_mqtt(started):
+    """Bis zum ersten CONNACK warten, höchstens startup_connect_timeout ab started (Event statt Polling)"""
+    timeout = config.get('startup_connect_timeout', DEFAULT_CONFIG['startup_connect_timeout'])
+    remaining = max(0.0, timeout - (time.monotonic() - started))
+    ready = event_loop.create_task(mqtt_ready.wait())
+    stopping = event_loop.create_task(shutdown_event.wait())
+    await asyncio.wait({ready, stopping}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+    ready.cancel()
+    stopping.cancel()
+    if not mqtt_ready.is_set() and not shutdown_event.is_set():
+        logging.info(f"Noch keine MQTT Verbindung nach {timeout}s, erste Messung wird gepuffert.")
+
+def finish_startup():
+    """Start abgeschlossen (erster Messwert beim Broker bzw. im Ring): Phasen loggen und Bericht speichern"""
+    target = config.get('startup_target_first_publish', DEFAULT_CONFIG['startup_target_first_publish'])
+    startup.log_summary(target)
+    # The acquire process keeps its own report, the uplink one has the first publish (frostctl startbench)
+    path = STARTUP_REPORT_FILE.replace(".json", "_acquire.json") if process_role == "acquire" else STARTUP_REPORT_FILE
+    startup.save(path, role=process_role, target_s=target)
+
+
+async def run_node():
+    """
+    Laufzeit des Knotens im Event-Loop: MQTT (mqtt_driver), Link-Monitor, lokale API und der
+    Scheduler (Messung, Heartbeat, Metriken, Buffer, Datenbudget, Konfiguration) bis zum Herunterfahren.
+    Im Uplink-Prozess kommen die Messwerte aus dem Ring statt vom Sensor-Job.
+    """
+    _setup_event_loop()
+
+    # Lokale Abfrage-API (Ringpuffer + HTTP auf localhost / Unix-Socket)
+    start_local_api()
+
+    mqtt_task_holder = [None]  # housekeeping_job() restarts the task if it died
+    try:
+        # --- MQTT Initialisierung ---
+        connect_started = time.monotonic()
+        with startup.phase("mqtt_init"):
+            mqtt_ok = init_mqtt_client()
+        if not mqtt_ok:
+            logging.warning("MQTT Client konnte nicht initialisiert werden oder ist nicht konfiguriert. Betrieb ohne MQTT-Verbindung.")
+            print("WARNUNG: MQTT Client nicht initialisiert/konfiguriert.")
+            # Continue without MQTT, data will be buffered.
+        else:
+            mqtt_task_holder[0] = event_loop.create_task(mqtt_driver.run(), name="MQTT")
+
+        # The hardware came up while connecting; the first reading goes out live if the CONNACK
+        # follows within startup_connect_timeout, otherwise it goes into the buffer
+        await wait_for_hardware()
+        if mqtt_task_holder[0] is not None:
+            logging.info("Warte kurz auf initiale MQTT Verbindung...")
+            await wait_for_mqtt(connect_started)
+
+        # ppp0 up/down events: reconnect and flush at once instead of waiting for the reconnect backoff
+        init_link_monitor()
+
+        # --- Scheduler: erste Messung sofort, danach nach Fälligkeit ---
+        if not shutdown_event.is_set():
+            init_scheduler(mqtt_task_holder)
+            logging.info("Scheduler gestartet, System läuft.")
+            print("System läuft... (Drücke Strg+C zum Beenden)")
+            await run_scheduler()
+
+    except Exception as e:
+        logging.critical(f"Kritischer, nicht abgefangener Fehler in der Laufzeit: {e}", exc_info=True)
+        # The error status still goes out: shutdown_node() disconnects only after it is written
+        if mqtt_client and mqtt_connected:
+            publish_status(mqtt_client, "offline_critical_error")
+        graceful_shutdown(signal.SIGTERM)
+
+    await shutdown_node()
+    mqtt_task = mqtt_task_holder[0]
+    if mqtt_task is not None:
+        try:
+            await asyncio.wait_for(mqtt_task, 5)
+        except (asyncio.TimeoutError, Exception):
+            pass
+
+
+async def run_acquisition():
+    """
+    Messprozess im Zwei-Prozess-Betrieb: nur Sensor-Job und Konfigurationsprüfung, Messwerte und
+    Alarme gehen in den Ring. Kein MQTT, keine lokale API; der Uplink-Prozess darf fehlen.
+    """
+    global shutdown_complete
+    _setup_event_loop()
+    try:
+        await wait_for_hardware()
+        if not shutdown_event.is_set():
+            init_scheduler(None)
+            logging.info("Messprozess läuft.")
+            print("Messprozess läuft... (Drücke Strg+C zum Beenden)")
+            await run_scheduler()
+    except Exception as e:
+        logging.critical(f"Kritischer, nicht abgefangener Fehler im Messprozess: {e}", exc_info=True)
+        graceful_shutdown(signal.SIGTERM)
+
+    sensor_executor.shutdown(wait=False)
+    ring_notifier.close()
+    shared_ring.close()
+    logging.info("Räume GPIO auf...")
+    try:
+         GPIO.cleanup()
+    except Exception as e:
+         logging.error(f"Fehler beim GPIO Cleanup: {e}")
+    shutdown_complete = True
+    logging.warning("Messprozess beendet.")
+
+
+def _prime_system_info():
+    """psutil laden und den CPU-Zähler starten (cpu_percent(None) misst ab dem vorigen Aufruf)"""
+    import psutil
+    psutil.cpu_percent(interval=None)
+    return True
+
+def init_hardware():
+    """
+    Sensoren (DS18B20, DHT22, ADS1115) parallel initialisieren - jeder Teil wartet auf eigene
+    Hardware bzw. den Blinka-Import; mit 'calibrate' startet danach die Kalibrierung.
+    """
+    logging.info("Initialisiere Hardware...")
+    parts = {"onewire": init_onewire, "dht22": init_dht_sensor, "ads1115": init_battery_monitor,
+             "sysinfo": _prime_system_info}
+
+    def timed(name, func):
+        with startup.phase(name):
+            return func()
+
+    with startup.phase("hardware"), ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix="HardwareInit") as pool:
+        futures = {name: pool.submit(timed, name, func) for name, func in parts.items()}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logging.error(f"Initialisierung {name} fehlgeschlagen: {e}")
+                results[name] = False
+
+    # DS18B20
+    if DRY_SENSOR: logging.info(f"Trockentemperatursensor initialisiert: {DRY_SENSOR}")
+    else: logging.warning("Kein Trockentemperatursensor gefunden/initialisiert!")
+    if WET_SENSOR: logging.info(f"Nasstemperatursensor initialisiert: {WET_SENSOR}")
+    else: logging.warning("Kein Nasstemperatursensor gefunden/initialisiert!")
+
+    # DHT22
+    if results["dht22"]: logging.info("DHT22 Sensor initialisiert.")
+    else: logging.warning("DHT22 Sensor nicht initialisiert oder nicht verfügbar.")
+
+    # ADS1115 & Kalibrierung prüfen
+    battery_monitor_available = results["ads1115"]
+    if battery_monitor_available:
+        logging.info("Batterie-/Spannungs-Monitoring (ADS1115) aktiv.")
+        # Check if calibration has been done (by checking if factor is default 1.0)
+        # Allow calibration via command line arguments for setup purposes
+        if len(sys.argv) > 1 and sys.argv[1].upper() == 'CALIBRATE':
+             print("\n--- START KALIBRIERUNGSMODUS ---")
+             print("Wähle aus:")
+             print(" 1: Batteriespannung kalibrieren")
+             print(" 2: DC-DC Ausgangsspannung kalibrieren")
+             print(" 3: Beide kalibrieren")
+             choice = input("Auswahl (1-3): ")
+             if choice == '1' or choice == '3':
+                  calibrate_battery_sensor()
+             if choice == '2' or choice == '3':
+                  calibrate_dcdc_sensor()
+             print("--- ENDE KALIBRIERUNGSMODUS ---")
+             print("Skript wird jetzt beendet. Bitte ohne 'calibrate' Argument neu starten.")
+             sys.exit(0) # Exit after calibration mode
+        else:
+             # Check if factors seem uncalibrated (still 1.0) and log warning
+             if config.get('battery_calibration_factor', 1.0) == 1.0:
+                  logging.warning("Batteriespannungs-Kalibrierungsfaktor ist 1.0. Ggf. Kalibrierung durchführen (Skript mit 'calibrate' starten).")
+             if config.get('dcdc_calibration_factor', 1.0) == 1.0:
+                  logging.warning("DC-DC Spannungs-Kalibrierungsfaktor ist 1.0. Ggf. Kalibrierung durchführen.")
+    else:
+        logging.warning("Batterie-/Spannungs-Monitoring (ADS1115) nicht verfügbar.")
+    return results
 
 
 def main():
-    """Hauptfunktion"""
-    global device_id, mqtt_client # Allow modification
+    """Hauptfunktion; Argument "acquire" oder "uplink" startet eine Rolle des Zwei-Prozess-Betriebs"""
+    global device_id, mqtt_client, process_role, hardware_init # Allow modification
+    startup.mark("main")  # Interpreter start and imports
+    # Watchdog timeout: systemd sends SIGABRT, the stack of every thread then lands in the journal
+    faulthandler.enable()
+
+    if len(sys.argv) > 1 and sys.argv[1].lower() in ("acquire", "uplink"):
+        process_role = sys.argv[1].lower()
+        threading.current_thread().name = process_role.capitalize()  # Both processes log into the same file
 
     # --- Register Signal Handlers ---
     try:
@@ -1509,139 +2806,47 @@ def main():
 
 
         # Konfiguration laden (sets global device_id)
-        load_config()
+        with startup.phase("config"):
+            load_config()
         print(f"Device ID: {device_id}")
 
-
-        # Buffer laden
-        load_buffer()
-
         # --- Hardware Initialisierung ---
-        logging.info("Initialisiere Hardware...")
-
-        # DS18B20 (already done globally, just log status)
-        if DRY_SENSOR: logging.info(f"Trockentemperatursensor initialisiert: {DRY_SENSOR}")
-        else: logging.warning("Kein Trockentemperatursensor gefunden/initialisiert!")
-        if WET_SENSOR: logging.info(f"Nasstemperatursensor initialisiert: {WET_SENSOR}")
-        else: logging.warning("Kein Nasstemperatursensor gefunden/initialisiert!")
-
-        # DHT22
-        if init_dht_sensor(): logging.info("DHT22 Sensor initialisiert.")
-        else: logging.warning("DHT22 Sensor nicht initialisiert oder nicht verfügbar.")
-
-        # ADS1115 & Kalibrierung prüfen
-        battery_monitor_available = init_battery_monitor()
-        if battery_monitor_available:
-            logging.info("Batterie-/Spannungs-Monitoring (ADS1115) aktiv.")
-            # Check if calibration has been done (by checking if factor is default 1.0)
-            # Allow calibration via command line arguments for setup purposes
-            if len(sys.argv) > 1 and sys.argv[1].upper() == 'CALIBRATE':
-                 print("\n--- START KALIBRIERUNGSMODUS ---")
-                 print("Wähle aus:")
-                 print(" 1: Batteriespannung kalibrieren")
-                 print(" 2: DC-DC Ausgangsspannung kalibrieren")
-                 print(" 3: Beide kalibrieren")
-                 choice = input("Auswahl (1-3): ")
-                 if choice == '1' or choice == '3':
-                      calibrate_battery_sensor()
-                 if choice == '2' or choice == '3':
-                      calibrate_dcdc_sensor()
-                 print("--- ENDE KALIBRIERUNGSMODUS ---")
-                 print("Skript wird jetzt beendet. Bitte ohne 'calibrate' Argument neu starten.")
-                 sys.exit(0) # Exit after calibration mode
-            else:
-                 # Check if factors seem uncalibrated (still 1.0) and log warning
-                 if config.get('battery_calibration_factor', 1.0) == 1.0:
-                      logging.warning("Batteriespannungs-Kalibrierungsfaktor ist 1.0. Ggf. Kalibrierung durchführen (Skript mit 'calibrate' starten).")
-                 if config.get('dcdc_calibration_factor', 1.0) == 1.0:
-                      logging.warning("DC-DC Spannungs-Kalibrierungsfaktor ist 1.0. Ggf. Kalibrierung durchführen.")
-        else:
-            logging.warning("Batterie-/Spannungs-Monitoring (ADS1115) nicht verfügbar.")
-
-
-        # --- MQTT Initialisierung ---
-        if not init_mqtt_client():
-            logging.warning("MQTT Client konnte nicht initialisiert werden oder ist nicht konfiguriert. Betrieb ohne MQTT-Verbindung.")
-            print("WARNUNG: MQTT Client nicht initialisiert/konfiguriert.")
-            # Continue without MQTT, data will be buffered.
-        else:
-            # Allow some time for initial connection attempt before starting sensor loop
-            logging.info("Warte kurz auf initiale MQTT Verbindung...")
-            time.sleep(5) # Wait 5 seconds
-
-
-        # --- Initialer Systemstatus & Sensor Read ---
-        logging.info("Führe erste Sensor-Messung durch...")
-        update_sensor_data() # This now includes logging and MQTT publish attempt
-
-
-        # --- Threads starten ---
-        # Only Sensor Thread is needed now
-        sensor_thread = threading.Thread(target=sensor_monitoring_loop, name="SensorMonitor", daemon=True)
-        sensor_thread.start()
-
-        logging.info("Sensor-Thread gestartet, System läuft.")
-        print("System läuft... (Drücke Strg+C zum Beenden)")
-
-        # --- Hauptschleife (Überwachung der Threads & MQTT Status) ---
-        last_status_publish_time = 0
-        while not shutdown_requested:
-            # 1. Prüfen, ob Sensor-Thread noch läuft
-            if not sensor_thread.is_alive():
-                if not shutdown_requested: # Don't try restart if shutdown is in progress
-                     logging.error("Sensor-Thread ist unerwartet gestorben! Versuche Neustart...")
-                     # Optional: Publish error status?
-                     # publish_status(mqtt_client, "offline_thread_error")
-                     sensor_thread = threading.Thread(target=sensor_monitoring_loop, name="SensorMonitor", daemon=True)
-                     sensor_thread.start()
-                     time.sleep(5) # Wait a bit after restart
-                else:
-                     logging.info("Sensor-Thread beendet (Shutdown angefordert).")
-
-
-            # 2. Prüfen, ob MQTT verbunden ist und Buffer senden
-            with mqtt_lock:
-                 mqtt_is_connected_now = mqtt_connected
-            if mqtt_is_connected_now:
-                 # Periodically send buffer content if connection is up
-                 with buffer_lock:
-                      buffer_has_items = len(unsent_data_buffer) > 0
-                 if buffer_has_items:
-                      logging.info(f"MQTT verbunden und Buffer hat {len(unsent_data_buffer)} Einträge. Versuche erneut zu senden...")
-                      # Run in thread to avoid blocking main loop for long buffer sends
-                      threading.Thread(target=publish_or_buffer_data, args=(None,), name="MQTT_Buffer_Retry").start()
-
-
-                 # 3. Periodically publish "online" status as a heartbeat
-                 current_time = time.time()
-                 heartbeat_interval = config.get('mqtt_status_heartbeat_interval', DEFAULT_CONFIG['mqtt_status_heartbeat_interval'])
-                 if current_time - last_status_publish_time > heartbeat_interval:
-                      if publish_status(mqtt_client, "online"):
-                           last_status_publish_time = current_time
-                      else:
-                           # If publishing status fails, connection might be broken
-                           logging.warning("Fehler beim Senden des 'online' Heartbeats. Verbindungsproblem?")
-                           # Reduce interval slightly to retry sooner? Or rely on Paho's keepalive?
-                           # Let Paho handle keepalive/reconnect for now.
-
-            # 4. Sleep for a while
-            time.sleep(30) # Check threads/buffer/heartbeat every 30 seconds
+        # In the background: buffer load, MQTT connect and DNS run meanwhile; the first reading waits for it
+        if len(sys.argv) > 1 and sys.argv[1].upper() == 'CALIBRATE':
+            init_hardware()  # Interactive, exits afterwards
+        elif process_role != "uplink":
+            hardware_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Startup")
+            hardware_init = hardware_executor.submit(init_hardware)
+            hardware_executor.shutdown(wait=False)
+
+        apply_uplink_config()
+        if process_role != "uplink":
+            reading_sequence.load()  # New boot epoch (the process that numbers the readings)
+        if process_role != "single":
+            init_shared_ring()
+
+        if process_role != "acquire":
+            # Uplink-Worker (einziger Sende-Thread) anlegen und Buffer laden
+            with startup.phase("buffer"):
+                init_uplink_worker()
+                load_buffer()
+                uplink_worker.start()
+                init_rpc()
+
+            # GPRS data budget (per traffic class + ppp0 counters), before the first byte goes out
+            with startup.phase("data_budget"):
+                init_data_budget()
+                update_data_budget()
+
+        # --- Laufzeit: Event-Loop bis zum Herunterfahren ---
+        asyncio.run(run_acquisition() if process_role == "acquire" else run_node())
 
     except KeyboardInterrupt:
-         # This should be caught by the signal handler, but as a fallback:
-         logging.warning("KeyboardInterrupt im Hauptprogramm abgefangen.")
-         graceful_shutdown(signal.SIGINT, None) # Trigger manual shutdown
+         # Ctrl+C before the event loop installed its signal handlers
+         logging.warning("KeyboardInterrupt während der Initialisierung abgefangen.")
 
     except Exception as e:
         logging.critical(f"Kritischer, nicht abgefangener Fehler im Hauptprogramm: {e}", exc_info=True)
-        # Attempt to publish an error status
-        try:
-            if mqtt_client:
-                 # Use a blocking publish attempt for critical error
-                 publish_status(mqtt_client, "offline_critical_error")
-                 time.sleep(2)
-        except Exception as final_pub_err:
-             logging.error(f"Fehler beim Senden des kritischen Fehlerstatus: {final_pub_err}")
 
         # Optional: Trigger automatic reboot on critical failure
         # logging.critical("Löse automatischen Neustart nach kritischem Fehler aus...")
@@ -1649,18 +2854,17 @@ def main():
         #     subprocess.Popen(['sudo', 'reboot'])
         # except Exception as reboot_err:
         #     logging.error(f"Fehler beim Ausführen des Neustart-Befehls nach kritischem Fehler: {reboot_err}")
-        # graceful_shutdown(signal.SIGTERM, None) # Clean up as much as possible
 
     finally:
-        # This block executes even if sys.exit() is called in graceful_shutdown
-        # Ensure GPIO cleanup happens if shutdown handler wasn't fully executed
-        if not shutdown_requested: # If shutdown wasn't initiated gracefully
-             logging.warning("Finally-Block erreicht ohne vorheriges graceful_shutdown. Notfall-Cleanup.")
-             if mqtt_client:
-                  try: mqtt_client.loop_stop(force=True)
-                  except: pass
-                  try: mqtt_client.disconnect()
-                  except: pass
+        # Ensure buffer and GPIO are taken care of if shutdown_node() did not run
+        if not shutdown_complete:
+             logging.warning("Finally-Block erreicht ohne vorheriges shutdown_node(). Notfall-Cleanup.")
+             if uplink_worker is not None:
+                  try:
+                       uplink_worker.stop()
+                       save_buffer()
+                  except Exception:
+                       pass
              try: GPIO.cleanup()
              except: pass
         logging.info("Programm final beendet.")
@@ -0,0 +1,223 @@
+"""
+systemd-Watchdog mit Fristen je Verarbeitungsstufe für das Frostwarnsystem
+
+Bisher wurde nur ein gestorbener Thread bemerkt. Hängt ein DHT22-Lesevorgang,
+der I2C-Bus oder ein Schreibzugriff auf die SD-Karte, sah der Dienst gesund
+aus, obwohl keine Daten mehr flossen. Jetzt meldet jede Stufe ihren
+Fortschritt:
+
+- StageWatchdog: Stufen (Messung, Uplink-Schritt, Pufferdatei) mit Budget
+  (wie lange ein Durchlauf höchstens dauern darf) und Frist bis zum
+  nächsten abgeschlossenen Durchlauf (period bzw. expect()). check()
+  liefert die Stufen, die ihr Budget oder ihre Frist überschritten haben.
+- SystemdNotifier: sd_notify-Protokoll (READY, WATCHDOG, STATUS, STOPPING)
+  über $NOTIFY_SOCKET, ohne python-systemd.
+
+Der Knoten streichelt den Watchdog (WATCHDOG=1) nur, solange check() leer
+ist. Bleibt eine Stufe hängen, hört das Streicheln auf und systemd startet
+den Dienst nach WatchdogSec neu (Restart=always); die hängende Stufe steht
+vorher in STATUS, im Log, in einem Alarm und in einer Datei, die der Knoten
+nach dem Neustart als Alarm meldet. Ein blockierter Event-Loop streichelt
+ebenfalls nicht mehr.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+
+class SystemdNotifier:
+    """sd_notify über den Unix-Datagram-Socket aus $NOTIFY_SOCKET (ohne systemd: alles ein No-op)"""
+
+    def __init__(self, environ=os.environ):
+        address = environ.get("NOTIFY_SOCKET", "")
+        self.address = "\0" + address[1:] if address.startswith("@") else address  # "@": abstract namespace
+        self.sock = None
+        if self.address:
+            try:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+            except OSError as e:
+                logging.warning(f"systemd Notify-Socket nicht verfügbar: {e}")
+        # WatchdogSec= of the unit, only if it is meant for this process
+        usec = environ.get("WATCHDOG_USEC", "")
+        pid = environ.get("WATCHDOG_PID", "")
+        self.watchdog_s = int(usec) / 1e6 if usec.isdigit() and (not pid or pid == str(os.getpid())) else None
+        self.counts = {"sent": 0, "failed": 0, "pets": 0}
+
+    @property
+    def enabled(self):
+        return self.sock is not None
+
+    def notify(self, *assignments):
+        """Zeilen wie "READY=1", "STATUS=..." senden; False ohne systemd oder bei Fehlern"""
+        if self.sock is None:
+            return False
+        try:
+            self.sock.sendto("\n".join(assignments).encode(), self.address)
+            self.counts["sent"] += 1
+            return True
+        except OSError as e:
+            self.counts["failed"] += 1
+            logging.debug(f"sd_notify fehlgeschlagen: {e}")
+            return False
+
+    def ready(self, status=None):
+        return self.notify("READY=1", *([f"STATUS={status}"] if status else []))
+
+    def pet(self):
+        self.counts["pets"] += 1
+        return self.notify("WATCHDOG=1")
+
+    def status(self, text):
+        return self.notify(f"STATUS={text}")
+
+    def stopping(self):
+        return self.notify("STOPPING=1")
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class Stage:
+    """Eine überwachte Stufe; Zähler für die Statistik"""
+
+    def __init__(self, name, budget, period):
+        self.name = name
+        self.budget = budget
+        self.period = period  # Max seconds between completed runs (None: only the budget counts)
+        self.active = []  # Start times of runs in progress (several threads may run a stage)
+        self.due = None  # monotonic: next run must have completed by then
+        self.last_done = None
+        self.last_duration_s = None
+        self.max_duration_s = 0.0
+        self.stalled = False
+        self.counts = {"runs": 0, "over_budget": 0, "stalls": 0}
+
+
+class StageWatchdog:
+    """Fristen je Verarbeitungsstufe (siehe Moduldokumentation)"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, budget, period=None):
+        """Stufe anlegen; die erste Frist läuft ab jetzt (period, sonst erst nach dem ersten Durchlauf)"""
+        stage = Stage(name, budget, period)
+        if period is not None:
+            stage.due = self.clock() + period + budget
+        self.stages[name] = stage
+        return stage
+
+    # begin/end/expect ignore stages not added yet (e.g. a buffer write before the scheduler starts)
+
+    def begin(self, name):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is not None:
+                stage.active.append(self.clock())
+
+    def end(self, name):
+        now = self.clock()
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None or not stage.active:
+                return
+            duration = now - stage.active.pop(0)
+            stage.counts["runs"] += 1
+            stage.last_done = now
+            stage.last_duration_s = duration
+            stage.max_duration_s = max(stage.max_duration_s, duration)
+            if duration > stage.budget:
+                stage.counts["over_budget"] += 1
+                logging.warning(f"Stufe {name} hat {duration:.1f}s gebraucht (Budget {stage.budget}s).")
+            if stage.period is not None:
+                stage.due = now + stage.period + stage.budget
+
+    @contextmanager
+    def stage(self, name):
+        """Ein Durchlauf der Stufe (auch bei Fehlern abgeschlossen - hängen ist das Problem, nicht scheitern)"""
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def expect(self, name, within):
+        """Nächster Durchlauf muss binnen within Sekunden (plus Budget) abgeschlossen sein, z.B. Messintervall"""
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is not None:
+                stage.due = self.clock() + within + stage.budget
+
+    def check(self):
+        """Hängende Stufen als Liste (name, Grund, Sekunden); leer = alles im Rahmen"""
+        now = self.clock()
+        stalls = []
+        with self._lock:
+            for stage in self.stages.values():
+                if stage.active and now - stage.active[0] > stage.budget:
+                    stalls.append((stage.name, "budget", round(now - stage.active[0], 1)))
+                elif stage.due is not None and not stage.active and now > stage.due:
+                    stalls.append((stage.name, "overdue", round(now - stage.due, 1)))
+                else:
+                    stage.stalled = False
+                    continue
+                if not stage.stalled:
+                    stage.stalled = True
+                    stage.counts["stalls"] += 1
+        return stalls
+
+    def stats(self):
+        now = self.clock()
+        with self._lock:
+            return {
+                stage.name: {
+                    **stage.counts,
+                    "budget_s": stage.budget,
+                    "running_s": round(now - stage.active[0], 1) if stage.active else None,
+                    "last_duration_s": round(stage.last_duration_s, 3) if stage.last_duration_s is not None else None,
+                    "max_duration_s": round(stage.max_duration_s, 3),
+                    "due_in_s": round(stage.due - now, 1) if stage.due is not None else None,
+                }
+                for stage in self.stages.values()
+            }
+
+
+def save_stall_report(path, stalls, **extra):
+    """Hängende Stufen für den nächsten Start festhalten (der Neustart durch systemd folgt)"""
+    report = {"stalls": [{"stage": name, "reason": reason, "seconds": seconds} for name, reason, seconds in stalls],
+              "time": time.time(), **extra}
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(report, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.warning(f"Watchdog-Bericht {path} konnte nicht gespeichert werden: {e}")
+
+
+def pop_stall_report(path):
+    """Bericht eines vorigen Laufs lesen und entfernen; None, wenn es keinen gibt"""
+    try:
+        with open(path) as f:
+            report = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Watchdog-Bericht {path} nicht lesbar: {e}")
+        report = None
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return report
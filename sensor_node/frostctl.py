@@ -0,0 +1,1371 @@
+#!/usr/bin/env python3
+"""
+frostctl - Werkzeuge für die Auswertung der Frostwarnsystem-Daten auf dem Node
+
+Befehle:
+- analyze: Nachtstatistiken aus temp_log_mqtt.csv oder einem Binärarchiv
+           (Minimum, Zeit unter warning_temp, Abkühlraten, Datenlücken,
+           gemessene vs. berechnete Nasstemperatur, Batterieeinbruch)
+- archive: Wandelt die CSV-Logdatei in ein kompaktes Binärarchiv (.npy) um
+- bench:   Vergleicht Nutzlast-Formate (Bytes, Kodierzeit, geschätzte
+           Übertragungszeit über GPRS) für Live-Messwerte und einen Pufferabbau
+- stress:  Belastungstest des Uplink-Workers gegen eine simulierte Verbindung
+           (parallele Erzeuger, zufällige Verbindungsabbrüche): prüft, dass
+           jeder Messwert genau einmal und der Rückstand in Reihenfolge gesendet wird
+- tlsbench: Misst Handshake-Bytes und -Zeit voller gegenüber wiederaufgenommener
+           TLS-Verbindungen gegen einen lokalen TLS-Broker-Ersatz (wie Caddy auf 8883)
+- idlebench: Vergleicht CPU-Zeit und Aufwachvorgänge im Leerlauf: Thread je
+           Aufgabe (paho loop_start, Link-Monitor, lokale API) gegen die
+           asyncio-Laufzeit (frost_aio)
+- jitterbench: Misst den Zeitversatz der Messung (Aufwachen, zeitkritisches
+           Einlesen wie beim DHT22) ohne Uplink-Last, mit Uplink-Last im selben
+           Prozess und mit Uplink-Last im eigenen Prozess (Ring, frost_ring)
+- startbench: Startet den Dienst mehrmals neu und wertet den Startbericht aus
+           (Phasen, erstes CONNACK, Zeit bis zum ersten bestätigten Messwert)
+- readingbench: Speicher je gepuffertem Messwert, Speicherspitze und Zeit je
+           Messzyklus und Laden der Pufferdatei: dict je Messwert mit Kopien
+           (bisher) gegen den kompakten Datensatz (frost_reading.Reading)
+
+Die Daten werden blockweise mit NumPy verarbeitet, damit auch mehrjährige
+Logs im Speicher des Pi Zero bleiben.
+
+Beispiele:
+    python frostctl.py analyze /home/pi/temp_log_mqtt.csv --last 7
+    python frostctl.py archive /home/pi/temp_log_mqtt.csv /home/pi/temp_log_mqtt.npy
+    python frostctl.py analyze /home/pi/temp_log_mqtt.npy --json
+    python frostctl.py bench --readings 1000 --rtt 0.6 --kbps 20
+    python frostctl.py stress --producers 4 --readings 2000
+    python frostctl.py tlsbench --connects 5 --rtt 0.6
+    python frostctl.py idlebench --seconds 60
+    python frostctl.py jitterbench --seconds 10
+    sudo python frostctl.py startbench --runs 5
+    python frostctl.py readingbench --readings 5000
+"""
+
+import argparse
+import collections
+import json
+import math
+import os
+import random
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from frost_codec import decode_binary_reading, decode_envelope, encode_binary_reading, encode_envelope
+from frost_reading import Reading, parse_timestamp
+from frost_uplink import (BACKLOG_ORDERS, TOPIC_ALIAS_PROPERTY_BYTES, DeliveryLedger, ReplayFlowController,
+                          TLSSessionCache, UplinkWorker, publish_packet_bytes)
+
+CONFIG_FILE = "/home/pi/frost_config_mqtt.json"
+LOG_FILE = "/home/pi/temp_log_mqtt.csv"
+
+DEFAULT_WARNING_TEMP = 0.0
+DEFAULT_CHECK_INTERVAL = 900
+DEFAULT_CHUNK_ROWS = 20000
+
+# Spalten der CSV-Logdatei (siehe log_data() in frost_warning_mqtt.py), ohne Zeitstempel
+CSV_COLUMNS = [
+    "dry_temp", "wet_temp", "humidity", "calc_wet_temp", "effective_wet_temp",
+    "battery_percent", "battery_voltage", "dcdc_voltage"
+]
+
+# Datensatzformat des Binärarchivs: Epoch-Sekunden + float32 Messwerte (NaN = fehlt)
+ARCHIVE_DTYPE = np.dtype([("ts", "<i8")] + [(name, "<f4") for name in CSV_COLUMNS])
+
+# Eine "Nacht" läuft von 12:00 bis 12:00 Uhr Ortszeit, damit ein Frostereignis
+# nicht an Mitternacht geteilt wird.
+NIGHT_OFFSET_SECONDS = 12 * 3600
+
+
+def load_analysis_settings(config_path):
+    """Liest warning_temp und check_interval aus der Node-Konfiguration (falls vorhanden)"""
+    warning_temp = DEFAULT_WARNING_TEMP
+    check_interval = DEFAULT_CHECK_INTERVAL
+    try:
+        if config_path and os.path.exists(config_path):
+            with open(config_path, 'r') as f:
+                loaded = json.load(f)
+            warning_temp = float(loaded.get("warning_temp", warning_temp))
+            check_interval = int(loaded.get("check_interval", check_interval))
+    except (ValueError, TypeError, json.JSONDecodeError) as e:
+        print(f"WARNUNG: Konfiguration {config_path} nicht lesbar ({e}), verwende Standardwerte.", file=sys.stderr)
+    return warning_temp, check_interval
+
+
+def _parse_csv_lines(lines):
+    """Wandelt CSV-Zeilen in ein strukturiertes Array (ARCHIVE_DTYPE) um"""
+    n_cols = len(CSV_COLUMNS) + 1
+    rows = [line.rstrip("\r\n").split(",") for line in lines if line.strip()]
+    # Zeilen mit falscher Spaltenzahl (z.B. abgeschnittene letzte Zeile) verwerfen
+    rows = [r for r in rows if len(r) == n_cols]
+    out = np.empty(len(rows), dtype=ARCHIVE_DTYPE)
+    if not rows:
+        return out
+
+    columns = list(zip(*rows))
+    del rows
+    try:
+        out["ts"] = np.array(columns[0], dtype="datetime64[s]").astype(np.int64)
+        valid = None
+    except ValueError:
+        # Einzelne kaputte Zeitstempel: zeilenweise parsen und ungültige verwerfen
+        ts = np.full(len(columns[0]), -1, dtype=np.int64)
+        for i, raw in enumerate(columns[0]):
+            try:
+                ts[i] = np.datetime64(raw, "s").astype(np.int64)
+            except ValueError:
+                pass
+        out["ts"] = ts
+        valid = ts >= 0
+
+    for name, column in zip(CSV_COLUMNS, columns[1:]):
+        values = np.array(column, dtype="U16")
+        values[values == ""] = "nan"
+        out[name] = values.astype(np.float32)
+    if valid is not None:
+        out = out[valid]
+    return out
+
+
+def iter_csv_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Liefert die CSV-Logdatei blockweise als strukturierte Arrays"""
+    with open(path, 'r', newline='') as f:
+        header = f.readline()
+        if not header.startswith("Zeitstempel"):
+            # Datei ohne Header: erste Zeile ist bereits ein Datensatz
+            f.seek(0)
+        while True:
+            lines = f.readlines(chunk_rows * 80)  # Größenhinweis in Bytes (~80 Byte/Zeile)
+            if not lines:
+                break
+            yield _parse_csv_lines(lines)
+
+
+def iter_archive_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Liefert ein Binärarchiv blockweise (speicherabgebildet, kein Volllesen)"""
+    data = np.load(path, mmap_mode='r')
+    if data.dtype != ARCHIVE_DTYPE:
+        raise ValueError(f"Unbekanntes Archivformat in {path}: {data.dtype}")
+    for start in range(0, len(data), chunk_rows):
+        yield np.array(data[start:start + chunk_rows])
+
+
+def iter_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Wählt anhand der Dateiendung den passenden Leser"""
+    if path.endswith(".npy"):
+        return iter_archive_chunks(path, chunk_rows)
+    return iter_csv_chunks(path, chunk_rows)
+
+
+class NightAnalyzer:
+    """
+    Sammelt Nachtstatistiken in einem Durchlauf über beliebig viele Blöcke.
+    Pro Nacht werden nur wenige Skalare gehalten, der Speicherbedarf hängt
+    also nur von der Blockgröße und der Anzahl der Nächte ab.
+    """
+
+    def __init__(self, warning_temp, gap_seconds, utc_offset_seconds):
+        self.warning_temp = warning_temp
+        self.gap_seconds = gap_seconds
+        self.utc_offset_seconds = utc_offset_seconds
+        self.nights = {}
+        self._prev = None  # Letzter Datensatz des vorherigen Blocks (für Differenzen)
+        self.rows = 0
+
+    def _night_of(self, ts):
+        return (ts + self.utc_offset_seconds - NIGHT_OFFSET_SECONDS) // 86400
+
+    def _acc(self, night):
+        acc = self.nights.get(night)
+        if acc is None:
+            acc = {
+                "samples": 0,
+                "first_ts": None, "last_ts": None,
+                "min_wet": math.inf, "min_wet_ts": None,
+                "min_dry": math.inf,
+                "below_seconds": 0.0,
+                "max_cooling_rate": 0.0,
+                "gaps": 0, "gap_seconds": 0.0,
+                "wet_pairs": 0, "wet_diff_sum": 0.0, "wet_absdiff_sum": 0.0,
+                "min_battery_v": math.inf, "max_battery_v": -math.inf,
+                "min_battery_pct": math.inf,
+            }
+            self.nights[night] = acc
+        return acc
+
+    @staticmethod
+    def _reduce(func, values, starts, empty):
+        """Gruppenweise Reduktion mit NaN-Behandlung (NaN -> neutrales Element)"""
+        clean = np.where(np.isnan(values), empty, values)
+        return func.reduceat(clean, starts) if len(clean) else np.array([])
+
+    def feed(self, chunk):
+        """Verarbeitet einen Block (strukturiertes Array in zeitlicher Reihenfolge)"""
+        if len(chunk) == 0:
+            return
+        chunk = chunk[np.argsort(chunk["ts"], kind="stable")]
+        self.rows += len(chunk)
+
+        ts = chunk["ts"]
+        eff = chunk["effective_wet_temp"].astype(np.float64)
+        dry = chunk["dry_temp"].astype(np.float64)
+        wet = chunk["wet_temp"].astype(np.float64)
+        calc = chunk["calc_wet_temp"].astype(np.float64)
+        bat_v = chunk["battery_voltage"].astype(np.float64)
+        bat_p = chunk["battery_percent"].astype(np.float64)
+
+        # Intervall-Kennzahlen beziehen sich auf (vorheriger Datensatz -> aktueller).
+        # Der letzte Datensatz des vorherigen Blocks wird vorangestellt.
+        if self._prev is not None:
+            p_ts, p_eff, p_dry = self._prev
+            all_ts = np.concatenate(([p_ts], ts))
+            all_eff = np.concatenate(([p_eff], eff))
+            all_dry = np.concatenate(([p_dry], dry))
+        else:
+            all_ts, all_eff, all_dry = ts, eff, dry
+        self._prev = (ts[-1], eff[-1], dry[-1])
+
+        dt = np.diff(all_ts).astype(np.float64)
+        start_ts = all_ts[:-1]
+        start_eff = all_eff[:-1]
+        dT = np.diff(all_dry)
+        contiguous = (dt > 0) & (dt <= self.gap_seconds)
+        gap = dt > self.gap_seconds
+        below = contiguous & (start_eff <= self.warning_temp)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rate = np.where(contiguous & ~np.isnan(dT), dT / dt * 3600.0, 0.0)
+
+        self._feed_intervals(self._night_of(start_ts), dt, below, gap, rate)
+        self._feed_samples(self._night_of(ts), ts, eff, dry, wet, calc, bat_v, bat_p)
+
+    def _feed_intervals(self, nights, dt, below, gap, rate):
+        if len(nights) == 0:
+            return
+        starts = np.flatnonzero(np.r_[True, nights[1:] != nights[:-1]])
+        below_s = np.add.reduceat(np.where(below, dt, 0.0), starts)
+        gap_n = np.add.reduceat(gap.astype(np.int64), starts)
+        gap_s = np.add.reduceat(np.where(gap, dt, 0.0), starts)
+        min_rate = np.minimum.reduceat(rate, starts)
+        for i, night in enumerate(nights[starts].tolist()):
+            acc = self._acc(night)
+            acc["below_seconds"] += float(below_s[i])
+            acc["gaps"] += int(gap_n[i])
+            acc["gap_seconds"] += float(gap_s[i])
+            acc["max_cooling_rate"] = min(acc["max_cooling_rate"], float(min_rate[i]))
+
+    def _feed_samples(self, nights, ts, eff, dry, wet, calc, bat_v, bat_p):
+        starts = np.flatnonzero(np.r_[True, nights[1:] != nights[:-1]])
+        ends = np.r_[starts[1:], len(nights)]
+
+        min_wet = self._reduce(np.minimum, eff, starts, np.inf)
+        min_dry = self._reduce(np.minimum, dry, starts, np.inf)
+        min_bv = self._reduce(np.minimum, bat_v, starts, np.inf)
+        max_bv = self._reduce(np.maximum, bat_v, starts, -np.inf)
+        min_bp = self._reduce(np.minimum, bat_p, starts, np.inf)
+
+        pair = ~np.isnan(wet) & ~np.isnan(calc)
+        diff = np.where(pair, wet - calc, 0.0)
+        pair_n = np.add.reduceat(pair.astype(np.int64), starts)
+        diff_sum = np.add.reduceat(diff, starts)
+        absdiff_sum = np.add.reduceat(np.abs(diff), starts)
+
+        eff_for_argmin = np.where(np.isnan(eff), np.inf, eff)
+        for i, night in enumerate(nights[starts].tolist()):
+            s, e = starts[i], ends[i]
+            acc = self._acc(night)
+            acc["samples"] += int(e - s)
+            first, last = int(ts[s]), int(ts[e - 1])
+            acc["first_ts"] = first if acc["first_ts"] is None else min(acc["first_ts"], first)
+            acc["last_ts"] = last if acc["last_ts"] is None else max(acc["last_ts"], last)
+            if min_wet[i] < acc["min_wet"]:
+                acc["min_wet"] = float(min_wet[i])
+                acc["min_wet_ts"] = int(ts[s + int(np.argmin(eff_for_argmin[s:e]))])
+            acc["min_dry"] = min(acc["min_dry"], float(min_dry[i]))
+            acc["min_battery_v"] = min(acc["min_battery_v"], float(min_bv[i]))
+            acc["max_battery_v"] = max(acc["max_battery_v"], float(max_bv[i]))
+            acc["min_battery_pct"] = min(acc["min_battery_pct"], float(min_bp[i]))
+            acc["wet_pairs"] += int(pair_n[i])
+            acc["wet_diff_sum"] += float(diff_sum[i])
+            acc["wet_absdiff_sum"] += float(absdiff_sum[i])
+
+    def results(self):
+        """Liefert die Nachtstatistiken als Liste von Dicts (chronologisch)"""
+        out = []
+
+        def finite(value, prec=2):
+            return round(value, prec) if value is not None and math.isfinite(value) else None
+
+        for night in sorted(self.nights):
+            acc = self.nights[night]
+            night_start = night * 86400 + NIGHT_OFFSET_SECONDS - self.utc_offset_seconds
+            pairs = acc["wet_pairs"]
+            sag = acc["max_battery_v"] - acc["min_battery_v"]
+            out.append({
+                "night": time.strftime("%Y-%m-%d", time.gmtime(night_start + self.utc_offset_seconds)),
+                "samples": acc["samples"],
+                "first": _iso(acc["first_ts"]),
+                "last": _iso(acc["last_ts"]),
+                "min_wet_temp": finite(acc["min_wet"]),
+                "min_wet_temp_at": _iso(acc["min_wet_ts"]),
+                "min_dry_temp": finite(acc["min_dry"]),
+                "minutes_below_warning": round(acc["below_seconds"] / 60.0, 1),
+                "max_cooling_rate_c_per_h": finite(acc["max_cooling_rate"]),
+                "gaps": acc["gaps"],
+                "gap_minutes": round(acc["gap_seconds"] / 60.0, 1),
+                "wet_pairs": pairs,
+                "wet_bias": finite(acc["wet_diff_sum"] / pairs, 3) if pairs else None,
+                "wet_mae": finite(acc["wet_absdiff_sum"] / pairs, 3) if pairs else None,
+                "min_battery_voltage": finite(acc["min_battery_v"]),
+                "battery_sag_v": finite(sag),
+                "min_battery_percent": finite(acc["min_battery_pct"], 0),
+            })
+        return out
+
+
+def _iso(ts):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)) if ts is not None else None
+
+
+def _cell(value, prec=2):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.{prec}f}"
+    return str(value)
+
+
+def print_table(results, warning_temp):
+    """Gibt die Nachtstatistiken als Tabelle aus"""
+    print(f"Nachtauswertung (Warnschwelle {warning_temp:.1f}°C, Nacht = 12:00-12:00 Ortszeit)")
+    header = (f"{'Nacht':<10} {'N':>5} {'minNass':>7} {'um (UTC)':>8} {'minTr':>6} {'<Warn':>7} "
+              f"{'Kühl/h':>7} {'Lücken':>6} {'L.min':>7} {'Nass-Δ':>7} {'MAE':>6} {'Bat.min':>7} {'Einbr.':>6}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        at = r["min_wet_temp_at"][11:16] if r["min_wet_temp_at"] else "-"
+        print(f"{r['night']:<10} {r['samples']:>5} {_cell(r['min_wet_temp']):>7} {at:>8} "
+              f"{_cell(r['min_dry_temp']):>6} {_cell(r['minutes_below_warning'], 0):>7} "
+              f"{_cell(r['max_cooling_rate_c_per_h']):>7} {r['gaps']:>6} {_cell(r['gap_minutes'], 0):>7} "
+              f"{_cell(r['wet_bias']):>7} {_cell(r['wet_mae']):>6} "
+              f"{_cell(r['min_battery_voltage']):>7} {_cell(r['battery_sag_v']):>6}")
+
+
+def cmd_analyze(args):
+    warning_temp, check_interval = load_analysis_settings(args.config)
+    if args.warning_temp is not None:
+        warning_temp = args.warning_temp
+    gap_seconds = args.gap if args.gap else 2.5 * check_interval
+    utc_offset = args.utc_offset * 3600 if args.utc_offset is not None else time.localtime().tm_gmtoff
+
+    analyzer = NightAnalyzer(warning_temp, gap_seconds, int(utc_offset))
+    started = time.monotonic()
+    for chunk in iter_chunks(args.path, args.chunk_rows):
+        analyzer.feed(chunk)
+    elapsed = time.monotonic() - started
+
+    results = analyzer.results()
+    if args.last:
+        results = results[-args.last:]
+    if args.json:
+        print(json.dumps({"warning_temp": warning_temp, "rows": analyzer.rows,
+                          "elapsed_s": round(elapsed, 3), "nights": results}, indent=2))
+    else:
+        print_table(results, warning_temp)
+        print(f"\n{analyzer.rows} Datensätze in {elapsed:.2f}s ausgewertet.")
+    return 0
+
+
+def cmd_archive(args):
+    """CSV -> Binärarchiv. Zwei Durchläufe (Zählen, Schreiben), damit nie die ganze Datei im RAM liegt."""
+    total = sum(len(chunk) for chunk in iter_csv_chunks(args.csv, args.chunk_rows))
+    out = np.lib.format.open_memmap(args.out, mode='w+', dtype=ARCHIVE_DTYPE, shape=(total,))
+    pos = 0
+    for chunk in iter_csv_chunks(args.csv, args.chunk_rows):
+        out[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+    out.flush()
+    del out
+    print(f"{total} Datensätze nach {args.out} archiviert ({os.path.getsize(args.out) / 1024:.0f} KiB).")
+    return 0
+
+
+def sample_readings(count, device_id=None, interval=300):
+    """Erzeugt realistische Messwert-Dicts wie update_sensor_data() (für Benchmarks)"""
+    device_id = device_id or str(uuid.uuid4())
+    start = datetime.now(timezone.utc) - timedelta(seconds=count * interval)
+    rng = random.Random(42)
+    readings = []
+    for i in range(count):
+        dry = 2.0 + 4.0 * math.sin(i / 40.0) + rng.gauss(0, 0.2)
+        humidity = 85.0 + rng.gauss(0, 3)
+        readings.append({
+            "timestamp": (start + timedelta(seconds=i * interval)).isoformat(),
+            "device_id": device_id,
+            "seq": 1000 + i, "boot": 7,
+            "dry_temp": round(dry, 3), "wet_temp": round(dry - 0.8, 3),
+            "humidity": round(humidity, 1), "calc_wet_temp": round(dry - 0.9, 6),
+            "effective_wet_temp": round(dry - 0.8, 3),
+            "battery_percent": 82, "battery_voltage": 12.61 + rng.gauss(0, 0.01),
+            "dcdc_voltage": 5.08 + rng.gauss(0, 0.01),
+            "cpu_percent": round(rng.uniform(1, 15), 1), "memory_percent": 23.4, "disk_percent": 31.2,
+            "uptime_seconds": 86400 + i * interval, "uptime_str": f"{1 + i * interval // 86400}d 3h 12m",
+            "ip_address": "10.64.12.7",
+        })
+    return readings
+
+
+def _replay_estimate(message_sizes, rtt, kbps, inflight):
+    """Übertragungszeit: Serialisierung über die Bandbreite + RTT je Fenster voller Nachrichten"""
+    total_bytes = sum(message_sizes)
+    rounds = math.ceil(len(message_sizes) / inflight) if message_sizes else 0
+    return total_bytes, total_bytes * 8 / (kbps * 1000.0) + rounds * rtt
+
+
+def _aliased_packet_sizes(topic, payload_lens):
+    """PUBLISH+PUBACK-Größen mit Topic Alias: erste Nachricht mit Topic, danach nur der Alias"""
+    return [publish_packet_bytes(topic if i == 0 else "", n, property_len=TOPIC_ALIAS_PROPERTY_BYTES)
+            for i, n in enumerate(payload_lens)]
+
+
+def cmd_bench(args):
+    readings = sample_readings(args.readings)
+    device_id = readings[0]["device_id"]
+    sensor_topic = f"frostsystem/{device_id}/sensors"
+    batch_topic = f"frostsystem/{device_id}/sensors/batch"
+    binary_topic = f"frostsystem/{device_id}/sensors/bin"
+    results = []
+
+    started = time.perf_counter()
+    payloads = [json.dumps(r) for r in readings]
+    encode_s = time.perf_counter() - started
+    sizes = [publish_packet_bytes(sensor_topic, len(p.encode("utf-8"))) for p in payloads]
+    total, replay_s = _replay_estimate(sizes, args.rtt, args.kbps, args.inflight)
+    results.append(("JSON einzeln", len(sizes), total, encode_s, replay_s))
+
+    # Topic alias + payload without device_id/uptime_str (mqtt_trim_payload)
+    started = time.perf_counter()
+    trimmed = [json.dumps({k: v for k, v in r.items() if k not in ("device_id", "uptime_str")}) for r in readings]
+    encode_s = time.perf_counter() - started
+    sizes = _aliased_packet_sizes(sensor_topic, [len(p.encode("utf-8")) for p in trimmed])
+    total, replay_s = _replay_estimate(sizes, args.rtt, args.kbps, args.inflight)
+    results.append(("JSON + Alias", len(sizes), total, encode_s, replay_s))
+
+    started = time.perf_counter()
+    binaries = [encode_binary_reading(r) for r in readings]
+    encode_s = time.perf_counter() - started
+    assert all(decode_binary_reading(b)["timestamp"] for b in binaries)
+    sizes = [publish_packet_bytes(binary_topic, len(b)) for b in binaries]
+    total, replay_s = _replay_estimate(sizes, args.rtt, args.kbps, args.inflight)
+    results.append(("Binär einzeln", len(sizes), total, encode_s, replay_s))
+
+    for batch_size in args.batch_sizes:
+        started = time.perf_counter()
+        envelopes = [encode_envelope(readings[i:i + batch_size], args.level)
+                     for i in range(0, len(readings), batch_size)]
+        encode_s = time.perf_counter() - started
+        assert sum(len(decode_envelope(e)) for e in envelopes) == len(readings)
+        sizes = [publish_packet_bytes(batch_topic, len(e)) for e in envelopes]
+        total, replay_s = _replay_estimate(sizes, args.rtt, args.kbps, args.inflight)
+        results.append((f"Envelope x{batch_size}", len(sizes), total, encode_s, replay_s))
+
+    print(f"Pufferabbau von {args.readings} Messwerten (RTT {args.rtt}s, {args.kbps} kbit/s, "
+          f"{args.inflight} Nachrichten in-flight, inkl. MQTT-Header und PUBACK)")
+    # Factors relative to single JSON messages: how many times fewer bytes / less transfer time
+    header = (f"{'Format':<16} {'Nachr.':>7} {'Bytes':>9} {'B/Wert':>7} {'Kodieren':>9} {'Übertragung':>12} "
+              f"{'Bytes-F.':>8} {'Zeit-F.':>7}")
+    print(header)
+    print("-" * len(header))
+    base_bytes, base_time = results[0][2], results[0][4]
+    for name, count, total, encode_s, replay_s in results:
+        print(f"{name:<16} {count:>7} {total:>9} {total / args.readings:>7.1f} {encode_s * 1000:>7.1f}ms "
+              f"{replay_s:>10.1f}s {base_bytes / total if total else 0:>7.1f}x "
+              f"{base_time / replay_s if replay_s else 0:>6.1f}x")
+
+    json_bytes = sum(len(p.encode("utf-8")) for p in payloads) / len(payloads)
+    binary_bytes = sum(len(b) for b in binaries) / len(binaries)
+    print(f"\nLive-Messwert (nur Nutzlast): JSON {json_bytes:.0f} B / {results[0][3] / args.readings * 1e6:.0f} µs, "
+          f"Binär {binary_bytes:.0f} B / {results[2][3] / args.readings * 1e6:.0f} µs")
+    # Per-message overhead = PUBLISH fixed header, topic, packet ID, properties + PUBACK
+    full_overhead = publish_packet_bytes(sensor_topic, 0)
+    alias_overhead = publish_packet_bytes("", 0, property_len=TOPIC_ALIAS_PROPERTY_BYTES)
+    trimmed_bytes = sum(len(p.encode("utf-8")) for p in trimmed) / len(trimmed)
+    print(f"Overhead je Nachricht: volles Topic {full_overhead} B, Topic Alias {alias_overhead} B; "
+          f"Nutzlast ohne device_id/uptime_str {trimmed_bytes:.0f} B (statt {json_bytes:.0f} B)")
+    return 0
+
+
+class SimulatedLink:
+    """
+    Verbindung wie paho sie dem Uplink-Worker zeigt: publish() liefert eine
+    MID (oder None ohne Verbindung), PUBACKs kommen nach zufälliger Latenz
+    aus einem eigenen Thread. Bei einem Abbruch bleiben unbestätigte
+    Nachrichten erhalten und werden nach dem Reconnect bestätigt.
+    """
+
+    def __init__(self, rng, max_latency):
+        self.rng = rng
+        self.max_latency = max_latency
+        self.on_ack = None
+        self.on_connect = None
+        self.on_disconnect = None
+        self.connected = True
+        self.log = []  # (mid, readings) in publish order
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._inflight = []  # (due, mid)
+        self._mid = 0
+        self._stop = False
+        self._thread = threading.Thread(target=self._ack_loop, name="SimulatedLink", daemon=True)
+        self._thread.start()
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, readings):
+        with self._cond:
+            if not self.connected:
+                return None
+            self._mid += 1
+            self.log.append((self._mid, readings))
+            self._inflight.append((time.monotonic() + self.rng.uniform(0, self.max_latency), self._mid))
+            self._cond.notify()
+            return self._mid
+
+    def set_connected(self, connected):
+        with self._cond:
+            self.connected = connected
+            self._cond.notify()
+        callback = self.on_connect if connected else self.on_disconnect
+        if callback:
+            callback()
+
+    def _ack_loop(self):
+        while True:
+            with self._cond:
+                while not self._stop and (not self.connected or not self._inflight):
+                    self._cond.wait(0.05)
+                if self._stop:
+                    return
+                self._inflight.sort()
+                due, mid = self._inflight[0]
+                if due > time.monotonic():
+                    self._cond.wait(due - time.monotonic())
+                    continue
+                self._inflight.pop(0)
+            self.on_ack(mid)
+
+    def idle(self):
+        with self._lock:
+            return not self._inflight
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join(1)
+
+
+def cmd_stress(args):
+    rng = random.Random(args.seed)
+    link = SimulatedLink(rng, args.max_latency)
+    ledger = DeliveryLedger(ack_timeout=3600)
+    flow = ReplayFlowController(window=4, max_window=16, target_latency=args.max_latency)
+
+    def encode(readings):
+        # Backlog chunks become one batch message, like the envelopes on the node
+        return [("sim", json.dumps(readings), readings)]
+
+    worker = UplinkWorker(encode=encode, publish=lambda topic, payload: link.publish(json.loads(payload)),
+                          is_connected=link.is_connected, ledger=ledger, flow=flow,
+                          batch_size=lambda: args.batch, max_buffer=args.readings * args.producers + 1,
+                          backlog_order=args.backlog_order, idle_interval=0.05, name="UplinkStress")
+
+    def on_ack(mid):
+        if flow.on_ack(mid):
+            worker.wake()
+        delivered = ledger.ack(mid)
+        if delivered:
+            worker.on_delivered(delivered)
+
+    def on_connect():
+        ledger.on_reconnect()
+        worker.on_connect()
+
+    link.on_ack = on_ack
+    link.on_connect = on_connect
+    link.on_disconnect = flow.on_disconnect
+    worker.start()
+
+    def produce(producer):
+        prng = random.Random(args.seed * 1000 + producer)
+        for seq in range(args.readings):
+            worker.submit({"producer": producer, "seq": seq})
+            if prng.random() < 0.1:
+                time.sleep(prng.uniform(0, 0.002))
+
+    started = time.monotonic()
+    producers = [threading.Thread(target=produce, args=(p,)) for p in range(args.producers)]
+    for thread in producers:
+        thread.start()
+    flaps = 0
+    while any(t.is_alive() for t in producers) or flaps < args.flaps:
+        time.sleep(rng.uniform(0.005, 0.03))
+        link.set_connected(not link.connected)
+        flaps += 1
+    for thread in producers:
+        thread.join()
+    if not link.connected:
+        link.set_connected(True)
+
+    deadline = time.monotonic() + args.timeout
+    total = args.readings * args.producers
+    while time.monotonic() < deadline and not (len(worker) == 0 and len(ledger) == 0 and link.idle()):
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+    worker.stop()
+    link.close()
+
+    # --- checks ---
+    sent = collections.Counter()
+    backlog_seqs = collections.defaultdict(list)
+    reordered = 0
+    for _, readings in link.log:
+        for r in readings:
+            sent[(r["producer"], r["seq"])] += 1
+        if len(readings) > 1:  # only backlog chunks carry several readings
+            if args.backlog_order == "newest":
+                # chunks go out newest-first, but each chunk stays chronological
+                per_producer = collections.defaultdict(list)
+                for r in readings:
+                    per_producer[r["producer"]].append(r["seq"])
+                reordered += sum(1 for seqs in per_producer.values() for a, b in zip(seqs, seqs[1:]) if b <= a)
+            else:
+                for r in readings:
+                    backlog_seqs[r["producer"]].append(r["seq"])
+    missing = total - len(sent)
+    duplicates = sum(c - 1 for c in sent.values() if c > 1)
+    reordered += sum(1 for seqs in backlog_seqs.values() for a, b in zip(seqs, seqs[1:]) if b <= a)
+    stats = worker.stats()
+
+    print(f"{args.producers} Erzeuger x {args.readings} Messwerte, {flaps} Verbindungswechsel, {elapsed:.1f}s")
+    print(f"Nachrichten: {len(link.log)}, live: {stats['live_sent']}, Rückstand: {stats['backlog_sent']}, "
+          f"gepuffert: {stats['buffered']}, Weckrufe: {stats['wakeups']}")
+    first_live = stats["first_live_after_connect"]
+    if first_live["count"]:
+        print(f"Erster Live-Messwert nach Reconnect ({args.backlog_order} zuerst): "
+              f"Mittel {first_live['avg_s'] * 1000:.0f} ms, max {first_live['max_s'] * 1000:.0f} ms "
+              f"({first_live['count']} Reconnects)")
+    print(f"Fehlend: {missing}, doppelt gesendet: {duplicates}, Rückstand außer Reihenfolge: {reordered}, "
+          f"unbestätigt: {len(ledger)}")
+    ok = missing == 0 and duplicates == 0 and reordered == 0 and len(ledger) == 0
+    print("OK" if ok else "FEHLER")
+    return 0 if ok else 1
+
+
+def _make_test_certificate(directory, key_type):
+    """Selbstsigniertes Zertifikat für localhost (openssl-Kommandozeile)"""
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    newkey = ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:P-256"] if key_type == "ec" else ["-newkey", "rsa:2048"]
+    subprocess.run(["openssl", "req", "-x509", *newkey, "-nodes", "-keyout", key, "-out", cert, "-days", "1",
+                    "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+def _read_mqtt_packet(sock):
+    """Liest ein MQTT-Paket (fester Header + Restlänge); None bei Verbindungsende"""
+    first = sock.recv(1)
+    if not first:
+        return None
+    length, shift = 0, 0
+    while True:
+        byte = sock.recv(1)
+        if not byte:
+            return None
+        length |= (byte[0] & 0x7F) << shift
+        shift += 7
+        if not byte[0] & 0x80:
+            break
+    body = b""
+    while len(body) < length:
+        chunk = sock.recv(length - len(body))
+        if not chunk:
+            return None
+        body += chunk
+    return first[0] >> 4, body
+
+
+class TLSStandInBroker:
+    """Minimaler MQTT-Broker hinter TLS (nur CONNECT/CONNACK/DISCONNECT) - Ersatz für Caddy + Mosquitto"""
+
+    def __init__(self, cert, key, tls_version):
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert, key)
+        self.context.minimum_version = self.context.maximum_version = tls_version
+        self._sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept, name="TLSStandIn", daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            with self.context.wrap_socket(conn, server_side=True) as tls:
+                while True:
+                    packet = _read_mqtt_packet(tls)
+                    if packet is None or packet[0] == 14:  # closed or DISCONNECT
+                        return
+                    if packet[0] == 1:  # CONNECT -> CONNACK (MQTT v5, no properties)
+                        tls.sendall(b"\x20\x03\x00\x00\x00")
+        except (OSError, ssl.SSLError):
+            pass
+
+    def close(self):
+        self._sock.close()
+
+
+class CountingRelay:
+    """TCP-Relay vor dem Broker: zählt Bytes je Richtung und verzögert jede Richtung um rtt/2"""
+
+    def __init__(self, target_port, rtt):
+        self.target_port = target_port
+        self.delay = rtt / 2
+        self.connections = []  # [bytes up, bytes down, done event]
+        self._sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept, name="CountingRelay", daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            server = socket.create_connection(("127.0.0.1", self.target_port))
+            counters = [0, 0, threading.Event()]
+            self.connections.append(counters)
+            up = threading.Thread(target=self._pipe, args=(client, server, counters, 0), daemon=True)
+            down = threading.Thread(target=self._pipe, args=(server, client, counters, 1), daemon=True)
+            up.start()
+            down.start()
+            threading.Thread(target=lambda: (up.join(), down.join(), counters[2].set()), daemon=True).start()
+
+    def _pipe(self, src, dst, counters, index):
+        try:
+            while True:
+                data = src.recv(65536)
+                if not data:
+                    break
+                counters[index] += len(data)
+                if self.delay:
+                    time.sleep(self.delay)
+                dst.sendall(data)
+        except OSError:
+            pass
+        for sock in (src, dst):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self._sock.close()
+
+
+def _tls_connect_rounds(port, cert, connects, resume):
+    """Verbindet connects-mal nacheinander (paho, MQTT v5); liefert [(Sekunden, Art), ...]"""
+    import paho.mqtt.client as mqtt  # only needed for this command
+
+    cache = TLSSessionCache(enabled=resume)
+    context = cache.context(ca_certs=cert)
+    rounds = []
+    for _ in range(connects):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"tlsbench-{uuid.uuid4().hex[:8]}",
+                             protocol=mqtt.MQTTv5)
+        client.tls_set_context(context)
+        result = {}
+
+        def on_connect(client, userdata, flags, reason_code, properties):
+            result["elapsed"] = time.monotonic() - started
+            result["kind"] = cache.capture(client.socket())
+
+        client.on_connect = on_connect
+        started = time.monotonic()
+        client.connect("localhost", port, keepalive=60)
+        while "elapsed" not in result and time.monotonic() - started < 30:
+            client.loop(0.05)
+        client.disconnect()
+        rounds.append((result.get("elapsed"), result.get("kind")))
+    return rounds
+
+
+def cmd_tlsbench(args):
+    tls_version = ssl.TLSVersion.TLSv1_3 if args.tls_version == "1.3" else ssl.TLSVersion.TLSv1_2
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.cert:
+            cert, key = args.cert, args.key
+        else:
+            try:
+                cert, key = _make_test_certificate(tmp, args.key_type)
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Testzertifikat konnte nicht erzeugt werden (openssl): {e}", file=sys.stderr)
+                return 1
+        broker = TLSStandInBroker(cert, key, tls_version)
+        relay = CountingRelay(broker.port, args.rtt)
+        results = []
+        for label, resume in (("voll", False), ("wiederaufgenommen", True)):
+            first = len(relay.connections)
+            rounds = _tls_connect_rounds(relay.port, cert, args.connects, resume)
+            for counters in relay.connections[first:]:
+                counters[2].wait(5)
+            results.append((label, rounds, relay.connections[first:]))
+        relay.close()
+        broker.close()
+
+    print(f"{args.connects} Verbindungen je Modus über TLS {args.tls_version} (RTT {args.rtt}s, "
+          f"Schlüssel: {'eigenes Zertifikat' if args.cert else args.key_type}), Bytes inkl. TCP-Nutzlast von "
+          f"MQTT CONNECT/CONNACK/DISCONNECT")
+    header = f"{'Modus':<18} {'#':>3} {'Handshake':>18} {'Hoch':>7} {'Runter':>7} {'Summe':>7} {'Zeit':>8}"
+    print(header)
+    print("-" * len(header))
+    summary = {}
+    for label, rounds, connections in results:
+        for i, ((elapsed, kind), (up, down, _)) in enumerate(zip(rounds, connections), 1):
+            print(f"{label:<18} {i:>3} {kind or '-':>18} {up:>7} {down:>7} {up + down:>7} "
+                  f"{elapsed * 1000 if elapsed is not None else float('nan'):>6.0f}ms")
+        # Reconnects only (the first connect is a full handshake in both modes)
+        later = [(up + down, elapsed) for (elapsed, _), (up, down, _) in zip(rounds[1:], connections[1:])
+                 if elapsed is not None]
+        if later:
+            summary[label] = (sum(b for b, _ in later) / len(later), sum(t for _, t in later) / len(later))
+    if "voll" in summary and "wiederaufgenommen" in summary:
+        (full_bytes, full_time), (res_bytes, res_time) = summary["voll"], summary["wiederaufgenommen"]
+        print(f"\nReconnect im Mittel: voll {full_bytes:.0f} B / {full_time * 1000:.0f} ms, "
+              f"wiederaufgenommen {res_bytes:.0f} B / {res_time * 1000:.0f} ms "
+              f"({1 - res_bytes / full_bytes:.0%} weniger Bytes)")
+    return 0
+
+
+class MQTTStandInBroker:
+    """Minimaler MQTT-v5-Broker ohne TLS (CONNACK, PUBACK, SUBACK, PINGRESP) - Ersatz für Mosquitto"""
+
+    def __init__(self):
+        self._sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept, name="MQTTStandIn", daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            with conn:
+                while True:
+                    packet = _read_mqtt_packet(conn)
+                    if packet is None or packet[0] == 14:  # closed or DISCONNECT
+                        return
+                    kind, body = packet
+                    if kind == 1:  # CONNECT
+                        conn.sendall(b"\x20\x03\x00\x00\x00")
+                    elif kind == 3:  # PUBLISH (QoS 1 from the node) -> PUBACK
+                        topic_len = int.from_bytes(body[:2], "big")
+                        conn.sendall(b"\x40\x02" + body[2 + topic_len:4 + topic_len])
+                    elif kind == 8:  # SUBSCRIBE -> SUBACK, QoS 1 granted
+                        conn.sendall(b"\x90\x04" + body[:2] + b"\x00\x01")
+                    elif kind == 12:  # PINGREQ -> PINGRESP
+                        conn.sendall(b"\xd0\x00")
+        except OSError:
+            pass
+
+    def close(self):
+        self._sock.close()
+
+
+def _process_usage(pid):
+    """(CPU-Sekunden, Kontextwechsel aller Threads, Anzahl Threads) eines Prozesses aus /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+    switches = 0
+    tasks = os.listdir(f"/proc/{pid}/task")
+    for tid in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/status") as f:
+                for line in f:
+                    if line.startswith(("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches")):
+                        switches += int(line.split()[1])
+        except OSError:
+            pass  # thread ended meanwhile
+    return cpu, switches, len(tasks)
+
+
+def _idle_node(runtime, port, seconds, keepalive):
+    """Kindprozess: Netzwerkteil des Knotens im Leerlauf (MQTT, Link-Monitor, lokale API, Hauptschleife)"""
+    import asyncio
+    import logging
+    import paho.mqtt.client as mqtt  # only needed for this command
+
+    from frost_aio import MQTTDriver
+    from frost_link import LinkMonitor
+    from frost_local_api import LocalQueryServer, ReadingRing
+
+    logging.disable(logging.WARNING)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"idlebench-{runtime}", protocol=mqtt.MQTTv5)
+    client.connect_async("127.0.0.1", port, keepalive)
+    api = LocalQueryServer(ReadingRing(10), dict, dict, port=0)
+    link = LinkMonitor("lo")
+    if runtime == "threads":
+        client.loop_start()
+        api.start()
+        link.start()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            time.sleep(min(30, max(0.0, deadline - time.monotonic())))  # main() poll loop
+        return
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        driver = MQTTDriver(client, loop, keepalive=keepalive)
+        driver.attach()
+        task = loop.create_task(driver.run())
+        api.start(loop=loop)
+        link.start(loop=loop)
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(30, max(0.0, deadline - time.monotonic())))  # run_node() supervision
+        await driver.stop()
+        await task
+
+    asyncio.run(run())
+
+
+def cmd_idlebench(args):
+    import multiprocessing
+
+    broker = MQTTStandInBroker()
+    context = multiprocessing.get_context("fork")
+    results = []
+    for runtime in ("threads", "asyncio"):
+        child = context.Process(target=_idle_node, args=(runtime, broker.port, args.warmup + args.seconds + 5,
+                                                         args.keepalive), daemon=True)
+        child.start()
+        time.sleep(args.warmup)
+        cpu0, switches0, _ = _process_usage(child.pid)
+        time.sleep(args.seconds)
+        cpu1, switches1, threads = _process_usage(child.pid)
+        child.terminate()
+        child.join()
+        per_min = 60.0 / args.seconds
+        results.append((runtime, threads, (cpu1 - cpu0) * per_min * 1000, (switches1 - switches0) * per_min))
+    broker.close()
+
+    print(f"Leerlauf über {args.seconds:.0f}s nach {args.warmup:.0f}s Anlauf (MQTT-Keepalive {args.keepalive}s, "
+          f"Broker-Ersatz auf localhost, Link-Monitor, lokale API)")
+    header = f"{'Laufzeit':<10} {'Threads':>7} {'CPU ms/min':>11} {'Aufwachen/min':>14}"
+    print(header)
+    print("-" * len(header))
+    for runtime, threads, cpu_ms, wakeups in results:
+        print(f"{runtime:<10} {threads:>7} {cpu_ms:>11.1f} {wakeups:>14.0f}")
+    (_, _, cpu_before, wake_before), (_, _, cpu_after, wake_after) = results
+    if wake_before:
+        print(f"\nasyncio: {1 - wake_after / wake_before:.0%} weniger Aufwachvorgänge"
+              + (f", {1 - cpu_after / cpu_before:.0%} weniger CPU-Zeit" if cpu_before else ""))
+    return 0
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+def _acquire_for_jitter(seconds, period, burst, hand_off):
+    """Messschleife: Aufwachverspätung (s) und größte Lücke im zeitkritischen Einlesen (s) je Zyklus"""
+    late, gaps = [], []
+    deadline = time.monotonic() + period
+    end = time.monotonic() + seconds
+    i = 0
+    while deadline < end:
+        time.sleep(max(0.0, deadline - time.monotonic()))
+        start = time.monotonic()
+        late.append(start - deadline)
+        # Bit-banging like the DHT22 read: a tight loop, any pause (GIL, scheduler) shows as a gap
+        gap, last = 0.0, start
+        while last - start < burst:
+            now = time.monotonic()
+            gap = max(gap, now - last)
+            last = now
+        gaps.append(gap)
+        hand_off(i)
+        i += 1
+        deadline += period
+    return late, gaps
+
+
+def _uplink_load(backlog, stop, take=None):
+    """Uplink-Arbeit: Rückstand serialisieren und als Envelope packen, bis stop gesetzt ist"""
+    while not stop.is_set():
+        if take is not None:
+            take()
+        json.dumps(backlog)
+        encode_envelope(backlog[:200])
+
+
+def _uplink_process(ring_path, backlog_size, stop):
+    """Kindprozess: Uplink-Last, liest dabei die Messwerte aus dem Ring"""
+    from frost_ring import SharedRing
+
+    ring = SharedRing(ring_path).open()
+
+    def take():
+        for _, _, payload in ring.read():
+            decode_binary_reading(payload)
+        ring.commit()
+
+    _uplink_load(sample_readings(backlog_size), stop, take)
+    ring.close()
+
+
+def cmd_jitterbench(args):
+    import multiprocessing
+
+    from frost_ring import KIND_READING, SharedRing
+
+    reading = encode_binary_reading(sample_readings(1)[0])
+    backlog = sample_readings(args.backlog)
+    results = []
+    for mode in ("ohne Last", "ein Prozess", "zwei Prozesse"):
+        stop = threading.Event()
+        workers = []
+        with tempfile.TemporaryDirectory() as tmp:
+            ring = None
+            if mode == "ein Prozess":
+                inbox = collections.deque()
+                hand_off = lambda i: inbox.append(reading)  # noqa: E731 - like uplink_worker.submit()
+                for _ in range(args.load):
+                    workers.append(threading.Thread(target=_uplink_load, args=(backlog, stop, inbox.clear), daemon=True))
+            elif mode == "zwei Prozesse":
+                ring = SharedRing(os.path.join(tmp, "ring.bin"), slots=1024, slot_size=64).open()
+                hand_off = lambda i: ring.append(KIND_READING, reading)  # noqa: E731
+                stop = multiprocessing.get_context("fork").Event()
+                for _ in range(args.load):
+                    workers.append(multiprocessing.get_context("fork").Process(
+                        target=_uplink_process, args=(ring.path, args.backlog, stop), daemon=True))
+            else:
+                hand_off = lambda i: None  # noqa: E731
+            for worker in workers:
+                worker.start()
+            time.sleep(0.5)  # Load running before the measurement starts
+            late, gaps = _acquire_for_jitter(args.seconds, args.period, args.burst, hand_off)
+            stop.set()
+            for worker in workers:
+                worker.join()
+            if ring is not None:
+                ring.close()
+        disturbed = sum(1 for gap in gaps if gap > args.max_gap) / len(gaps)
+        results.append((mode, [value * 1000 for value in late], gaps, disturbed))
+
+    print(f"Messzyklus alle {args.period * 1000:.0f} ms über {args.seconds:.0f}s, zeitkritisches Einlesen "
+          f"{args.burst * 1000:.1f} ms; Uplink-Last: {args.load} x json.dumps + Envelope von {args.backlog} Messwerten, "
+          f"{os.cpu_count()} CPU-Kern(e)")
+    header = (f"{'Betrieb':<14} {'Versatz p50':>11} {'p99':>8} {'max':>8} {'Lücke max':>10} "
+              f"{'gestört (> ' + format(args.max_gap * 1e6, '.0f') + ' µs)':>20}")
+    print(header)
+    print("-" * len(header))
+    for mode, late_ms, gaps, disturbed in results:
+        print(f"{mode:<14} {_percentile(late_ms, 50):>8.2f} ms {_percentile(late_ms, 99):>5.2f} ms "
+              f"{max(late_ms):>5.2f} ms {max(gaps) * 1000:>7.2f} ms {disturbed:>20.1%}")
+    if (os.cpu_count() or 1) <= args.load:
+        print("\nHinweis: nicht mehr CPU-Kerne als Uplink-Arbeiter - im Zwei-Prozess-Betrieb teilen sich "
+              "Messung und Uplink einen Kern, das Einlesen wird dann vom Betriebssystem unterbrochen.")
+    return 0
+
+
+def _wait_for_startup_report(path, after, timeout):
+    """Startbericht, der nach after geschrieben wurde und den ersten bestätigten Messwert enthält"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if os.stat(path).st_mtime >= after:
+                with open(path) as f:
+                    report = json.load(f)
+                if "first_publish" in report.get("marks", {}):
+                    return report
+        except (OSError, ValueError):
+            pass  # Not written yet (or being replaced)
+        time.sleep(0.2)
+    return None
+
+
+def cmd_startbench(args):
+    runs = []
+    for run in range(1, args.runs + 1):
+        restarted = time.time()
+        subprocess.run(["systemctl", "restart", args.service], check=True)
+        report = _wait_for_startup_report(args.report, restarted, args.timeout)
+        if report is None:
+            print(f"Lauf {run}: kein erster bestätigter Messwert nach {args.timeout:.0f}s "
+                  f"(Broker erreichbar? {args.report} wird geschrieben?)")
+            continue
+        runs.append(report)
+        marks = report["marks"]
+        print(f"Lauf {run}: " + ", ".join(f"{name} {at:.2f}s" for name, at in marks.items()))
+        for name, phase in report.get("phases", {}).items():
+            print(f"    {name:<14} ab {phase['start_s']:6.2f}s  Dauer {phase['duration_s']:6.2f}s")
+        time.sleep(args.pause)
+    if not runs:
+        return 1
+
+    target = args.target if args.target is not None else runs[-1].get("target_s", 20)
+    print(f"\nZeit bis zum ersten bestätigten Messwert über {len(runs)} Neustarts (Ziel {target:.0f}s):")
+    for name in runs[-1]["marks"]:
+        values = [report["marks"][name] for report in runs if name in report["marks"]]
+        print(f"{name:<14} p50 {_percentile(values, 50):6.2f}s  max {max(values):6.2f}s")
+    first = _percentile([report["marks"]["first_publish"] for report in runs], 50)
+    return 0 if first <= target else 1
+
+
+TRIMMED_FIELDS = ("device_id", "uptime_str")  # mqtt_trim_payload
+
+
+def _sensor_read(sample):
+    """Neue Zahlobjekte je Zyklus wie beim Einlesen der Sensoren (sonst teilen sich alle Messwerte die Beispielwerte)"""
+    return {key: value * 1 if isinstance(value, float) else value for key, value in sample.items()}
+
+
+def _dict_cycle(sample, epoch, device_id):
+    """Messzyklus wie vor frost_reading: dict je Messwert, Kopien für letzten Messwert, CSV und MQTT"""
+    sample = _sensor_read(sample)
+    stamp = datetime.fromtimestamp(epoch, timezone.utc)
+    readings = {
+        "timestamp": stamp.isoformat(), "device_id": device_id, "seq": sample["seq"], "boot": sample["boot"],
+        "dry_temp": sample["dry_temp"], "wet_temp": sample["wet_temp"], "humidity": sample["humidity"],
+        "calc_wet_temp": sample["calc_wet_temp"], "effective_wet_temp": sample["effective_wet_temp"],
+        "battery_percent": sample["battery_percent"], "battery_voltage": sample["battery_voltage"],
+        "dcdc_voltage": sample["dcdc_voltage"],
+    }
+    up = sample["uptime_seconds"]
+    readings.update({
+        "cpu_percent": sample["cpu_percent"], "memory_percent": sample["memory_percent"],
+        "disk_percent": sample["disk_percent"], "uptime_seconds": up,
+        "uptime_str": f"{up // 86400}d {(up % 86400) // 3600}h {(up % 3600) // 60}m",
+        "ip_address": ".".join(("10", "64", "12", "7")),  # getsockname() returns a new string each time
+    })
+    last = readings.copy()
+    last["last_update_ts"] = time.time()
+    csv_row = readings.copy()
+    csv_row["timestamp"] = stamp.strftime("%Y-%m-%d %H:%M:%S")
+    payload = readings.copy()
+    json.dumps({k: v for k, v in payload.items() if k not in TRIMMED_FIELDS})
+    return payload
+
+
+def _reading_cycle(sample, epoch, device_id):
+    """Messzyklus mit frost_reading.Reading: ein Datensatz, dict erst an der JSON-Grenze"""
+    sample = _sensor_read(sample)
+    stamp = datetime.fromtimestamp(epoch, timezone.utc)
+    reading = Reading(
+        stamp.timestamp(), device_id=device_id, seq=sample["seq"], boot=sample["boot"],
+        dry_temp=sample["dry_temp"], wet_temp=sample["wet_temp"], humidity=sample["humidity"],
+        calc_wet_temp=sample["calc_wet_temp"], effective_wet_temp=sample["effective_wet_temp"],
+        battery_percent=sample["battery_percent"], battery_voltage=sample["battery_voltage"],
+        dcdc_voltage=sample["dcdc_voltage"], cpu_percent=sample["cpu_percent"],
+        memory_percent=sample["memory_percent"], disk_percent=sample["disk_percent"],
+        uptime_seconds=sample["uptime_seconds"], ip_address=".".join(("10", "64", "12", "7")),
+    )
+    stamp.strftime("%Y-%m-%d %H:%M:%S")
+    json.dumps(reading.as_dict(exclude=TRIMMED_FIELDS))
+    return reading
+
+
+def _traced(build):
+    """build() unter tracemalloc: (Ergebnis, zusätzlich belegte Bytes, belegte Blöcke)"""
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - base
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    finally:
+        tracemalloc.stop()
+    return result, retained, blocks
+
+
+def _cycle_peaks(cycle, samples, device_id):
+    """Speicherspitze je Zyklus (Bytes über dem Stand davor), das Ergebnis bleibt wie im Puffer liegen"""
+    import tracemalloc
+
+    tracemalloc.start()
+    peaks = []
+    kept = []
+    try:
+        for sample, epoch in samples:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            kept.append(cycle(sample, epoch, device_id))
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def cmd_readingbench(args):
+    device_id = str(uuid.uuid4())
+    samples = [(sample, parse_timestamp(sample["timestamp"])) for sample in sample_readings(args.readings, device_id)]
+    buffer_text = json.dumps(sample_readings(args.readings, device_id))
+    results = []
+    for name, cycle, load in (
+        ("dict (bisher)", _dict_cycle, lambda: json.loads(buffer_text)),
+        ("Reading", _reading_cycle, lambda: [Reading.from_dict(entry, device_id) for entry in json.loads(buffer_text)]),
+    ):
+        buffered, retained, blocks = _traced(lambda: [cycle(sample, epoch, device_id) for sample, epoch in samples])
+        del buffered
+        loaded, load_retained, _ = _traced(load)
+        del loaded
+        peaks = _cycle_peaks(cycle, samples[:args.cycles], device_id)
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            for sample, epoch in samples[:args.cycles]:
+                cycle(sample, epoch, device_id)
+            timings.append((time.perf_counter() - started) / min(args.cycles, len(samples)))
+        results.append((name, retained / len(samples), blocks / len(samples), load_retained / len(samples),
+                        _percentile(peaks, 50), min(timings) * 1e6))
+
+    print(f"{args.readings} gepufferte Messwerte, {min(args.cycles, len(samples))} Messzyklen "
+          f"(Messwert anlegen, letzter Messwert, CSV-Zeile, JSON für MQTT)")
+    header = (f"{'Datensatz':<14} {'Bytes/Messwert':>14} {'Blöcke/Messwert':>15} {'Pufferdatei geladen':>19} "
+              f"{'Spitze/Zyklus':>13} {'Zeit/Zyklus':>11}")
+    print(header)
+    print("-" * len(header))
+    for name, per_reading, blocks, loaded, peak, micros in results:
+        print(f"{name:<14} {per_reading:>8.0f} Bytes {blocks:>15.1f} {loaded:>13.0f} Bytes "
+              f"{peak:>7.0f} Bytes {micros:>8.1f} µs")
+    (_, before, *_), (_, after, *_) = results
+    print(f"\nPuffer mit {args.readings} Messwerten: {before * args.readings / 1e6:.2f} MB -> "
+          f"{after * args.readings / 1e6:.2f} MB ({1 - after / before:.0%} weniger)")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="frostctl", description="Werkzeuge für das Frostwarnsystem")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_an = sub.add_parser("analyze", help="Nachtstatistiken aus CSV-Log oder Binärarchiv")
+    p_an.add_argument("path", nargs="?", default=LOG_FILE, help="CSV-Logdatei oder .npy-Archiv")
+    p_an.add_argument("--config", default=CONFIG_FILE, help="Node-Konfiguration (für warning_temp/check_interval)")
+    p_an.add_argument("--warning-temp", type=float, help="Warnschwelle überschreiben (°C)")
+    p_an.add_argument("--gap", type=float, help="Ab diesem Abstand (s) zählt ein Intervall als Lücke")
+    p_an.add_argument("--utc-offset", type=float, help="Offset Ortszeit zu UTC in Stunden (Standard: Systemzeitzone)")
+    p_an.add_argument("--last", type=int, help="Nur die letzten N Nächte ausgeben")
+    p_an.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Datensätze pro Block")
+    p_an.add_argument("--json", action="store_true", help="Ausgabe als JSON")
+    p_an.set_defaults(func=cmd_analyze)
+
+    p_ar = sub.add_parser("archive", help="CSV-Log in Binärarchiv (.npy) umwandeln")
+    p_ar.add_argument("csv", help="CSV-Logdatei")
+    p_ar.add_argument("out", help="Zieldatei (.npy)")
+    p_ar.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    p_ar.set_defaults(func=cmd_archive)
+
+    p_be = sub.add_parser("bench", help="Nutzlast-Formate für den Pufferabbau vergleichen")
+    p_be.add_argument("--readings", type=int, default=1000, help="Anzahl gepufferter Messwerte")
+    p_be.add_argument("--rtt", type=float, default=0.6, help="Round-Trip-Zeit der GPRS-Verbindung (s)")
+    p_be.add_argument("--kbps", type=float, default=20.0, help="Nutzbare Bandbreite (kbit/s)")
+    p_be.add_argument("--inflight", type=int, default=20, help="Max. unbestätigte QoS-1-Nachrichten (paho Standard: 20)")
+    p_be.add_argument("--batch-sizes", type=int, nargs="+", default=[50, 200], help="Envelope-Größen")
+    p_be.add_argument("--level", type=int, default=6, help="zlib-Kompressionsstufe")
+    p_be.set_defaults(func=cmd_bench)
+
+    p_st = sub.add_parser("stress", help="Belastungstest des Uplink-Workers (Reihenfolge, genau einmal senden)")
+    p_st.add_argument("--producers", type=int, default=4, help="Parallele Erzeuger-Threads")
+    p_st.add_argument("--readings", type=int, default=2000, help="Messwerte je Erzeuger")
+    p_st.add_argument("--batch", type=int, default=20, help="Messwerte je Rückstands-Nachricht")
+    p_st.add_argument("--max-latency", type=float, default=0.02, help="Maximale simulierte PUBACK-Latenz (s)")
+    p_st.add_argument("--flaps", type=int, default=50, help="Mindestanzahl Verbindungswechsel")
+    p_st.add_argument("--timeout", type=float, default=60.0, help="Maximale Wartezeit auf vollständige Zustellung (s)")
+    p_st.add_argument("--backlog-order", choices=BACKLOG_ORDERS, default="oldest", help="Reihenfolge des Rückstands")
+    p_st.add_argument("--seed", type=int, default=1)
+    p_st.set_defaults(func=cmd_stress)
+
+    p_tl = sub.add_parser("tlsbench", help="TLS-Handshake voll vs. wiederaufgenommen (lokaler Broker-Ersatz)")
+    p_tl.add_argument("--connects", type=int, default=5, help="Verbindungen je Modus")
+    p_tl.add_argument("--rtt", type=float, default=0.6, help="Simulierte Round-Trip-Zeit (s)")
+    p_tl.add_argument("--tls-version", choices=("1.2", "1.3"), default="1.3")
+    p_tl.add_argument("--key-type", choices=("ec", "rsa"), default="ec", help="Schlüsseltyp des Testzertifikats")
+    p_tl.add_argument("--cert", help="Eigene Zertifikatskette (PEM) statt Testzertifikat, z.B. die von Caddy")
+    p_tl.add_argument("--key", help="Privater Schlüssel zu --cert")
+    p_tl.set_defaults(func=cmd_tlsbench)
+
+    p_id = sub.add_parser("idlebench", help="Leerlauf: CPU-Zeit und Aufwachvorgänge, Threads vs. asyncio")
+    p_id.add_argument("--seconds", type=float, default=60.0, help="Messdauer je Laufzeit (s)")
+    p_id.add_argument("--warmup", type=float, default=3.0, help="Anlaufzeit vor der Messung (s)")
+    p_id.add_argument("--keepalive", type=int, default=60, help="MQTT-Keepalive (s), wie mqtt_keepalive")
+    p_id.set_defaults(func=cmd_idlebench)
+
+    p_ji = sub.add_parser("jitterbench", help="Messzeitpunkt-Versatz mit/ohne Uplink-Last, ein vs. zwei Prozesse")
+    p_ji.add_argument("--seconds", type=float, default=10.0, help="Messdauer je Betriebsart (s)")
+    p_ji.add_argument("--period", type=float, default=0.02, help="Abstand der simulierten Messungen (s)")
+    p_ji.add_argument("--burst", type=float, default=0.004, help="Dauer des zeitkritischen Einlesens (s), DHT22: ca. 4 ms")
+    p_ji.add_argument("--max-gap", type=float, default=0.0001, help="Lücke (s), ab der ein Einlesen als gestört zählt")
+    p_ji.add_argument("--load", type=int, default=1, help="Uplink-Last: Anzahl paralleler Arbeiter")
+    p_ji.add_argument("--backlog", type=int, default=1000, help="Messwerte im serialisierten Rückstand")
+    p_ji.set_defaults(func=cmd_jitterbench)
+
+    p_sb = sub.add_parser("startbench", help="Dienst neu starten, Zeit bis zum ersten bestätigten Messwert messen")
+    p_sb.add_argument("--service", default="frostwarn.service", help="systemd-Dienst (Zwei-Prozess-Betrieb: frostwarn-uplink.service)")
+    p_sb.add_argument("--runs", type=int, default=5, help="Anzahl Neustarts")
+    p_sb.add_argument("--report", default="/home/pi/startup_report.json", help="Startbericht des Knotens")
+    p_sb.add_argument("--timeout", type=float, default=120.0, help="Maximale Wartezeit je Neustart (s)")
+    p_sb.add_argument("--pause", type=float, default=5.0, help="Pause zwischen den Neustarts (s)")
+    p_sb.add_argument("--target", type=float, help="Ziel (s), Standard: startup_target_first_publish des Knotens")
+    p_sb.set_defaults(func=cmd_startbench)
+
+    p_rb = sub.add_parser("readingbench", help="Speicher und Allokationen je Messwert: dict vs. kompakter Datensatz")
+    p_rb.add_argument("--readings", type=int, default=5000, help="Gepufferte Messwerte (vgl. max_buffer_size)")
+    p_rb.add_argument("--cycles", type=int, default=1000, help="Messzyklen für Spitze und Zeit")
+    p_rb.add_argument("--repeat", type=int, default=5, help="Wiederholungen der Zeitmessung (bester Lauf zählt)")
+    p_rb.set_defaults(func=cmd_readingbench)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except FileNotFoundError as e:
+        print(f"FEHLER: Datei nicht gefunden: {e.filename}", file=sys.stderr)
+        return 1
+    except (ValueError, OSError) as e:
+        print(f"FEHLER: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
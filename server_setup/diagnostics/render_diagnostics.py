@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+render_diagnostics - Diagnoseberichte der Sensor-Nodes lesbar machen
+
+Ein Node misst auf Abruf (PROFILE_START über das Kommando-Topic, siehe
+sensor_node/frost_profiler.py) und sendet das Ergebnis komprimiert an
+frostsystem/<device_id>/diagnostics. Dieses Skript läuft auf dem Server und
+braucht nur die Standardbibliothek (paho-mqtt nur für --listen).
+
+Messung anstoßen und Bericht abholen:
+    mosquitto_pub -t frostsystem/<device_id>/cmd \\
+        -m '{"command": "PROFILE_START", "params": {"kind": "cpu", "duration": 60}}'
+    python3 render_diagnostics.py --listen --broker localhost --save /var/lib/frost-diagnostics
+
+Weitere Beispiele:
+    python3 render_diagnostics.py /var/lib/frost-diagnostics/<datei>.fwd
+    python3 render_diagnostics.py bericht.fwd --sort own --top 20
+    python3 render_diagnostics.py stacks.fwd --collapsed stacks.txt   # für flamegraph.pl / speedscope
+    python3 render_diagnostics.py bericht.fwd --json
+
+Arten: cpu (cProfile im Event-Loop), memory (tracemalloc), stacks
+(Stichproben aller Threads oder einmaliger Stack-Dump).
+"""
+
+import argparse
+import json
+import os
+import sys
+import zlib
+from datetime import datetime
+
+DIAG_MAGIC = b"FWD"
+DIAG_VERSION = 1
+
+
+def decode_report(data):
+    """Nutzlast des Diagnose-Topics -> Bericht (dict), wie frost_profiler.decode_report()"""
+    if data[:3] != DIAG_MAGIC:
+        raise ValueError("Kein Diagnosebericht (Magic fehlt)")
+    if data[3] != DIAG_VERSION:
+        raise ValueError(f"Nicht unterstützte Diagnose-Version: {data[3]}")
+    return json.loads(zlib.decompress(data[4:]))
+
+
+def _size(nbytes):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(nbytes) < 1024 or unit == "MiB":
+            return f"{nbytes:.0f} {unit}" if unit == "B" else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+
+
+def _header(report):
+    lines = [f"{report['kind']} - Node {report.get('device_id', '?')} ({report.get('role', '?')}, "
+             f"PID {report.get('pid')}, Python {report.get('python')})",
+             f"Beginn {report.get('started')}, Dauer {report.get('duration_s')} s "
+             f"(angefordert {report.get('requested_s')} s, Ende: {report.get('reason')})"]
+    if report.get("params"):
+        lines.append("Parameter: " + ", ".join(f"{k}={v}" for k, v in report["params"].items()))
+    return lines
+
+
+def render_cpu(report, top, sort):
+    column = {"cumulative": 6, "own": 5, "calls": 3}[sort]
+    rows = sorted(report["functions"], key=lambda row: row[column], reverse=True)[:top]
+    lines = [f"{report['total_calls']} Aufrufe, {report['total_s']:.3f} s im Event-Loop-Thread", "",
+             f"{'Aufrufe':>10} {'eigen s':>10} {'kumul. s':>10}  Funktion"]
+    for filename, line, func, calls, primitive, own, cumulative in rows:
+        count = f"{calls}/{primitive}" if calls != primitive else str(calls)
+        where = f"{filename}:{line}" if line else filename
+        lines.append(f"{count:>10} {own:>10.4f} {cumulative:>10.4f}  {func} ({where})")
+    return lines
+
+
+def render_memory(report, top, sort):
+    lines = [f"Zuwachs während der Messung: {_size(report['current_bytes'])} in {report['blocks']} Blöcken, "
+             f"Spitze {_size(report['peak_bytes'])}"]
+    if report.get("rss_kb_start") is not None and report.get("rss_kb_end") is not None:
+        lines.append(f"RSS {report['rss_kb_start']} -> {report['rss_kb_end']} KiB")
+    lines += ["", f"{'Bytes':>12} {'Blöcke':>8}  Zeile"]
+    for filename, line, size, count in report["top"][:top]:
+        lines.append(f"{_size(size):>12} {count:>8}  {filename}:{line}")
+    for i, trace in enumerate(report.get("tracebacks", ())[:top], 1):
+        lines += ["", f"#{i}: {_size(trace['size'])} in {trace['count']} Blöcken"]
+        lines += [f"    {filename}:{line}" for filename, line in trace["frames"]]
+    return lines
+
+
+def render_stacks(report, top, sort):
+    if "stacks" not in report:  # Dump (duration 0)
+        lines = []
+        for thread in report["threads"]:
+            lines += ["", f"Thread {thread['name']} ({thread['ident']}{', daemon' if thread.get('daemon') else ''})"]
+            lines += [f"    {func} ({filename}:{line})" for filename, line, func in thread["stack"]]
+        return lines
+    samples = report["samples"]
+    lines = [f"{samples} Stichproben alle {report['params'].get('interval')} s, "
+             f"{report['distinct_stacks']} verschiedene Stacks", ""]
+    for name, count in sorted(report["threads"].items(), key=lambda item: -item[1]):
+        lines.append(f"  {name}: {count} Stichproben")
+    for stack, count in report["stacks"][:top]:
+        frames = stack.split(";")
+        share = 100.0 * count / samples if samples else 0.0
+        lines += ["", f"{share:5.1f} % ({count}) {frames[0]}"]
+        lines += [f"    {frame}" for frame in frames[1:]]
+    return lines
+
+
+RENDERERS = {"cpu": render_cpu, "memory": render_memory, "stacks": render_stacks}
+
+
+def render(report, top=30, sort="cumulative"):
+    renderer = RENDERERS.get(report.get("kind"))
+    if renderer is None:
+        return json.dumps(report, indent=2)
+    return "\n".join(_header(report) + [""] + renderer(report, top, sort))
+
+
+def write_collapsed(report, path):
+    """Stichproben im Collapsed-Format (eine Zeile je Stack: "thread;aussen;...;innen anzahl")"""
+    if report.get("kind") != "stacks" or "stacks" not in report:
+        raise ValueError("--collapsed braucht einen stacks-Bericht mit Stichproben (duration > 0)")
+    with open(path, "w") as f:
+        for stack, count in report["stacks"]:
+            f.write(f"{stack} {count}\n")
+
+
+def show(data, args):
+    report = decode_report(data)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(render(report, args.top, args.sort))
+    if args.collapsed:
+        write_collapsed(report, args.collapsed)
+        print(f"\nCollapsed Stacks nach {args.collapsed} geschrieben.", file=sys.stderr)
+    return report
+
+
+def listen(args):
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        sys.exit("--listen braucht paho-mqtt (pip install paho-mqtt)")
+
+    def on_connect(client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            print(f"Verbindung abgelehnt: {reason_code}", file=sys.stderr)
+            client.disconnect()
+            return
+        client.subscribe(args.topic, qos=1)
+        print(f"Warte auf Diagnoseberichte an {args.topic} ...", file=sys.stderr)
+
+    def on_message(client, userdata, msg):
+        device = msg.topic.split("/")[1] if msg.topic.count("/") >= 2 else "node"
+        print(f"\n=== {msg.topic} ({len(msg.payload)} Bytes) ===")
+        try:
+            report = show(msg.payload, args)
+        except (ValueError, zlib.error) as e:
+            print(f"Nicht lesbar: {e}", file=sys.stderr)
+            return
+        if args.save:
+            os.makedirs(args.save, exist_ok=True)
+            name = f"{device}_{report['kind']}_{datetime.now():%Y%m%d_%H%M%S}.fwd"
+            with open(os.path.join(args.save, name), "wb") as f:
+                f.write(msg.payload)
+            print(f"Gespeichert: {os.path.join(args.save, name)}", file=sys.stderr)
+        if args.once:
+            client.disconnect()
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5)
+    if args.username:
+        client.username_pw_set(args.username, args.password)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port)
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diagnoseberichte der Sensor-Nodes darstellen")
+    parser.add_argument("files", nargs="*", help="Gespeicherte Berichte (Nutzlast des Diagnose-Topics)")
+    parser.add_argument("--top", type=int, default=30, help="Zeilen je Tabelle")
+    parser.add_argument("--sort", choices=("cumulative", "own", "calls"), default="cumulative",
+                        help="cpu: Sortierung nach kumulierter, eigener Zeit oder Aufrufen")
+    parser.add_argument("--collapsed", help="stacks: Collapsed Stacks in diese Datei schreiben (Flamegraph)")
+    parser.add_argument("--json", action="store_true", help="Bericht als JSON ausgeben")
+    parser.add_argument("--listen", action="store_true", help="Diagnose-Topic abonnieren statt Dateien zu lesen")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--topic", default="frostsystem/+/diagnostics")
+    parser.add_argument("--save", help="--listen: empfangene Berichte in diesem Verzeichnis ablegen")
+    parser.add_argument("--once", action="store_true", help="--listen: nach dem ersten Bericht beenden")
+    args = parser.parse_args()
+
+    if args.listen:
+        listen(args)
+        return
+    if not args.files:
+        parser.error("Datei angeben oder --listen")
+    for path in args.files:
+        if len(args.files) > 1:
+            print(f"\n=== {path} ===")
+        with open(path, "rb") as f:
+            try:
+                show(f.read(), args)
+            except (ValueError, zlib.error) as e:
+                sys.exit(f"{path}: {e}")
+
+
+if __name__ == "__main__":
+    main()